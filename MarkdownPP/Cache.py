@@ -0,0 +1,448 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import pickle
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import path, stat, replace
+
+from MarkdownPP.Common import process_path, read_bytes
+from MarkdownPP.Context import current_context
+from MarkdownPP.Listing import DirectoryListing
+
+
+def replay(effect):
+    '''
+    Repeats a side effect recorded by BuildCache.effect(). Returns False if it
+    no longer gives the same result, so the expansion has to be redone.
+    '''
+    kind, args = effect[0], effect[1:]
+    if kind == 'frontmatter':
+        filename, frontmatter = args
+        current_context().frontmatter[filename] = frontmatter
+    elif kind == 'embed':
+        md_file, file_to_embed, get_abs, result = args
+        return process_path(md_file, file_to_embed, get_abs) == result
+
+
+class BuildCache:
+    """
+    Incremental build cache for the include modules.
+
+    While a module expands a directive it records everything the expansion
+    depended on: files read (with a content hash), glob patterns and
+    directory listings. Side effects that have to happen again when an
+    expansion is reused (storing frontmatter, copying embedded images) are
+    recorded as well. Dependencies of nested expansions are added to the
+    enclosing ones, so every cached expansion knows its whole include subtree.
+
+    On the next build an expansion is reused as long as none of its
+    dependencies changed, so only the subtrees with modified inputs are
+    expanded again. The cache is pickled to `filename` (when given) between
+    runs. The dependencies of everything expanded in a run are kept in `deps`.
+    """
+    VERSION = 1
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}   # key -> (deps, effects, value)
+        self.used = set()   # keys looked up or stored in this run
+        self.checked = {}   # (kind, target) -> current signature, per run
+        self.listing = DirectoryListing()   # directories listed for those
+        self.frames = []    # dependencies of the expansions being recorded
+        self.deps = {}      # (kind, target) -> signature, for the whole run
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        '''
+        Loads cache entries from disk, silently starting over on any problem
+        '''
+        if not self.filename or not path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, 'rb') as f:
+                version, entries = pickle.load(f)
+            if version == self.VERSION:
+                self.entries = entries
+        except Exception as exc:
+            logging.warning(f'Ignoring unreadable build cache {self.filename}: {exc}')
+
+    def save(self):
+        '''
+        Writes the entries used in this run to disk. Entries that were not
+        needed any more are dropped, so the cache doesn't grow forever.
+        '''
+        if not self.filename:
+            return
+        entries = {key: entry for key, entry in self.entries.items() if key in self.used}
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((self.VERSION, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(tmp, self.filename)
+
+    def begin(self):
+        '''
+        Starts a new build with the same cache, eg when watching for changes
+        '''
+        self.used = set()
+        self.recheck()
+        self.frames = []
+        self.deps = {}
+        self.hits = 0
+        self.misses = 0
+
+    # Dependencies
+    # ===
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def recheck(self):
+        '''
+        Forgets the signatures checked so far, to look at the files again
+        '''
+        self.checked = {}
+        self.listing = DirectoryListing()
+
+    def signature(self, kind, target, old=None):
+        '''
+        Returns the current signature of a dependency. Files are compared by
+        modification time and size first, their content is only hashed again
+        when those changed.
+
+        parameters:
+            kind (str): 'file', 'stat', 'glob' or 'files'
+            target: filename, glob pattern or (directory, recurse) tuple
+            old: previously recorded signature, if any
+
+        returns:
+            signature of the dependency, None if it doesn't exist
+        '''
+        if (kind, target) in self.checked:
+            return self.checked[(kind, target)]
+
+        if kind in ('file', 'stat'):
+            try:
+                st = stat(target)
+            except OSError:
+                signature = None
+            else:
+                signature = (st.st_mtime_ns, st.st_size, None)
+                if kind == 'file' and old and old[:2] == signature[:2]:
+                    signature = old
+                elif kind == 'file':
+                    try:
+                        with open(target, 'rb') as f:
+                            signature = signature[:2] + (self.digest(f.read()),)
+                    except OSError:
+                        signature = None
+                    if old and signature and old[2] == signature[2]:
+                        # Touched, but still the same content
+                        signature = old
+        elif kind == 'glob':
+            signature = tuple(sorted(self.listing.glob(target)))
+        elif kind == 'files':
+            try:
+                signature = tuple(self.listing.list_files(*target))
+            except OSError:
+                signature = None
+        else:
+            raise ValueError(f'Unknown dependency kind {kind}')
+
+        self.checked[(kind, target)] = signature
+        return signature
+
+    def depend(self, kind, target, signature):
+        '''
+        Records a dependency of the current build and of all expansions
+        being recorded.
+        '''
+        self.checked[(kind, target)] = signature
+        self.deps[(kind, target)] = signature
+        for deps, effects in self.frames:
+            deps[(kind, target)] = signature
+
+    def depend_file(self, filename, data=None, digest=None):
+        '''
+        Records a file that was read, data being its raw content (or digest
+        the digest() of it)
+        '''
+        try:
+            st = stat(filename)
+        except OSError:
+            return
+        if data is not None:
+            digest = self.digest(data)
+        self.depend('file' if digest else 'stat', filename, (st.st_mtime_ns, st.st_size, digest))
+
+    def depend_glob(self, pattern, files):
+        self.depend('glob', pattern, tuple(files))
+
+    def depend_files(self, directory, recurse, files):
+        '''
+        Records a directory listing, files being None if it doesn't exist
+        '''
+        self.depend('files', (directory, recurse), None if files is None else tuple(files))
+
+    def effect(self, *effect):
+        '''
+        Records a side effect that has to be repeated when the expansions
+        being recorded are reused, eg ('frontmatter', filename, frontmatter)
+        '''
+        for deps, effects in self.frames:
+            effects.append(effect)
+
+    # Expansions
+    # ===
+
+    @contextmanager
+    def record(self):
+        '''
+        Records the dependencies and side effects of everything run inside
+        the with block.
+        '''
+        frame = ({}, [])
+        self.frames.append(frame)
+        try:
+            yield frame
+        finally:
+            self.frames.pop()
+
+    def lookup(self, key, replay=replay):
+        '''
+        Returns the cached value for key if all its dependencies are
+        unchanged and its side effects could be repeated, None otherwise.
+
+        parameters:
+            key: the expansion's cache key
+            replay (function): called with each recorded side effect, returns
+                False if the effect no longer produces the same result
+        '''
+        self.used.add(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        deps, effects, value = entry
+        for (kind, target), signature in deps.items():
+            if self.signature(kind, target, signature) != signature:
+                return None
+        for effect in effects:
+            if replay(effect) is False:
+                return None
+
+        # Dependencies of reused expansions still belong to the enclosing ones
+        for (kind, target), signature in deps.items():
+            self.depend(kind, target, signature)
+        for effect in effects:
+            self.effect(*effect)
+        return value
+
+    def cached(self, key, compute, replay=replay):
+        '''
+        Returns the cached value for key, or computes, records and stores it.
+        Values are copied in and out of the cache so callers may modify them.
+
+        parameters:
+            key: the expansion's cache key
+            compute (function): produces the value when it isn't cached
+            replay (function): see lookup()
+        '''
+        value = self.lookup(key, replay)
+        if value is not None:
+            self.hits += 1
+            return list(value) if isinstance(value, list) else value
+
+        self.misses += 1
+        with self.record() as (deps, effects):
+            value = compute()
+        self.entries[key] = (deps, effects, list(value) if isinstance(value, list) else value)
+        return value
+
+
+class FileCache:
+    """
+    Bounded LRU cache of what was parsed out of files, eg the frontmatter
+    and body of included files, so a file included many times (or by every
+    build of a --watch session or batch) is read and parsed once.
+
+    Entries are keyed by the file's absolute path and stay valid while its
+    modification time and size are the same. A file that was touched is
+    read again, but only parsed again if its content changed. Either way the
+    file is still recorded as a dependency of the current build, and hits
+    and misses are counted in its profile.
+
+    prefetch() reads files ahead of their use on several threads. Using a
+    file prefetched by the same build doesn't check it again.
+
+    Besides the number of entries (`maxsize`), the total size of the cached
+    files can be bounded (`maxbytes`). Files larger than that aren't kept.
+
+    Cached values are shared, callers must copy them before modifying them.
+    """
+
+    def __init__(self, maxsize=256, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()    # (path, variant) -> ((mtime, size), digest, value, bytes)
+        self.bytes = 0                  # size of the cached files
+        self.lock = threading.Lock()
+        self.fresh = {}                 # key prefetched, but not used yet -> its build context
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename, parse, variant=None):
+        '''
+        Returns parse(raw) for the current raw content of filename.
+
+        parameters:
+            filename (str): the file
+            parse (function): parses the raw content (bytes) of the file
+            variant: anything else the parsed value depends on, eg the encoding
+
+        raises:
+            OSError: if the file can't be read
+        '''
+        key = (path.abspath(filename), variant)
+        context = current_context()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            # The first use of a file prefetched for this build is what
+            # reading it was, and it was just checked
+            prefetched = self.fresh.pop(key, None) is context
+
+        if prefetched:
+            signature = entry[0]
+        else:
+            st = stat(filename)
+            signature = (st.st_mtime_ns, st.st_size)
+
+        if entry is not None and entry[0] == signature:
+            if context.cache is not None:
+                context.cache.depend_file(filename, digest=entry[1])
+            self.count(context, hit=not prefetched)
+            return entry[2]
+
+        raw = read_bytes(filename)
+        digest = BuildCache.digest(raw)
+        if entry is not None and entry[1] == digest:
+            # Touched, but still the same content
+            value = entry[2]
+            self.count(context, hit=True)
+        else:
+            value = parse(raw)
+            self.count(context, hit=False)
+
+        self.store(key, signature, digest, value, size=len(raw))
+        return value
+
+    def prefetch(self, filenames, parse, variant=None, pool=None):
+        '''
+        Reads the files that aren't cached, or changed since, concurrently on
+        the threads of pool and parses them, so that get() then finds them
+        without waiting for the file system. The threads only stat and read,
+        while dependencies, hits and misses are recorded by get() when the
+        files are used. Files that can't be read or parsed are left for get()
+        to report.
+
+        parameters:
+            filenames (list): the files
+            parse (function): parses the raw content (bytes) of a file
+            variant: anything else the parsed value depends on, eg the encoding
+            pool (Executor): runs the reads, they run one by one without one
+
+        returns:
+            dict: {filename: parsed value} for the files that could be parsed
+        '''
+        keys = [(path.abspath(filename), variant) for filename in filenames]
+        loads = (pool.map if pool is not None else map)(self.load, keys)
+
+        context = current_context()
+        values = {}
+        for filename, key, (signature, raw) in zip(filenames, keys, loads):
+            entry = self.entries.get(key)
+            if raw is None:
+                if signature is not None and entry is not None:
+                    values[filename] = entry[2]
+                continue
+
+            if context.profile is not None:
+                context.profile.count(read=len(raw))
+            digest = BuildCache.digest(raw)
+            fresh = entry is None or entry[1] != digest
+            if fresh:
+                try:
+                    value = parse(raw)
+                except Exception:
+                    continue
+            else:
+                value = entry[2]
+            self.store(key, signature, digest, value, context if fresh else None, size=len(raw))
+            values[filename] = value
+        return values
+
+    def load(self, key):
+        '''
+        Reads a file for prefetch(), unless its cached entry is still valid
+
+        returns:
+            tuple: ((mtime, size) or None if the file can't be read,
+                    raw content or None if it wasn't read)
+        '''
+        try:
+            st = stat(key[0])
+            signature = (st.st_mtime_ns, st.st_size)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == signature:
+                return signature, None
+            with open(key[0], 'rb') as f:
+                return signature, f.read()
+        except OSError:
+            return None, None
+
+    def store(self, key, signature, digest, value, prefetched_for=None, size=0):
+        if self.maxbytes is not None and size > self.maxbytes:
+            # Would evict everything else, and then itself
+            return
+        with self.lock:
+            replaced = self.entries.pop(key, None)
+            if replaced is not None:
+                self.bytes -= replaced[3]
+            self.entries[key] = (signature, digest, value, size)
+            self.bytes += size
+            if prefetched_for is not None:
+                self.fresh[key] = prefetched_for
+            else:
+                self.fresh.pop(key, None)
+            while self.entries and (len(self.entries) > self.maxsize or
+                                    self.maxbytes is not None and self.bytes > self.maxbytes):
+                evicted, entry = self.entries.popitem(last=False)
+                self.bytes -= entry[3]
+                self.fresh.pop(evicted, None)
+
+    def count(self, context, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if context.profile is not None:
+            context.profile.count(hits=int(hit), misses=int(not hit))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.fresh.clear()
+            self.bytes = 0
@@ -1,11 +1,18 @@
-from os import path, mkdir
+from os import path, mkdir, stat
 from shutil import copyfile
+from io import StringIO
 import re
+from locale import getpreferredencoding
+from unicodedata import combining, east_asian_width
+
+from MarkdownPP.Context import current_context
+from MarkdownPP.Listing import DirectoryListing
 
 
 # SHARED REGULAR EXPRESSIONS
 # ===
 # Detects yaml frontmatter between `---` delimiters at the start of a Markdown file
+# (read_frontmatter finds it without matching the whole file)
 frontmatter_regex = re.compile(r"\A---(.*?)---\s*(.*?)\s*\Z", flags=re.DOTALL | re.MULTILINE)
 
 # Detects usage of "!FRONTMATTER this"
@@ -14,7 +21,7 @@ frontmatter_this_regex = re.compile(r'!FRONTMATTER\s+this,')
 # Detects !INCLUDECODE for various modules
 include_code_regex = re.compile(r"^!INCLUDECODE\s+(?:\"([^\"]+)\"|'([^']+)')"
                     r"(?:\s*\(\s*(.*)\s*\)\s*)?"
-                    r"\s*(?:,\s*(\d+|(\d*:\d*)))?\s*$")
+                    r"\s*(?:,\s*(\d+|(\d*:\d*)|(?:def|class):[\w.]+))?\s*$")
 
 # matches images embedded with <img> or ![]() methods
 embedded_image_regex = re.compile(r'^(<img |\[?!\[[\w\s=-]*?\]).*?(src=\"|\()([\w\/.-]+?)([\" #\)?])(.*)\s*?$') #^(<img |\[?!\[[\w\s=-]*?\]).*?(src="|\()([\w\/.-]+?)([" #\)?])(.*)$')
@@ -24,24 +31,59 @@ embedded_image_regex = re.compile(r'^(<img |\[?!\[[\w\s=-]*?\]).*?(src=\"|\()([\
 md_title_regex = re.compile(r"^(:?#+.*|={3,}|-{3,})$")
 # ===
 
+class context_attributes(type):
+    '''
+    Metaclass forwarding the class attributes listed in `fields` to the
+    current BuildContext, so the old class level globals keep working.
+    '''
+    def __getattr__(cls, name):
+        fields = type.__getattribute__(cls, 'fields')
+        if name in fields:
+            return getattr(current_context(), fields[name])
+        raise AttributeError(f"type object '{cls.__name__}' has no attribute '{name}'")
+
+    def __setattr__(cls, name, value):
+        if name in cls.fields:
+            setattr(current_context(), cls.fields[name], value)
+        else:
+            super().__setattr__(name, value)
+
+
 # TODO: make this class name less annoying.
-class frontmatter_storage:
-    frontmatter = {}
+class frontmatter_storage(metaclass=context_attributes):
+    # frontmatter lives in BuildContext.frontmatter
+    fields = {'frontmatter': 'frontmatter'}
+
     def __init__(self):
         self.frontmatter = {}
 
 
-class PROJECT_DIR:
+class PROJECT_DIR(metaclass=context_attributes):
+    # Compatibility shim: these are attributes of the current BuildContext,
+    # see MarkdownPP.Context
+    fields = {
+        'TOPLEVEL': 'toplevel',
+        'IMAGES_DIR': 'images_dir',
+        'FRONTMATTER_FILE': 'frontmatter_file',
+        'LOG': 'log',
+        'LOG_FILE': 'log_file',
+        'COLLECT': 'collect',
+        'INPUT_FILE': 'input_file',
+        'COPIED_FILES': 'copied_files',
+        'CACHE': 'cache',               # BuildCache for the current build, if any
+        'PROFILE': 'profile',           # Profile collecting per module statistics, if any
+        'INCLUDE_ONCE': 'include_once',
+        'INCLUDE_LIMITS': 'include_limits',
+        'URL_TIMEOUTS': 'url_timeouts',
+    }
 
-    TOPLEVEL = None
-    IMAGES_DIR = None
-    FRONTMATTER_FILE = None
-    LOG = None
-    LOG_FILE = False
-    COLLECT = False
-    INPUT_FILE = ''
-    COPIED_FILES = {}
 
+def set_toplevel(toplevel):
+    '''
+    Points the output locations of the current context (images, frontmatter
+    and log files) at the directory the report is written to.
+    '''
+    current_context().set_toplevel(toplevel)
 
 
 def process_path(md_file, file_to_embed, get_abs=True):
@@ -73,14 +115,27 @@ def process_path(md_file, file_to_embed, get_abs=True):
     if get_abs:
         return old_abs_path
     else:  
-        # Check if it has been copied before, return if so
-        if old_abs_path in PROJECT_DIR.COPIED_FILES.keys():
-            return PROJECT_DIR.COPIED_FILES[old_abs_path]
-        if not path.isdir(PROJECT_DIR.IMAGES_DIR): 
-            mkdir(PROJECT_DIR.IMAGES_DIR)
+        context = current_context()
+        # Check if it has been copied before, return if so. --watch rebuilds
+        # share the context: a file changed since it was copied is copied again
+        if old_abs_path in context.copied_files.keys():
+            new_rel_path = context.copied_files[old_abs_path]
+            new_abs_path = path.join(context.toplevel, new_rel_path)
+            if outdated_copy(old_abs_path, new_abs_path):
+                if not path.isdir(context.images_dir):
+                    mkdir(context.images_dir)
+                copyfile(old_abs_path, new_abs_path)
+                if context.profile is not None:
+                    context.profile.count(written=path.getsize(new_abs_path))
+            # Still written by this build, eg a target of its --depfile
+            if new_abs_path not in context.outputs:
+                context.outputs.append(new_abs_path)
+            return new_rel_path
+        if not path.isdir(context.images_dir): 
+            mkdir(context.images_dir)
         
         # If a file of that name exists, rename with (1), (2), (3), etc
-        new_abs_path = path.join(PROJECT_DIR.IMAGES_DIR, filename)
+        new_abs_path = path.join(context.images_dir, filename)
         new_abs_name, new_abs_ext = path.splitext(new_abs_path)
         i = 1
         while path.isfile(new_abs_path):
@@ -88,36 +143,341 @@ def process_path(md_file, file_to_embed, get_abs=True):
             i+=1
         
         new_abs_path = copyfile(old_abs_path, new_abs_path)
-        new_rel_path = path.relpath(new_abs_path, PROJECT_DIR.TOPLEVEL)
+        context.outputs.append(new_abs_path)
+        if context.profile is not None:
+            context.profile.count(written=path.getsize(new_abs_path))
+        new_rel_path = path.relpath(new_abs_path, context.toplevel)
 
-        PROJECT_DIR.COPIED_FILES[old_abs_path] = new_rel_path
+        context.copied_files[old_abs_path] = new_rel_path
 
         # Return the new relative path
         return new_rel_path
+
+
+def outdated_copy(source, copy):
+    '''
+    True if copy is missing, or source changed since it was copied
+    '''
+    try:
+        copy_stat = stat(copy)
+    except OSError:
+        return True
+    source_stat = stat(source)
+    return source_stat.st_size != copy_stat.st_size or source_stat.st_mtime_ns > copy_stat.st_mtime_ns
+
+
+def embed_path(md_file, file_to_embed, get_abs=True):
+    '''
+    process_path() for use by modules: also records the embedded file as a
+    dependency of the build, and the embed as a side effect to repeat when a
+    cached expansion containing it is reused.
+    '''
+    result = process_path(md_file, file_to_embed, get_abs)
+    context = current_context()
+    if context.cache is not None:
+        context.cache.depend_file(path.abspath(path.join(path.dirname(md_file), file_to_embed)))
+        context.cache.effect('embed', md_file, file_to_embed, get_abs, result)
+    return result
+
+
+def read_file(filename, encoding=None):
+    '''
+    Reads the lines of a text file like open(filename).readlines() does, and
+    records the file as a dependency of the build.
+
+    parameters:
+        filename (str): the file to read
+        encoding (str): text encoding, defaults to the locale's like open()
+
+    returns:
+        list: lines of the file
+    '''
+    return decode_lines(read_bytes(filename), encoding)
+
+
+def read_bytes(filename):
+    '''
+    Reads the raw content of a file, recording it as a dependency of the
+    build (and the bytes read, when profiling).
+    '''
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    context = current_context()
+    if context.cache is not None:
+        context.cache.depend_file(filename, raw)
+    if context.profile is not None:
+        context.profile.count(read=len(raw))
+    return raw
+
+
+def decode_lines(raw, encoding=None):
+    '''
+    Splits raw file content into lines, with the same universal newline
+    handling as reading in text mode
+    '''
+    if encoding is None:
+        encoding = getpreferredencoding(False)
+    return StringIO(raw.decode(encoding), newline=None).readlines()
+
+
+def read_frontmatter(lines):
+    '''
+    Finds the yaml frontmatter between `---` delimiters at the start of a
+    file, as frontmatter_regex does, but reading the lines only up to the
+    closing delimiter rather than joining and matching the whole file.
+
+    parameters:
+        lines (list): lines of the file
+
+    returns:
+        tuple: (frontmatter as a string, index of the line after the closing
+                delimiter, rest of the line after the closing delimiter),
+               or (None, 0, '') if the file has no frontmatter
+    '''
+    if not lines or not lines[0].startswith('---'):
+        return None, 0, ''
+
+    # The closing delimiter may even be on the opening line
+    header = [lines[0][3:]]
+    end = header[0].find('---')
+    if end >= 0:
+        return header[0][:end], 1, header[0][end + 3:]
+    for linenum in range(1, len(lines)):
+        line = lines[linenum]
+        end = line.find('---')
+        if end >= 0:
+            header.append(line[:end])
+            return ''.join(header), linenum + 1, line[end + 3:]
+        header.append(line)
+    return None, 0, ''
+
+
+def frontmatter_body(lines, start, rest=''):
+    '''
+    Returns the lines of a file after its frontmatter (see read_frontmatter),
+    without the blank lines around them or whitespace at either end, as
+    frontmatter_regex gave them
+    '''
+    end = len(lines)
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    if rest.strip():
+        # Text right after the closing delimiter starts the body
+        body = [rest] + lines[start:end]
+    else:
+        while start < end and not lines[start].strip():
+            start += 1
+        body = lines[start:end]
+    if not body:
+        return ['\n']
+
+    body[0] = body[0].lstrip()
+    body[-1] = body[-1].rstrip() + '\n'
+    return body
+
+
+def load_yaml(text):
+    '''
+    yaml.safe_load(), importing PyYAML on first use as it is slow to import
+    '''
+    import yaml
+    return yaml.safe_load(text)
+
+
+def list_files(directory, recurse=False):
+    '''
+    Lists the files in a directory (and its subdirectories if recurse is set)
+    in the order !INCLUDEDIR includes them.
+
+    parameters:
+        directory (str): absolute path to the directory
+        recurse (bool): include files in subdirectories
+
+    returns:
+        list: absolute paths of the files
+    '''
+    return DirectoryListing().list_files(directory, recurse)
     
 
-def markdown_table(data, first_row_header=False):
+def markdown_table(data, first_row_header=False, align=True):
     '''
-    The filthy cheater's way to get really nice markdown tables from any input.
-    Requires pandas and tabulate (available through pip)
+    Renders data as a pipe table, cell for cell what pandas' to_markdown
+    (ie. tabulate) used to make of it: number columns are right aligned,
+    floats on their decimal point, everything else is left aligned, and
+    list cells become html bullet lists. Missing keys and None values are
+    blank cells (pandas printed them as nan), and booleans are True and
+    False even in a column with blank cells (which pandas right aligned as
+    1 and 0).
 
     parameters:
-        data (list): list of dictionaries
+        data (list): list of dictionaries, or of tuples if first_row_header
+        first_row_header (bool): take the column names from the first row
+        align (bool): pad the columns to equal width. Without it, rows are
+                      rendered as they come, in a single pass
 
     return:
         list: markdown table of data, as a list of lines, ready for Transform
     '''
-    from pandas import DataFrame
+    if first_row_header:
+        header, rows = data[0], data[1:]
+    else:
+        header = list(dict.fromkeys(key for row in data for key in row))
+        rows = ([row.get(key) for key in header] for row in data)
+
+    return list(table_lines(header, rows, align))
+
+
+def table_lines(header, rows, align=True):
+    '''
+    Generates the lines of a pipe table with the given column names and rows
+    (sequences of cell values). See markdown_table.
+    '''
+    header = [str(name) for name in header]
 
-    # Create a dataframe, then apply a lambda to each cell such that list type cells are converted to bullet points in html
-    df = DataFrame(data).applymap(lambda x: '<ul><li>'+'</li><li>'.join(x)+'</li></ul>' if isinstance(x, list) else x)
+    if not align:
+        yield '| ' + ' | '.join(header) + ' |\n'
+        yield '|' + '|'.join('---' for _ in header) + '|\n'
+        for row in rows:
+            yield '| ' + ' | '.join(table_text(table_format(table_cell(value), TABLE_STR).strip()) for value in row) + ' |\n'
+        return
 
-    if first_row_header:
-        new_header = df.iloc[0] #grab the first row for the header
-        df = df[1:] #take the data less the header row
-        df.columns = new_header #set the header row as the df header
+    # One pass over the rows finds the type of each column, which decides
+    # how its cells are formatted and aligned
+    columns = [[] for _ in header]
+    types = [TABLE_BOOL] * len(header)
+    for row in rows:
+        for i, value in enumerate(row):
+            value = table_cell(value)
+            columns[i].append(value)
+            types[i] = max(types[i], table_type(value))
+
+    right = [t in (TABLE_INT, TABLE_FLOAT) for t in types]
+    widths = []
+    for i, cells in enumerate(columns):
+        cells = [table_format(value, types[i]) for value in cells]
+        if right[i]:
+            # line the numbers up on their decimal points
+            points = [afterpoint(cell) for cell in cells]
+            decimals = max(points, default=-1)
+            cells = [cell + ' ' * (decimals - point) for cell, point in zip(cells, points)]
+        else:
+            cells = [cell.strip() for cell in cells]
+        columns[i] = cells = [table_text(cell) for cell in cells]
+        widths.append(max([text_width(header[i]) + 2] + [text_width(cell) for cell in cells]))
+
+    def line(cells):
+        return '| ' + ' | '.join(pad(cell, width, r) for cell, width, r in zip(cells, widths, right)) + ' |\n'
+
+    yield line(header)
+    if not any(columns):
+        # tabulate leaves the alignment out of tables without rows
+        yield '|' + '|'.join('-' * (width + 2) for width in widths) + '|\n'
+        return
+    yield '|' + '|'.join('-' * (width + 1) + ':' if r else ':' + '-' * (width + 1)
+                         for width, r in zip(widths, right)) + '|\n'
+    for cells in zip(*columns):
+        yield line(cells)
+
+
+# Column types of a table, from the least to the most generic. A column
+# takes the most generic type of its cells
+TABLE_NONE, TABLE_BOOL, TABLE_INT, TABLE_FLOAT, TABLE_STR = range(5)
+
+# Numbers like 1,000 or -12,345.6
+thousands_regex = re.compile(r"^(([+-]?[0-9]{1,3})(?:,([0-9]{3}))*)?(?(1)\.[0-9]*|\.[0-9]+)?$")
 
-    table = df.to_markdown(index=False, tablefmt="pipe")
 
-    return [l+'\n' for l in table.split('\n') if l]
+def table_cell(value):
+    '''
+    Lists become html bullet lists, anything else is kept as is
+    '''
+    if isinstance(value, list):
+        return '<ul><li>' + '</li><li>'.join(map(str, value)) + '</li></ul>'
+    return value
+
+
+def table_type(value):
+    '''
+    The type of a table cell. Strings that look like numbers count as
+    numbers, and empty cells don't affect the type of their column.
+    '''
+    if value is None or value == '':
+        return TABLE_NONE
+    if hasattr(value, 'isoformat'):     # dates and times
+        return TABLE_STR
+    if isinstance(value, bool) or value in ('True', 'False'):
+        return TABLE_BOOL
+    if isinstance(value, int):
+        return TABLE_INT
+    if isinstance(value, float):
+        return TABLE_FLOAT
+    if not isinstance(value, str):
+        return TABLE_STR
+    # numbers (including inf and nan) can't start with anything else
+    first = value[0]
+    if not (first.isdecimal() or first.isspace() or first in '+-.iInN'):
+        return TABLE_STR
+    try:
+        int(value)
+        return TABLE_INT
+    except ValueError:
+        pass
+    if thousands_regex.match(value):
+        return TABLE_FLOAT if '.' in value else TABLE_INT
+    try:
+        number = float(value)
+    except ValueError:
+        return TABLE_STR
+    # '1e999' overflows to inf, which doesn't make it a number
+    if number in (float('inf'), float('-inf')) or number != number:
+        return TABLE_FLOAT if value.lower() in ('inf', '-inf', 'nan') else TABLE_STR
+    return TABLE_FLOAT
+
+
+def table_format(value, column_type):
+    '''
+    Formats a cell for a column of column_type
+    '''
+    if value is None:
+        return ''
+    if column_type == TABLE_FLOAT and value != '':
+        try:
+            return format(float(value.replace(',', '') if isinstance(value, str) else value), 'g')
+        except (ValueError, TypeError):
+            pass
+    return f'{value}'
+
+
+def table_text(text):
+    '''
+    Line breaks would end the table row, html ones don't
+    '''
+    return str(text).replace('\r\n', '<br>').replace('\n', '<br>')
+
+
+def afterpoint(text):
+    '''
+    Number of characters after the decimal point (or exponent) of a number,
+    -1 for integers and anything else
+    '''
+    if table_type(text) != TABLE_FLOAT:
+        return -1
+    position = text.rfind('.')
+    if position < 0:
+        position = text.lower().rfind('e')
+    return len(text) - position - 1 if position >= 0 else -1
+
+
+def text_width(text):
+    '''
+    Columns text takes up in a monospace font: wide east asian characters
+    take two, combining characters none
+    '''
+    if text.isascii():
+        return len(text)
+    return sum(0 if combining(c) else 2 if east_asian_width(c) in 'WF' else 1 for c in text)
+
 
+def pad(text, width, right=False):
+    padding = ' ' * (width - text_width(text))
+    return padding + text if right else text + padding
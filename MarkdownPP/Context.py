@@ -0,0 +1,100 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import path
+
+from MarkdownPP.Listing import DirectoryListing
+
+
+class BuildContext:
+    """
+    Everything a single build needs besides the document itself: where the
+    input lives, where the report and its files go, the cache and profile in
+    use, and the state collected while processing (frontmatter of included
+    files, images copied to the collection directory or rendered).
+
+    MarkdownPP creates one per run, hands it to the Processor and every
+    module (as `module.context`) and makes it the current context while the
+    run lasts, so helpers in Common find it through current_context().
+    Separate builds never share state, so several can run at the same time
+    in threads, and nothing accumulates from one render to the next.
+
+    The old PROJECT_DIR and frontmatter_storage class attributes still work:
+    they read and write the current context, which outside of a run is a
+    process wide default that new builds take their configuration from.
+    """
+
+    # Configuration a new build inherits, see copy()
+    CONFIG = ('input_file', 'toplevel', 'images_dir', 'frontmatter_file', 'log', 'log_file',
+              'collect', 'cache', 'profile', 'include_once', 'include_limits',
+              'url_timeouts')
+
+    def __init__(self, input_file='', toplevel=None, images_dir=None, frontmatter_file=None,
+                 log=None, log_file=False, collect=False, cache=None, profile=None,
+                 include_once=False, include_limits=None, url_timeouts=None):
+        self.input_file = input_file
+        self.toplevel = toplevel
+        self.images_dir = images_dir
+        self.frontmatter_file = frontmatter_file
+        self.log = log
+        self.log_file = log_file
+        self.collect = collect
+        self.cache = cache              # BuildCache for the build, if any
+        self.profile = profile          # Profile collecting per module statistics, if any
+        self.include_once = include_once        # expand files included several times only once
+        self.include_limits = include_limits    # {'depth', 'lines' or 'bytes': limit}, see Include.limits
+        self.url_timeouts = url_timeouts        # {'request' or 'total': seconds}, see IncludeURL.timeouts
+
+        self.copied_files = {}          # embedded file -> path of its copy in images_dir
+        self.frontmatter = {}           # file or url -> its yaml frontmatter
+        self.listing = DirectoryListing()   # directories listed by the build
+        self.outputs = []               # files written besides the report (images copied or rendered)
+
+    def copy(self):
+        '''
+        Returns a context with the same configuration and none of the state
+        collected by this one
+        '''
+        return BuildContext(**{name: getattr(self, name) for name in self.CONFIG})
+
+    def set_toplevel(self, toplevel):
+        '''
+        Points the output locations (images, frontmatter and log files) at
+        the directory the report is written to.
+        '''
+        self.toplevel = toplevel
+        self.images_dir = path.join(toplevel, 'images')
+        self.frontmatter_file = path.join(toplevel, 'frontmatter.yaml')
+        self.log_file = path.join(toplevel, 'debug.log')
+
+    @contextmanager
+    def activate(self):
+        '''
+        Makes this the current context for the with block, in the current
+        thread (or asyncio task) only.
+        '''
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+# Used outside of a build, and configured through the PROJECT_DIR shim
+default_context = BuildContext()
+
+_current = ContextVar('MarkdownPP_build_context', default=None)
+
+
+def current_context():
+    '''
+    Returns the context of the build running in this thread, or the process
+    wide default one outside of a build.
+    '''
+    return _current.get() or default_context
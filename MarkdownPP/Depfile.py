@@ -0,0 +1,99 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+
+from os import path
+
+from MarkdownPP.Watch import atomic_output
+
+
+def dependencies(deps):
+    '''
+    The files and directories a build depended on: the files it read
+    (inputs, includes, included code, embedded images), the files glob
+    patterns matched, and the directories glob patterns were matched in and
+    !INCLUDEDIR listed, so that adding a file to them makes the report out
+    of date. What didn't exist is left out.
+
+    parameters:
+        deps (dict): {(kind, target): signature} as collected in BuildCache.deps
+
+    returns:
+        list: absolute paths, sorted
+    '''
+    found = set()
+    for (kind, target), signature in deps.items():
+        if signature is None:
+            continue
+        if kind in ('file', 'stat'):
+            found.add(path.abspath(target))
+        elif kind == 'glob':
+            found.update(path.abspath(name) for name in signature)
+            if glob.has_magic(target):
+                found.update(path.abspath(name) for name in glob_directories(target))
+        elif kind == 'files':
+            directory, recurse = target
+            found.add(path.abspath(directory))
+            if recurse:
+                found.update(path.dirname(path.abspath(name)) for name in signature)
+    return sorted(found)
+
+
+def glob_directories(pattern):
+    '''
+    The directories a glob pattern is matched against: the one its last
+    part is matched in, and those its other magic parts are, eg "a" and
+    every "a/*" for "a/*/b*.md"
+    '''
+    directory = path.dirname(pattern)
+    if not glob.has_magic(directory):
+        return [directory or path.curdir] if path.isdir(directory or path.curdir) else []
+    return glob_directories(directory) + [name for name in glob.glob(directory) if path.isdir(name)]
+
+
+def display(filename):
+    '''
+    Paths below the current directory are written relative to it, like the
+    build system would name them, others are absolute
+    '''
+    relative = path.relpath(filename)
+    return filename if relative.startswith(path.pardir) else relative
+
+
+def escape(filename):
+    '''
+    Escapes a path for a make rule
+    '''
+    return filename.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+def depfile_lines(targets, prerequisites):
+    '''
+    Generates a make style dependency rule, followed by an empty rule for
+    each prerequisite (like `gcc -MP`) so make doesn't stop when one of
+    them is removed.
+
+    parameters:
+        targets (list): the report, and other files the build wrote
+        prerequisites (list): the files and directories it depended on
+    '''
+    targets = [escape(display(name)) for name in dict.fromkeys(targets)]
+    prerequisites = [escape(display(name)) for name in prerequisites]
+
+    yield ' '.join(targets) + ':' + ''.join(f' \\\n  {name}' for name in prerequisites) + '\n'
+    for name in prerequisites:
+        yield f'\n{name}:\n'
+
+
+def write_depfile(filename, targets, prerequisites):
+    '''
+    Writes the dependency rule of a build to filename (see depfile_lines),
+    replacing it atomically
+    '''
+    with atomic_output(filename, encoding='utf-8') as f:
+        f.writelines(depfile_lines(targets, prerequisites))
@@ -0,0 +1,145 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import threading
+
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from urllib.request import getproxies, proxy_bypass, urlopen
+
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class ConnectionPool:
+    """
+    HTTP(S) connections of a build, kept alive and reused by the threads
+    fetching its URLs: a thread takes an idle connection to the host, or
+    opens one, and puts it back once the response is read. Servers closing
+    the connection after a response (HTTP/1.0, "Connection: close") get a
+    new one each time.
+
+    URLs of other schemes, and those the environment sends through a proxy
+    (http_proxy, https_proxy), are fetched with urllib's urlopen instead.
+    """
+
+    # Redirects followed before giving up, like urllib
+    max_redirects = 10
+
+    def __init__(self, timeout=None, maxsize=8):
+        self.timeout = timeout          # seconds a connection waits for the server, None to wait forever
+        self.maxsize = maxsize          # idle connections kept per host
+        self.idle = {}                  # (scheme, host, port) -> [connection, ...]
+        self.lock = threading.Lock()
+        self.proxies = getproxies()
+        self.opened = 0                 # connections opened
+        self.requests = 0               # requests sent on them
+        self.headers = {'User-Agent': 'Python-urllib/%d.%d' % sys.version_info[:2]}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def get(self, url):
+        '''
+        Fetches url, following redirects
+
+        returns:
+            bytes: the body of the response
+
+        raises:
+            HTTPError: if the server answers with an error status
+            OSError: if the server can't be reached or doesn't answer in time
+        '''
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or self.proxied(parts):
+                with urlopen(url, timeout=self.timeout) as response:
+                    return response.read()
+
+            if not parts.hostname:
+                raise URLError('no host given')
+            target = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            response, body = self.request((parts.scheme, parts.hostname, parts.port), target)
+            location = response.getheader('Location')
+            if response.status in REDIRECTS and location:
+                url = urljoin(url, location)
+                continue
+            if response.status >= 400:
+                raise HTTPError(url, response.status, response.reason, response.headers, None)
+            return body
+        raise HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+    def proxied(self, parts):
+        return parts.scheme in self.proxies and not proxy_bypass(parts.hostname or '')
+
+    def request(self, key, target):
+        '''
+        Sends a GET request for target to the host of key on a pooled
+        connection. A connection the server closed while it was idle is
+        replaced, and the request sent again, once.
+
+        returns:
+            tuple: (http.client.HTTPResponse, its body)
+        '''
+        for attempt in (0, 1):
+            connection, reused = self.connection(key)
+            try:
+                connection.request('GET', target, headers=self.headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (ConnectionResetError, BrokenPipeError):
+                # RemoteDisconnected is a ConnectionResetError
+                connection.close()
+                if reused and not attempt:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            with self.lock:
+                self.requests += 1
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(key, connection)
+            return response, body
+
+    def connection(self, key):
+        '''
+        Takes an idle connection to the host of key, or opens a new one
+
+        returns:
+            tuple: (connection, whether it was used before)
+        '''
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+            self.opened += 1
+        scheme, host, port = key
+        factory = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return factory(host, port, timeout=self.timeout), False
+
+    def release(self, key, connection):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(connection)
+                return
+        connection.close()
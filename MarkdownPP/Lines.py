@@ -0,0 +1,87 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import mmap
+
+from array import array
+from bisect import bisect_right
+from os import stat
+
+
+class LineIndex:
+    """
+    Sparse index of where the lines of a (large) file start, so a range of
+    lines is read without reading the lines before it. The file is scanned
+    once, through a memory map, counting the newlines of each BLOCK bytes:
+    `counts[i]` is the number of lines before byte i * BLOCK. Finding line n
+    then takes a binary search of the counts and walking the newlines of a
+    single block, and reading lines n to m only touches the pages they are
+    on.
+
+    Lines end with "\\n" (or "\\r\\n"). Files ending lines with a lone "\\r",
+    which Python's universal newlines also split on, or in an encoding
+    where "\\n" isn't a single byte, are not `usable`, and have to be read in
+    full. The index describes the file as it was when built, see
+    `signature`.
+    """
+
+    BLOCK = 1 << 16
+
+    def __init__(self, filename):
+        self.filename = filename
+        st = stat(filename)
+        self.signature = (st.st_mtime_ns, st.st_size)
+        self.size = st.st_size
+        self.counts = array('Q', [0])
+        self.usable = True
+        self.lines = 0
+
+        if self.size:
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.scan(mm)
+
+    def scan(self, mm):
+        lines = 0
+        for start in range(0, self.size, self.BLOCK):
+            block = mm[start:start + self.BLOCK]
+            lines += block.count(b'\n')
+            self.counts.append(lines)
+            if b'\r' in block:
+                crlf = block.count(b'\r\n') + (block.endswith(b'\r') and mm[start + self.BLOCK:start + self.BLOCK + 1] == b'\n')
+                if block.count(b'\r') != crlf:
+                    self.usable = False
+        # The last line may not end with a newline
+        self.lines = lines + (mm[self.size - 1:self.size] != b'\n')
+
+    def offset(self, mm, linenum):
+        '''
+        Byte offset of the start of a line (counting from 0), the end of the
+        file for linenum == self.lines
+        '''
+        if linenum <= 0:
+            return 0
+        if linenum >= self.lines:
+            return self.size
+        # The block holding the newline ending the line before
+        block = bisect_right(self.counts, linenum - 1) - 1
+        position = block * self.BLOCK
+        for _ in range(linenum - self.counts[block]):
+            position = mm.find(b'\n', position) + 1
+        return position
+
+    def read(self, start, end):
+        '''
+        Reads lines start to end (not included, counting from 0) of the file
+
+        returns:
+            bytes: the lines, as they are in the file
+        '''
+        start, end = max(0, start), min(end, self.lines)
+        if start >= end:
+            return b''
+        with open(self.filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[self.offset(mm, start):self.offset(mm, end)]
@@ -0,0 +1,232 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import fnmatch
+import glob
+
+from os import path, scandir
+
+
+# Patterns of files and directories traversals leave out, one per line,
+# applying to the directory the file is in and everything below it
+IGNORE_FILE = '.mdppignore'
+
+
+class DirectoryListing:
+    """
+    Directory listings for a single build, read once with os.scandir and
+    reused by every glob pattern (`!INCLUDE "findings/*.md"`) and directory
+    include (`!INCLUDEDIR`) of the build. The type of each entry comes with
+    the listing, so telling files from directories needs no extra stat.
+
+    Traversals skip what the .mdppignore files of the directories they go
+    through (or of any directory above them) ignore: fnmatch patterns
+    matched against entry names, or against paths relative to the
+    .mdppignore's directory when they contain a "/". A trailing "/" makes a
+    pattern match directories only. Ignored directories are pruned along
+    with everything in them. Paths given literally are never ignored.
+
+    Every BuildContext has its own (`context.listing`), so a build sees the
+    directories as they were when it first looked, and the next build looks
+    again.
+    """
+
+    def __init__(self):
+        self.listings = {}          # absolute directory -> [(name, is_dir, is_file, is_symlink), ...] or OSError
+        self.patterns = {}          # absolute directory -> [(directory of the .mdppignore, pattern), ...]
+        self.names = {}             # (directory, dironly, hidden) -> names patterns may match
+        self.globs = {}             # glob pattern -> its matches
+        self.scanned = 0            # directories read from the file system
+
+    def entries(self, directory):
+        '''
+        Lists a directory in os.scandir order, leaving out ignored entries
+
+        returns:
+            list: (name, is_dir, is_file, is_symlink) tuples
+
+        raises:
+            OSError: if the directory can't be listed
+        '''
+        directory = path.abspath(directory)
+        listing = self.listings.get(directory)
+        if listing is None:
+            try:
+                listing = self.scan(directory)
+            except OSError as exc:
+                listing = exc
+            self.listings[directory] = listing
+        if isinstance(listing, OSError):
+            raise listing
+        return listing
+
+    def scan(self, directory):
+        self.scanned += 1
+        patterns = self.ignores(directory)
+        listing = []
+        with scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    is_file = entry.is_file()
+                    is_symlink = entry.is_symlink()
+                except OSError:
+                    is_dir = is_file = is_symlink = False
+                if entry.name == IGNORE_FILE or patterns and self.ignored(directory, entry.name, is_dir, patterns):
+                    continue
+                listing.append((entry.name, is_dir, is_file, is_symlink))
+        return listing
+
+    def ignores(self, directory):
+        '''
+        Returns the ignore patterns applying to the entries of directory: its
+        own .mdppignore's and those of the directories above it
+        '''
+        patterns = self.patterns.get(directory)
+        if patterns is None:
+            parent = path.dirname(directory)
+            patterns = list(self.ignores(parent)) if parent != directory else []
+            try:
+                with open(path.join(directory, IGNORE_FILE), encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line and not line.startswith('#'):
+                            patterns.append((directory, line))
+            except OSError:
+                pass
+            self.patterns[directory] = patterns
+        return patterns
+
+    @staticmethod
+    def ignored(directory, name, is_dir, patterns):
+        for base, pattern in patterns:
+            if pattern.endswith('/'):
+                if not is_dir:
+                    continue
+                pattern = pattern.rstrip('/')
+            if '/' in pattern:
+                target = path.relpath(path.join(directory, name), base).replace(path.sep, '/')
+                if fnmatch.fnmatchcase(target, pattern.lstrip('/')):
+                    return True
+            elif fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def glob(self, pattern):
+        '''
+        glob.glob(pattern), matching against the cached listings. Like
+        glob.glob, results are unsorted and "*" doesn't match names starting
+        with a dot unless the pattern does.
+        '''
+        matches = self.globs.get(pattern)
+        if matches is None:
+            matches = self.globs[pattern] = list(self.iglob(pattern, False))
+        return list(matches)
+
+    def iglob(self, pattern, dironly):
+        dirname, basename = path.split(pattern)
+        if not glob.has_magic(pattern):
+            if basename:
+                exists = path.isdir(pattern) if dironly else path.lexists(pattern)
+            else:
+                # Patterns ending with a slash only match directories
+                exists = path.isdir(dirname)
+            if exists:
+                yield pattern
+            return
+
+        if not dirname:
+            yield from self.match(dirname, basename, dironly)
+            return
+
+        if dirname != pattern and glob.has_magic(dirname):
+            dirs = self.iglob(dirname, True)
+        else:
+            dirs = [dirname]
+
+        for directory in dirs:
+            if glob.has_magic(basename):
+                names = self.match(directory, basename, dironly)
+            elif basename:
+                # Under a pattern, so not given literally: looked up in the listing
+                names = self.lookup(directory, basename, dironly)
+            else:
+                names = [basename] if path.isdir(directory) else []
+            for name in names:
+                yield path.join(directory, name)
+
+    def match(self, directory, pattern, dironly):
+        '''
+        Names in directory matching a single path component pattern
+        '''
+        hidden = pattern.startswith('.')
+        key = (directory, dironly, hidden)
+        names = self.names.get(key)
+        if names is None:
+            try:
+                entries = self.entries(directory or '.')
+            except OSError:
+                entries = []
+            names = self.names[key] = [name for name, is_dir, is_file, is_symlink in entries
+                                       if (is_dir or not dironly) and (hidden or not name.startswith('.'))]
+        return fnmatch.filter(names, pattern)
+
+    def lookup(self, directory, name, dironly):
+        '''
+        [name] if directory lists it, [] otherwise
+        '''
+        try:
+            entries = self.entries(directory)
+        except OSError:
+            return []
+        for entry, is_dir, is_file, is_symlink in entries:
+            if entry == name and (is_dir or not dironly):
+                return [name]
+        return []
+
+    def walk(self, directory):
+        '''
+        os.walk(directory) without following symbolic links to directories
+
+        yields:
+            tuple: (directory, names of the files in it) for the directory and
+                   each of its subdirectories, top down
+        '''
+        try:
+            entries = self.entries(directory)
+        except OSError:
+            return
+        yield directory, [name for name, is_dir, is_file, is_symlink in entries if not is_dir]
+        for name, is_dir, is_file, is_symlink in entries:
+            if is_dir and not is_symlink:
+                yield from self.walk(path.join(directory, name))
+
+    def list_files(self, directory, recurse=False):
+        '''
+        Lists the files in a directory (and its subdirectories if recurse is
+        set) in the order !INCLUDEDIR includes them, see Common.list_files
+        '''
+        return list(self.iter_files(directory, recurse))
+
+    def iter_files(self, directory, recurse=False):
+        '''
+        Generator version of list_files(), listing each subdirectory only
+        once the files before it were taken
+
+        raises:
+            FileNotFoundError: (on the first step) if the directory doesn't exist
+        '''
+        if recurse:
+            if not path.isdir(directory):
+                raise FileNotFoundError(directory)
+            for root, files in self.walk(directory):
+                for name in sorted(files):
+                    yield path.join(root, name)
+        else:
+            directory = path.abspath(directory)
+            yield from sorted(path.join(directory, name) for name, is_dir, is_file, is_symlink in self.entries(directory)
+                              if is_file)
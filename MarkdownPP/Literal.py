@@ -0,0 +1,193 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+
+from MarkdownPP.Transform import TransformBatch
+
+
+# Kinds of lines. Everything but PROSE is literal, and left alone by modules
+PROSE, FENCE, FENCED, INDENTED = range(4)
+
+# What the line before tells about the next one, when not in a fenced code
+# block (those states are (fence character, length, blockquote depth,
+# indentation) tuples)
+TEXT, BLANK, LIST, LIST_BLANK, CODE = range(5)
+
+# Blockquote markers in front of a line, eg "> > "
+quotere = re.compile(r"(?: {0,3}> ?)*")
+
+# Opening code fence: ``` (without backticks in the info string) or ~~~
+openre = re.compile(r"( *)(`{3,}(?=[^`]*$)|~{3,})")
+
+# Closing code fence, with nothing after it
+closere = re.compile(r"( *)(`{3,}|~{3,})[ \t]*$")
+
+# Indented code, or list item content
+indentre = re.compile(r" {0,3}\t| {4}")
+
+# Bullet or numbered list item
+listre = re.compile(r" {0,3}(?:[-*+]|\d{1,9}[.)])(?:[ \t]|$)")
+
+# Lines starting with anything else are plain text
+SPECIAL = ' \t\r\n>`~-*+0123456789'
+
+
+def step(line, state):
+    '''
+    Classifies a single line, given the state the previous line left.
+
+    returns:
+        tuple: (kind of the line, state after it)
+    '''
+    first = line[:1]
+
+    if type(state) is tuple:
+        char, length, depth, indent = state
+        rest = line
+        if depth:
+            quote = quotere.match(line)
+            if quote.group().count('>') < depth:
+                # The blockquote ended, and the fenced code in it
+                return step(line, TEXT)
+            rest = line[quote.end():]
+        elif first not in SPECIAL:
+            return FENCED, state
+        fence = closere.match(rest)
+        if fence and fence.group(2)[0] == char and len(fence.group(2)) >= length \
+                and len(fence.group(1)) <= indent + 3:
+            return FENCE, BLANK
+        return FENCED, state
+
+    if first not in SPECIAL and not first.isspace():
+        return PROSE, LIST if state == LIST else TEXT
+
+    if not line.strip():
+        return PROSE, BLANK if state == TEXT else LIST_BLANK if state == LIST else state
+
+    indented = indentre.match(line)
+    if indented:
+        if state == BLANK or state == CODE:
+            return INDENTED, CODE
+        if state == TEXT:
+            # continues a paragraph
+            return PROSE, TEXT
+
+    quote = quotere.match(line)
+    rest = line[quote.end():]
+    fence = openre.match(rest)
+    # Fences in list items may be indented as deep as the item's content
+    if fence and (len(fence.group(1)) <= 3 or state == LIST or state == LIST_BLANK):
+        marker = fence.group(2)
+        return FENCE, (marker[0], len(marker), quote.group().count('>'), len(fence.group(1)))
+
+    if indented or listre.match(rest):
+        return PROSE, LIST
+    return PROSE, LIST if state == LIST else TEXT
+
+
+def classify(line, state):
+    '''
+    Same as step(), for an element of the document that may hold several
+    lines (eg the code block !INCLUDECODE inserts). The element is of the
+    kind of its first line, and the state is the one its last line left.
+    '''
+    newline = line.find('\n')
+    if newline < 0 or newline == len(line) - 1:
+        return step(line, state)
+
+    kind, state = step(line[:newline + 1], state)
+    for part in line[newline + 1:].splitlines(True):
+        state = step(part, state)[1]
+    return kind, state
+
+
+class LiteralIndex:
+    """
+    Which lines of a document are literal: code fences (``` or ~~~, also in
+    blockquotes and list items), the code between them and indented code
+    blocks. Modules leave those lines alone, since tags and headers in them
+    are examples rather than instructions.
+
+    The Processor builds the index once per document and hands it to the
+    Scanner and to every module (as `module.literals`). index[linenum] is the
+    kind of a line (PROSE, FENCE, FENCED or INDENTED), and literal(linenum)
+    whether it is anything but prose, both in constant time. After each
+    module's transforms, update() reclassifies only the lines from the first
+    transformed one up to where the document is back in the state it was,
+    rather than the whole document.
+    """
+
+    def __init__(self, lines=()):
+        self.lines = lines
+        self.kinds = bytearray()
+        self.states = []            # state after each line
+
+        state = BLANK
+        for line in lines:
+            kind, state = classify(line, state)
+            self.kinds.append(kind)
+            self.states.append(state)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, linenum):
+        return self.kinds[linenum]
+
+    def literal(self, linenum):
+        return self.kinds[linenum] != PROSE
+
+    def regions(self):
+        '''
+        returns:
+            list: (start, end) line ranges of the literal parts of the document
+        '''
+        return [match.span() for match in re.finditer(rb'[^\x00]+', self.kinds)]
+
+    def update(self, lines, transforms):
+        '''
+        Brings the index up to date with lines, the result of applying
+        transforms (see apply_transforms) to the lines it indexed.
+
+        returns:
+            LiteralIndex: self
+        '''
+        if isinstance(transforms, TransformBatch):
+            linenums = transforms.linenums
+        else:
+            linenums = [transform.linenum for transform in transforms]
+
+        self.lines = lines
+        if not linenums:
+            return self
+
+        size = len(self.kinds)
+        linenums = [min(max(linenum, 0), size) for linenum in linenums]
+        first, last = min(linenums), max(linenums)
+        # Lines past the last transformed one are untouched, except for
+        # those the transforms on it borrowed (see apply_transforms)
+        tail = min(size, last + 1 + linenums.count(last))
+        shift = len(lines) - size
+
+        kinds = bytearray()
+        states = []
+        state = self.states[first - 1] if first else BLANK
+        end = len(lines)
+        for linenum in range(first, len(lines)):
+            old = linenum - shift
+            if old >= tail and state == (self.states[old - 1] if old else BLANK):
+                # The rest classifies as it did
+                end = linenum
+                break
+            kind, state = classify(lines[linenum], state)
+            kinds.append(kind)
+            states.append(state)
+
+        self.kinds[first:end - shift] = kinds
+        self.states[first:end - shift] = states
+        return self
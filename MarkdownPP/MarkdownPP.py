@@ -6,7 +6,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from MarkdownPP import Modules
-from MarkdownPP.Common import PROJECT_DIR, frontmatter_storage
+from MarkdownPP.Context import current_context
 from .Processor import Processor
 
 import sys
@@ -19,23 +19,43 @@ class MarkdownPP:
     Simplified front-end interface for the Processor and Module systems.
     Takes input and output file names or objects, and a list of module names.
     Automatically executes the preprocessor with the requested modules.
+
+    Each run has its own BuildContext (`context`), either given or derived
+    from the current one, so runs can happen concurrently in threads.
     """
 
-    def __init__(self, input=None, output=None, modules=None, encoding=None, timestamp=None):
+    def __init__(self, input=None, output=None, modules=None, encoding=None, timestamp=None, context=None):
         if encoding == None:
             encoding = sys.getdefaultencoding()
-        if not PROJECT_DIR.INPUT_FILE:
+
+        # Without an explicit BuildContext the build is configured through
+        # PROJECT_DIR, and gets its own state so runs don't leak into each other
+        ambient = None
+        if context is None:
+            ambient = current_context()
+            context = ambient.copy()
+        if not context.input_file:
             # If run programmatically on StringIO() input (eg in the tests), we need to give a random value for input file in PWD
-            PROJECT_DIR.INPUT_FILE = path.join(getcwd(), token_hex(8))
-        frontmatter_storage.frontmatter = {}
-        pp = Processor(encoding)
-
-        for name in [m.lower() for m in modules]:
-            if name in Modules.modules:
-                module = Modules.modules[name]()
-                module.encoding = encoding
-                pp.register(module)
-
-        pp.input(input)
-        pp.process()
-        pp.output(output)
+            context.input_file = path.join(getcwd(), token_hex(8))
+        context.frontmatter = {}
+        self.context = context
+
+        with context.activate():
+            pp = Processor(encoding, context)
+
+            for name in [m.lower() for m in modules]:
+                if name in Modules.modules:
+                    module = Modules.modules[name]()
+                    module.encoding = encoding
+                    pp.register(module)
+
+            pp.input(input)
+            pp.process()
+            pp.output(output)
+
+        if ambient is not None:
+            # Still readable through frontmatter_storage after the run
+            ambient.frontmatter = context.frontmatter
+
+        # Lines scanned by each module, see Processor.scan_counts
+        self.scan_counts = pp.scan_counts
@@ -6,6 +6,11 @@ from __future__ import print_function
 from __future__ import unicode_literals
 import sys
 
+from MarkdownPP.Context import current_context
+from MarkdownPP.Literal import LiteralIndex
+from MarkdownPP.Scanner import Scanner
+from MarkdownPP.Transform import TransformBatch, apply_transforms
+
 
 class Module:
     """
@@ -14,19 +19,199 @@ class Module:
     """
     DEFAULT = False
     REMOTE = True
+    RESOLVES = False
+    """
+    Modules that resolve the files a report is made of (includes, embedded
+    files) set this, and are all `mdpp --list-deps` runs to find them.
+    """
+    LINE_LOCAL = False
+    """
+    Line local modules only ever rewrite the lines their scanre matched,
+    without looking at the rest of the document. When every selected module
+    is line local, the Processor streams the document through their stream()
+    generators instead of loading it all into memory.
+    """
     priority = 5
     """
     Priority is defined as a range of integers with 0 being highest priority,
     and 5 being "normal".
     """
+    scanre = None
+    """
+    Modules that only care about specific lines set this to a regular
+    expression matching those lines. The Processor's Scanner then hands them
+    just the matching line numbers (outside of fenced code) through
+    transform_lines(), rather than having each module walk the whole document.
+    """
+    directives = ()
+    """
+    Keywords of the `!KEYWORD` directives scanre matches, eg ('INCLUDE',),
+    and `prefixes` the other starts of the lines it matches, eg ('[',). The
+    Scanner routes lines to modules by these before trying their scanre.
+    A module with a scanre but neither has it tried on every line.
+    """
+    prefixes = ()
+
+    peers = ()
+    """
+    The modules registered with the same Processor (set by it), so a module
+    can hand the directives it generates straight to the module handling
+    them, see peer()
+    """
+
+    literals = None
+    """
+    LiteralIndex of the document being processed, kept up to date by the
+    Processor. Modules walking the whole document use literal_index() to
+    skip code blocks.
+    """
+
+    _context = None
 
     def __init__(self):
         self.encoding = sys.getdefaultencoding()
-    
+
+    @property
+    def context(self):
+        """
+        The BuildContext of the build this module is running in, set by the
+        Processor. A module used on its own gets the current context.
+        """
+        return self._context if self._context is not None else current_context()
+
+    @context.setter
+    def context(self, context):
+        self._context = context
+
+    def peer(self, name):
+        """
+        Returns the module of class name (eg 'Include') running in the same
+        build, or None if it isn't
+        """
+        for module in self.peers:
+            if module.__class__.__name__ == name:
+                return module
+        return None
+
+    def literal_index(self, data):
+        """
+        Returns the LiteralIndex of data: the Processor's when it indexes
+        data, a new one otherwise (eg when the module is used on its own).
+        """
+        if self.literals is not None and self.literals.lines is data:
+            return self.literals
+        return LiteralIndex(data)
+
     def transform(self, data):
         """
-        This method should generate a list of Transform objects for each
-        modification to the original data, and return this list when ready.
+        This method should generate a list of Transform objects (or a
+        TransformBatch) for each modification to the original data, and return
+        this list when ready.
         """
+        if self.scanre is not None:
+            return self.transform_lines(data, Scanner([self]).scan(data)[self])
+        return []
 
+    def transform_lines(self, data, linenums):
+        """
+        Same as transform(), but only the lines numbered in linenums (those
+        matched by scanre) need to be inspected.
+        """
         return []
+
+    def stream(self, lines, scanner=None):
+        """
+        Generator version of transform_lines() for LINE_LOCAL modules. Takes
+        an iterable of lines and yields the transformed document, rewriting
+        each line matched by scanre on its own as it passes through.
+        """
+        if scanner is None:
+            scanner = Scanner([self])
+
+        for line, candidate in scanner.classify(self, lines):
+            if candidate:
+                yield from apply_transforms([line], self.transform_lines([line], [0]))
+            else:
+                yield line
+
+
+class TaggedModule(Module):
+    """
+    Base of the modules rewriting tags in place (`!TODO`, `!ERROR`) and
+    listing them in tables (`!TABLE_OF_TODOS`, `!TABLE_OF_ERRORS`), which
+    need every tag of the document, including those after the table.
+
+    Subclasses set tagre, tablere and table_heading, and implement tag() and
+    table().
+    """
+    LINE_LOCAL = True
+
+    tagre = None
+    tablere = None
+    table_heading = ''
+
+    def tag(self, match, tags):
+        """
+        Formats the tag tagre matched, adding what its table lists to tags
+        """
+        raise NotImplementedError
+
+    def table(self, tags):
+        """
+        Returns the lines of the table of tags
+        """
+        raise NotImplementedError
+
+    def transform_lines(self, data, linenums):
+        transforms = TransformBatch()
+        tags = []
+        tablelines = []
+
+        for linenum in linenums:
+            line = data[linenum]
+            match = self.tagre.search(line)
+
+            if match:
+                transforms.add(linenum, 'swap', self.tag(match, tags))
+            elif self.tablere.search(line):
+                # Tables go in once all the tags have been collected
+                tablelines.append(linenum)
+
+        for linenum in tablelines:
+            transforms.add(linenum, 'swap', self.table(tags))
+            transforms.add(linenum, 'prepend', [self.table_heading])
+        return transforms
+
+    def stream(self, lines, scanner=None):
+        """
+        Tags are rewritten as they stream past. A table needs the tags that
+        come after it though, so from the first table on the output is held
+        back until the end of the document.
+        """
+        if scanner is None:
+            scanner = Scanner([self])
+
+        tags = []
+        held = None     # output after the first table, None marks a table
+
+        for line, candidate in scanner.classify(self, lines):
+            match = self.tagre.search(line) if candidate else None
+
+            if match:
+                line = self.tag(match, tags)
+            elif candidate and self.tablere.search(line):
+                line = None
+                if held is None:
+                    held = []
+
+            if held is None:
+                yield line
+            else:
+                held.append(line)
+
+        for line in held or []:
+            if line is None:
+                yield self.table_heading
+                yield from self.table(tags)
+            else:
+                yield line
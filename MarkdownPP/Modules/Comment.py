@@ -1,5 +1,4 @@
-from MarkdownPP.Module import Module
-from MarkdownPP.Transform import Transform
+from MarkdownPP.Module import TaggedModule
 from MarkdownPP.Common import markdown_table
 
 from secrets import token_hex
@@ -8,7 +7,7 @@ import os
 import re
 import logging
 
-class Comment(Module):
+class Comment(TaggedModule):
     """
     Module for adding various types of comments to final markdown document
     
@@ -39,43 +38,33 @@ class Comment(Module):
 
     priority = 8
 
-    def transform(self, data):
-        transforms = []
-        todos = []
-        linenum = 0
-        literal = False
-
-        for linenum, line in enumerate(data):
-            match = self.commentre.search(line)
-
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
-                err_nonce = ''
-                if 'TODO' in match.group(1):
-                    err_nonce = token_hex(5)
-                    todos.append((err_nonce, match.group(2)))
-                comment = self.process_comment(match, err_nonce=err_nonce)
-                transform = Transform(linenum=linenum, oper='swap',
-                                        data=comment)
-                transforms.append(transform)
-       
-        for linenum, line in enumerate(data):
-            # Go through again searching for the !TABLE_OF_TODOS tag
-            tot_match = self.table_of_todo_re.search(line)
-            if tot_match:
-                todos_hdr = [('Search Me', 'TO DO')] + todos
-                table = markdown_table(todos_hdr, first_row_header=True)
-                
-                title_transform = Transform(linenum=linenum, oper='prepend', data=['\n**Table of TODOs**\n'])
-                table_transform = Transform(linenum=linenum, oper='swap', data=table)
-                
-                transforms.append(table_transform)
-                transforms.append(title_transform)
-        return transforms
+    # Lines handed to this module by the Processor's scanner
+    scanre = re.compile(r'^!(COMMENT|TODO|TABLE_OF_TODOS|TOT)')
+    directives = ('COMMENT', 'TODO', 'TABLE_OF_TODOS', 'TOT')
+
+    # Comments are rewritten in place, so the module can be streamed
+    LINE_LOCAL = True
+
+    tagre = commentre
+    tablere = table_of_todo_re
+    table_heading = '\n**Table of TODOs**\n'
+
+    def comment(self, match, todos):
+        '''
+        Formats a matched comment tag, adding it to todos if it is a !TODO
+        '''
+        err_nonce = ''
+        if 'TODO' in match.group(1):
+            err_nonce = token_hex(5)
+            todos.append((err_nonce, match.group(2)))
+        return self.process_comment(match, err_nonce=err_nonce)
+
+    tag = comment
+
+    @staticmethod
+    def table(todos):
+        todos_hdr = [('Search Me', 'TO DO')] + todos
+        return markdown_table(todos_hdr, first_row_header=True)
 
 
     def process_comment(self, match, err_nonce=''):
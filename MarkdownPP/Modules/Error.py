@@ -1,5 +1,4 @@
-from MarkdownPP.Module import Module
-from MarkdownPP.Transform import Transform
+from MarkdownPP.Module import TaggedModule
 from MarkdownPP.Common import markdown_table
 
 import os
@@ -8,7 +7,7 @@ import logging
 
 from secrets import token_hex
 
-class Error(Module):
+class Error(TaggedModule):
     """
     Module that handles atuomatically formatting the !ERROR tag. 
     For the preprocessor to mark tags it failed to process for the user. 
@@ -22,54 +21,34 @@ class Error(Module):
 
     priority = 9
 
-    def transform(self, data):
-        transforms = []
-        errors = []
-        literal = False
-        for linenum, line in enumerate(data):
-            # If !ERROR tag found, format and output
-            err_match = self.error_re.search(line)
+    # Lines handed to this module by the Processor's scanner
+    scanre = re.compile(r'^!(ERROR|TABLE_OF_ERRORS|TOE)')
+    directives = ('ERROR', 'TABLE_OF_ERRORS', 'TOE')
 
+    # Errors are rewritten in place, so the module can be streamed
+    LINE_LOCAL = True
 
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif err_match:
-                error = err_match.group(1).strip()
-                err = err_match.group(2).strip()
+    tagre = error_re
+    tablere = table_of_errors_re
+    table_heading = '\n**Table of Errors**\n'
 
-                err_nonce = token_hex(5)
+    @staticmethod
+    def error(err_match, errors):
+        '''
+        Formats a matched !ERROR tag and adds it to errors
+        '''
+        error = err_match.group(1).strip()
+        err = err_match.group(2).strip()
 
-                errors.append((err_nonce, error, err.replace('!ERROR:', '').strip()))
+        err_nonce = token_hex(5)
 
-                comment = f'<span style="color:FireBrick" id="{err_nonce}">ERROR {err_nonce}: {error}</span> <!-- {err} -->\n'
-                transform = Transform(linenum=linenum, oper='swap',
-                                        data=comment)
-                transforms.append(transform)
-        
-        #print('searching for table of errors...')
-        
-        literal = False
-        for linenum, line in enumerate(data):
-            # If !TABLE_OF_ERRORS tag found, format and output
-            toe_match = self.table_of_errors_re.search(line)
+        errors.append((err_nonce, error, err.replace('!ERROR:', '').strip()))
 
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif toe_match:
-                #print(linenum, line.strip(), 'FOUND')
-                errors_hdr = [('Search Me', 'Error Tag', 'Error Cause')] + errors
-                table = markdown_table(errors_hdr, first_row_header=True)
-                
-                title_transform = Transform(linenum=linenum, oper='prepend', data=['\n**Table of Errors**\n'])
-                table_transform = Transform(linenum=linenum, oper='swap', data=table)
-                
-                transforms.append(table_transform)
-                transforms.append(title_transform)
+        return f'<span style="color:FireBrick" id="{err_nonce}">ERROR {err_nonce}: {error}</span> <!-- {err} -->\n'
 
-        return transforms
\ No newline at end of file
+    tag = error
+
+    @staticmethod
+    def table(errors):
+        errors_hdr = [('Search Me', 'Error Tag', 'Error Cause')] + errors
+        return markdown_table(errors_hdr, first_row_header=True)
@@ -2,10 +2,9 @@ from MarkdownPP.Module import Module
 from MarkdownPP.Transform import Transform
 
 from MarkdownPP.Common import PROJECT_DIR
-from MarkdownPP.Common import frontmatter_storage
+from MarkdownPP.Common import markdown_table
 
 import os
-import yaml
 import re
 
 import logging
@@ -38,25 +37,24 @@ class Frontmatter(Module):
     selectors = ['all', 'this']
     structures = ['bullet.list', 'numbered.list', 'table']
 
-    priority = 2
+    priority = 3
 
-    def transform(self, data):
+    # Lines handed to this module by the Processor's scanner
+    scanre = re.compile(r"^!FRONTMATTER\s")
+    directives = ('FRONTMATTER',)
+
+    def transform_lines(self, data, linenums):
         logging.debug('running tansform()')
 
-        self.frontmatter = frontmatter_storage.frontmatter 
+        self.frontmatter = self.context.frontmatter
 
         transforms = []
-        literal = False
 
-        for linenum, line in enumerate(data): # Go line by line through the mdpp file
+        for linenum in linenums: # Go through the !FRONTMATTER lines of the mdpp file
+            line = data[linenum]
             match = self.frontmatter_regex.search(line) # Find the Frontmatter tags
-            
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
+
+            if match:
                 logging.debug(f'transform() -> !FRONTMATTER tag found: {str(linenum)}:{match.string.rstrip()}')
                 
                 frontmatterdata = self.process_frontmatter(match) # Process frontmatter tag to get markdown
@@ -167,20 +165,15 @@ class Frontmatter(Module):
     @staticmethod
     def markdown_table(data):
         '''
-        The filthy cheater's way to get really nice markdwon tables from any input.
-        Requires pandas and tabulate (available through pip)
+        Markdown table of the selected frontmatter, see Common.markdown_table
 
         parameters:
             data (list): list of dictionaries
 
         return:
-            str: markdown table of data
+            list: markdown table of data, as a list of lines
         '''
-        from pandas import DataFrame
-        df = DataFrame(data).applymap(lambda x: '<ul><li>'+'</li><li>'.join(x)+'</li></ul>' if isinstance(x, list) else x)
-        table = df.to_markdown(index=False, tablefmt="pipe")
-
-        return [l+'\n' for l in table.split('\n') if l]
+        return markdown_table(data)
 
     @staticmethod
     def plain(data):
@@ -5,23 +5,27 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import glob
 import re
-import yaml
+from concurrent.futures import ThreadPoolExecutor
 from os import path, getcwd, replace
 
 from MarkdownPP.Module import Module
 from MarkdownPP.Transform import Transform
+from MarkdownPP.Cache import FileCache
 
-from MarkdownPP.Common import PROJECT_DIR, process_path
+from MarkdownPP.Common import embed_path, decode_lines, load_yaml, read_frontmatter, frontmatter_body
 
-from MarkdownPP.Common import frontmatter_regex
 from MarkdownPP.Common import frontmatter_this_regex
 from MarkdownPP.Common import include_code_regex
 from MarkdownPP.Common import embedded_image_regex
 from MarkdownPP.Common import md_title_regex
 
-from MarkdownPP.Common import frontmatter_storage
+
+class IncludeLimitError(Exception):
+    """
+    Raised when an include tree grows past one of the Include.limits, to stop
+    expanding it altogether
+    """
 
 
 class Include(Module):
@@ -32,6 +36,7 @@ class Include(Module):
     """
     DEFAULT = True
     REMOTE = False
+    RESOLVES = True
     
     # matches !INCLUDE directives in .mdpp files
     includere = re.compile(r"^!INCLUDE\s+(?:\"([^\"]+)\"|'([^']+)')\s*(?:,\s*L?E?V?E?L?\s?(\d+))?\s*$") # New regex allows us to write LEVEL before shift value for clarity
@@ -42,62 +47,142 @@ class Include(Module):
     # includes should happen before anything else
     priority = 1
 
-    def transform(self, data):
+    # Parsed included files, shared by all builds in the process
+    files = FileCache(maxsize=256)
+
+    # Threads reading the include tree ahead of its expansion, see prefetch()
+    workers = 8
+
+    # How deep includes may nest, and how many lines and bytes of included
+    # files a build may expand in total (None for no limit). Builds override
+    # these with BuildContext.include_limits
+    limits = {'depth': 64, 'lines': 1000000, 'bytes': 256 * 1024 * 1024}
+
+    # Lines handed to this module by the Processor's scanner: includes,
+    # embedded images and "!FRONTMATTER this" tags
+    scanre = re.compile(r"^(!INCLUDE\s|<img |\[?!\[|!FRONTMATTER\s+this,)")
+    directives = ('INCLUDE', 'FRONTMATTER')
+    prefixes = ('<img ', '![', '[![')
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []             # (real path, name) of the files being expanded, outermost first,
+                                    # starting with the input file when there is one
+        self.depth = 0              # includes being expanded
+        self.seen = set()           # real paths of the files included so far
+        self.expanded = {'lines': 0, 'bytes': 0}
+        self.exceeded = None        # IncludeLimitError once a limit was reached
+
+    def transform_lines(self, data, linenums):
         transforms = []
+        self.stack = []
+        if path.isfile(self.context.input_file):
+            self.stack.append((path.realpath(self.context.input_file), self.context.input_file))
 
         # Top level YAML Frontmatter is detected, parsed and stored in memory
-        frontmatter = ''
-        match = frontmatter_regex.match(''.join(data))
-        if match:
-            frontmatter, _ = match.groups()         # get yaml frontmatter as string
-          
+        frontmatter, end, rest = read_frontmatter(data)      # get yaml frontmatter as string
+        if frontmatter is not None:
             # Drop all frontmatter lines
-            for linenum in range(len(frontmatter.split('\n'))):
+            for linenum in range(end):
                 transform = Transform(linenum=linenum, oper="drop")
                 transforms.append(transform)
 
-            frontmatter = yaml.safe_load(frontmatter)   # get yaml frontmatter as dictionary from string
+            frontmatter = load_yaml(frontmatter)   # get yaml frontmatter as dictionary from string
             if isinstance(frontmatter, list) or isinstance(frontmatter, dict):
-                frontmatter_storage.frontmatter[PROJECT_DIR.INPUT_FILE] = frontmatter
+                self.context.frontmatter[self.context.input_file] = frontmatter
             
             # Sneakily substitute "!FRONTMATTER this," to "!FRONTMATTER id.id,"
             this_id = f"id.{frontmatter.get('id', 'UNDEF')}"
-            for linenum, line in enumerate(data):
+            for linenum in linenums:
+                line = data[linenum]
                 match = frontmatter_this_regex.search(line)
                 if match:
                     transform = Transform(linenum=linenum, oper='swap', data=frontmatter_this_regex.sub(f"!FRONTMATTER {this_id},", line))
                     transforms.append(transform)
-    
-        # Don't process include tags in ``` code fences`
-        literal = False
 
-        for linenum, line in enumerate(data):
+        # Read everything the includes below need before expanding them
+        fileglobs = []
+        for linenum in linenums:
+            match = self.includere.search(data[linenum])
+            if match:
+                fileglobs.append(match.group(1) or match.group(2))
+        if fileglobs and self.workers > 1:
+            self.prefetch(fileglobs)
+
+        # Include tags in ``` code fences are never handed to us by the scanner
+        for linenum in linenums:
+            line = data[linenum]
             match = self.includere.search(line)
             image_match = embedded_image_regex.search(line)
 
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
-                includedata = self.include(match)
+            if match:
+                if self.exceeded is not None:
+                    includedata = [f'!ERROR "{line.rstrip()}" <!-- !ERROR: Not included ({self.exceeded}) -->\n']
+                else:
+                    try:
+                        includedata = self.include(match)
+                    except IncludeLimitError as exc:
+                        # Stop including anything, rather than exhaust memory
+                        self.exceeded = exc
+                        includedata = [f'!ERROR "{line.rstrip()}" <!-- !ERROR: {exc} -->\n']
                 transform = Transform(linenum=linenum, oper="swap", data=includedata)
                 transforms.append(transform)
             elif image_match:
                 # Handle images linked to in the top level file (not in included files)
-                embed_img = image_match.group(3)
-                replace_path = process_path(md_file=PROJECT_DIR.INPUT_FILE, file_to_embed=embed_img, get_abs=(not PROJECT_DIR.COLLECT))
-                if 'Process_path ERROR' in replace_path:
-                    new_embed = f'!ERROR "{line.rstrip()}" <!-- !ERROR: {replace_path.split(":")[-1]} -->'
-                else:
-                    new_embed = line.replace(embed_img, replace_path)
-                transform = Transform(linenum=linenum, oper="swap", data=[new_embed])
+                transform = Transform(linenum=linenum, oper="swap", data=[self.embed(line, image_match)])
                 transforms.append(transform)
 
         return transforms
+
+    def embed(self, line, image_match):
+        '''
+        Points an image embedded in the top level document at the image
+        file, or its copy in the collection directory
+        '''
+        embed_img = image_match.group(3)
+        replace_path = embed_path(md_file=self.context.input_file, file_to_embed=embed_img, get_abs=(not self.context.collect))
+        if 'Process_path ERROR' in replace_path:
+            return f'!ERROR "{line.rstrip()}" <!-- !ERROR: {replace_path.split(":")[-1]} -->'
+        return line.replace(embed_img, replace_path)
     
 
+    def prefetch(self, fileglobs):
+        '''
+        Walks the include tree below fileglobs breadth first, resolving the
+        globs and reading the files of each level concurrently, so that the
+        (depth first, serial) expansion finds every file already parsed in
+        the file cache. Only pays off when the file system is slow, eg on
+        network shares, where waiting for one file after the other adds up.
+        The walk stops at the depth and bytes limits the expansion would.
+        '''
+        limits = self.include_limits()
+        seen = set()
+        depth = size = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while fileglobs:
+                depth += 1
+                if limits['depth'] is not None and depth > limits['depth'] \
+                        or limits['bytes'] is not None and size > limits['bytes']:
+                    break
+
+                files = []
+                for matches in pool.map(self.context.listing.glob, fileglobs):
+                    for filename in sorted(matches):
+                        if filename not in seen:
+                            seen.add(filename)
+                            files.append(filename)
+
+                units = self.files.prefetch(files, self.parse_file, self.encoding, pool)
+
+                # Includes in included files are relative to them
+                fileglobs = []
+                for filename, (_, data, raw_size) in units.items():
+                    size += raw_size
+                    for line in data:
+                        match = self.includere.search(line)
+                        if match:
+                            fileglobs.append(path.join(path.dirname(filename), match.group(1) or match.group(2)))
+
     def include(self, match, pwd=""):
         # file name is caught in group 1 if it's written with double quotes,
         # or group 2 if written with single quotes
@@ -109,7 +194,9 @@ class Include(Module):
         if pwd != "":
             fileglob = path.join(pwd, fileglob)
 
-        files = sorted(glob.glob(fileglob))
+        files = sorted(self.context.listing.glob(fileglob))
+        if self.context.cache is not None:
+            self.context.cache.depend_glob(fileglob, files)
 
         if len(files) > 0:
             for filename in files:
@@ -120,94 +207,175 @@ class Include(Module):
         return result
 
 
+    def include_limits(self):
+        return {**self.limits, **(self.context.include_limits or {})}
+
     def include_file(self, filename, pwd="", shift=0):
+        realpath = path.realpath(filename)
+        names = [name for real, name in self.stack]
+        reals = [real for real, name in self.stack]
+
+        if realpath in reals:
+            loop = names[reals.index(realpath):] + [filename]
+            return [f'!ERROR "!INCLUDE "{filename.rstrip()}"" <!-- !ERROR: Include cycle: {" -> ".join(loop)} -->\n']
+
+        if self.context.include_once and realpath in self.seen:
+            return []
+        self.seen.add(realpath)
+
+        depth = self.include_limits()['depth']
+        if depth is not None and self.depth >= depth:
+            raise IncludeLimitError(f'Includes nested more than {depth} deep: {" -> ".join(names + [filename])}')
+
+        self.stack.append((realpath, filename))
+        self.depth += 1
         try:
-            with open(filename, "r", encoding = self.encoding) as f:
-                data = f.readlines()
-                
-            # YAML Frontmatter is detected, parsed and stored in memory
-            frontmatter = ''
-            match = frontmatter_regex.match(''.join(data))
-            if match:
-                frontmatter, data = match.groups()         # get yaml frontmatter as string
-                frontmatter = yaml.safe_load(frontmatter)   # get yaml frontmatter as dictionary from string
-                if isinstance(frontmatter, list) or isinstance(frontmatter, dict):
-                    frontmatter_storage.frontmatter[filename] = frontmatter
-                
-                # Sneakily substitute "!FRONTMATTER this," to "!FRONTMATTER id.id,"
-                this_id = f"id.{frontmatter.get('id', 'UNDEF')}"
-                data = frontmatter_this_regex.sub(f"!FRONTMATTER {this_id},", data)
-                data = [line+'\n' for line in data.split('\n')]
-
-            # line by line, apply shift and recursively include file data
-            linenum = 0
-            includednum = 0
-
-            # Can't use enumerate in this case because we are changing the list as we iterate... 
-            for line in data:
-                include_match = self.includere.search(line)
-                image_match = embedded_image_regex.search(line)
-                include_code_match = include_code_regex.search(line)
-
-                if include_match:
-                    dirname = path.dirname(filename)
-                    data[linenum:linenum+1] = self.include(include_match, dirname)
-                    includednum = linenum
-                    # Update line so that we won't miss a shift if
-                    # heading is on the 1st line.
-                    line = data[linenum]
-
-                elif image_match:
-                    # Handle images linked to in subfiles through the !INCLUDE directive
-                    embed_img = image_match.group(3)
-
-                    replace_path = process_path(md_file=filename, file_to_embed=embed_img, get_abs=(not PROJECT_DIR.COLLECT))
-                    new_embed = line.replace(embed_img, replace_path)
-
-                    #print('\n\nSUBFILE IMG:\n', embed_img, '\n', replace_path)
-                    data[linenum:linenum+1] = [new_embed]
-
-                elif include_code_match:
-                    # Make links to included code in sub files absolute such that the includcode module can parse later
-                    code_file = include_code_match.group(1) or include_code_match.group(2)
-                    
-                #    print(path.join(path.dirname(filename), code_file))
-                    replace_path = path.join(path.dirname(filename), code_file)
-                    new_include_code = line.replace(code_file, replace_path)
-
-                    data[linenum:linenum+1] = [new_include_code]
-                    #print(new_include_code)
-                
-
-                if shift:
-                    # Applies shift to header levels, if specified
-                    titlematch = md_title_regex.search(line)
-                    if titlematch:
-                        to_del = []
-                        for _ in range(shift):
-                            # Skip underlines with empty above text
-                            # or underlines that are the first line of an
-                            # included file
-                            prevtxt = re.sub(self.formatre, '',
-                                             data[linenum - 1]).strip()
-                            isunderlined = prevtxt and linenum > includednum
-                            if data[linenum][0] == '#':
-                                data[linenum] = "#" + data[linenum]
-                            elif data[linenum][0] == '=' and isunderlined:
-                                data[linenum] = data[linenum].replace("=", '-')
-                            elif data[linenum][0] == '-' and isunderlined:
-                                data[linenum] = '### ' + data[linenum - 1]
-                                to_del.append(linenum - 1)
-                        for l in to_del:
-                            del data[l]
-
-                linenum += 1
-
-            return data
+            cache = self.context.cache
+            if cache is None or self.context.include_once:
+                # What include-once leaves out depends on everything included before
+                return self.expand_file(filename, pwd, shift)
+
+            # Reuse the expansion from the last build if nothing in its include
+            # subtree changed. Embedded image paths depend on the output settings,
+            # and cycles on the files including it.
+            key = ('include', filename, path.abspath(filename), shift, self.context.collect, self.context.images_dir,
+                   tuple(reals))
+            misses = cache.misses
+            result = cache.cached(key, lambda: self.expand_file(filename, pwd, shift))
+            if cache.misses == misses:
+                # Reused without expanding anything, still counts towards the limits
+                self.count_expanded(len(result), len(''.join(result).encode(self.encoding, 'replace')), filename)
+            return result
+        finally:
+            self.stack.pop()
+            self.depth -= 1
+
+    def count_expanded(self, lines, size, filename):
+        '''
+        Adds what an included file brings to the build's totals, and stops
+        the expansion once they exceed the limits
+        '''
+        self.expanded['lines'] += lines
+        self.expanded['bytes'] += size
+        limits = self.include_limits()
+        for name in ('lines', 'bytes'):
+            if limits[name] is not None and self.expanded[name] > limits[name]:
+                raise IncludeLimitError(f'Included more than {limits[name]} {name} in total, '
+                                        f'exceeded by {filename}')
+
+    def parse_file(self, raw):
+        '''
+        Splits the raw content of an included file into its frontmatter and
+        its (unshifted) lines, with "!FRONTMATTER this" resolved
+
+        returns:
+            tuple: (frontmatter or None, tuple of lines, size of the file in bytes)
+        '''
+        data = decode_lines(raw, self.encoding)
+
+        frontmatter, end, rest = read_frontmatter(data)      # get yaml frontmatter as string
+        if frontmatter is not None:
+            frontmatter = load_yaml(frontmatter)   # get yaml frontmatter as dictionary from string
+
+            # Sneakily substitute "!FRONTMATTER this," to "!FRONTMATTER id.id,"
+            this_id = f"id.{frontmatter.get('id', 'UNDEF')}"
+            data = [frontmatter_this_regex.sub(f"!FRONTMATTER {this_id},", line)
+                    for line in frontmatter_body(data, end, rest)]
+
+        return frontmatter, tuple(data), len(raw)
+
+    def expand_file(self, filename, pwd="", shift=0):
+        try:
+            # Files are only read and parsed again once they change
+            frontmatter, data, size = self.files.get(filename, self.parse_file, self.encoding)
+            self.count_expanded(len(data), size, filename)
+
+            # YAML Frontmatter is stored in memory
+            if isinstance(frontmatter, list) or isinstance(frontmatter, dict):
+                self.context.frontmatter[filename] = frontmatter
+                if self.context.cache is not None:
+                    self.context.cache.effect('frontmatter', filename, frontmatter)
+
+            return list(self.shift_headings(self.expand_lines(filename, data), shift))
 
+        except IncludeLimitError:
+            raise
         except (IOError, OSError) as exc:
             return [ f'!ERROR "!INCLUDE "{filename.rstrip()}"" <!-- !ERROR:  Requested data structure not recognized -->\n' ]
         except Exception as exc:
             return [f'!ERROR "!INCLUDE "{filename.rstrip()}"" <!-- !ERROR: {exc} -->\n']
 
+    def expand_lines(self, filename, data):
+        '''
+        Expands the includes of an included file and makes the paths in it
+        usable from the including document, in one pass over its lines.
+
+        yields:
+            tuple: (line, first), first being True for the first line of each
+                   nested include
+        '''
+        dirname = path.dirname(filename)
+        for line in data:
+            # Includes, images and code includes all start with one of these
+            if line[:1] not in '!<[':
+                yield line, False
+                continue
+
+            include_match = self.includere.search(line)
+            if include_match:
+                # Nested includes come expanded, and only need shifting
+                first = True
+                for included in self.include(include_match, dirname):
+                    yield included, first
+                    first = False
+                continue
+
+            image_match = embedded_image_regex.search(line)
+            include_code_match = include_code_regex.search(line)
+            if image_match:
+                # Handle images linked to in subfiles through the !INCLUDE directive
+                embed_img = image_match.group(3)
+                replace_path = embed_path(md_file=filename, file_to_embed=embed_img, get_abs=(not self.context.collect))
+                line = line.replace(embed_img, replace_path)
+
+            elif include_code_match:
+                # Make links to included code in sub files absolute such that the includcode module can parse later
+                code_file = include_code_match.group(1) or include_code_match.group(2)
+                line = line.replace(code_file, path.join(dirname, code_file))
+
+            yield line, False
+
+    def shift_headings(self, lines, shift):
+        '''
+        Applies shift to the header levels of (line, first) pairs from
+        expand_lines(). A setext header underline ("===" or "---") can turn
+        the line before it into an atx header, so that line is held back
+        until the next one is seen.
+
+        yields:
+            str: the shifted lines
+        '''
+        previous = None
+        for line, first in lines:
+            if shift and line[:1] in '#=-' and md_title_regex.search(line):
+                # Skip underlines with empty above text
+                # or underlines that are the first line of an
+                # included file
+                isunderlined = previous is not None and not first and re.sub(self.formatre, '', previous).strip()
+                for _ in range(shift):
+                    if line[0] == '#':
+                        line = "#" + line
+                    elif line[0] == '=' and isunderlined:
+                        line = line.replace("=", '-')
+                    elif line[0] == '-' and isunderlined:
+                        line = '### ' + previous
+                        previous = None
+
+            if previous is not None:
+                yield previous
+            previous = line
+
+        if previous is not None:
+            yield previous
+
         
\ No newline at end of file
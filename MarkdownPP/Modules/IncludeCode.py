@@ -6,70 +6,166 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import ast
 import re
+import threading
 
-from os import path
-from MarkdownPP.Common import PROJECT_DIR
+from collections import OrderedDict
+from locale import getpreferredencoding
+from os import path, stat
+from MarkdownPP.Cache import FileCache
+from MarkdownPP.Common import decode_lines
+from MarkdownPP.Lines import LineIndex
 
 from MarkdownPP.Module import Module
 from MarkdownPP.Transform import Transform
 
 from MarkdownPP.Common import include_code_regex
 
+class CodeFile:
+    """
+    The lines of a code file, and where the functions and classes defined
+    in it are, found by parsing it as Python the first time a definition is
+    looked up.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.symbols = None     # ('def' or 'class', name) -> (start, end) line indexes
+
+    def symbol(self, kind, name):
+        '''
+        Finds the lines of a definition, decorators included
+
+        parameters:
+            kind (str): 'def' for functions and methods, 'class' for classes
+            name (str): the qualified name of the definition (eg Exploit.run),
+                or just its name to take the first one defined
+
+        returns:
+            tuple: (start, end) indexes of its lines
+
+        raises:
+            LookupError: if the file doesn't define it
+            SyntaxError: if the file isn't valid Python
+        '''
+        if self.symbols is None:
+            self.symbols = self.parse()
+        if (kind, name) not in self.symbols:
+            raise LookupError(f'No {kind} {name} found')
+        return self.symbols[(kind, name)]
+
+    def parse(self):
+        definitions = {}
+
+        def visit(node, prefix):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    kind = 'class' if isinstance(child, ast.ClassDef) else 'def'
+                    start = min([child.lineno] + [decorator.lineno for decorator in child.decorator_list])
+                    definitions.setdefault((kind, prefix + child.name), (start - 1, child.end_lineno))
+                    visit(child, prefix + child.name + '.')
+                else:
+                    visit(child, prefix)
+
+        visit(ast.parse(''.join(self.lines)), '')
+        # Unqualified names find the first definition of that name
+        symbols = dict(definitions)
+        for (kind, name), span in definitions.items():
+            symbols.setdefault((kind, name.rpartition('.')[2]), span)
+        return symbols
+
+
 class IncludeCode(Module):
     """
     Module for recursively including the contents of other local code
     files into the current document using a command like
     `!INCLUDECODE "codes/mycode.py"`.
     Targets must be valid, absolute urls.
+
+    Instead of a line range, `def:name` or `class:name` includes a single
+    function or class of a Python file (`Class.method` for methods).
     """
     DEFAULT = True
     REMOTE = False
+    RESOLVES = True
 
     # include code should happen after includes, but before everything else
-    priority = 2
+    priority = 3
+
+
+    # Lines handed to this module by the Processor's scanner
+    scanre = re.compile(r"^!INCLUDECODE\s")
+    directives = ('INCLUDECODE',)
 
+    # Directives are swapped for their output in place, so the module can be
+    # streamed
+    LINE_LOCAL = True
 
-    def transform(self, data):
+    # Line ranges of files this large are read through a LineIndex of the
+    # file rather than reading all of it. Indexes are kept for the last
+    # `indexed` files, and reused while the files don't change. Builds in
+    # other threads share them, under index_lock.
+    index_size = 1 << 20
+    indexed = 16
+    indexes = OrderedDict()     # absolute path -> LineIndex
+    index_lock = threading.Lock()
+
+    # Code files are read and decoded once, and kept while they don't change
+    # (up to 64 MB of them), for all directives including them
+    files = FileCache(maxsize=256, maxbytes=64 * 1024 * 1024)
+
+    def transform_lines(self, data, linenums):
         transforms = []
-        literal = False
-
-        for linenum, line in enumerate(data):
-            match = include_code_regex.search(line)
-          
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
+
+        for linenum in linenums:
+            match = include_code_regex.search(data[linenum])
+
+            if match:
                 include_code_data = self.include_code(match)
                 transform = Transform(linenum=linenum, oper="swap", data=include_code_data)
                 transforms.append(transform)
-            
-            linenum += 1
+
         return transforms
 
     def _select_lines(self, code_file, lines):
         # No lines given
         if lines is None:
             return code_file
+        start, end = self._line_range(lines, len(code_file))
+        return code_file[start:end]
+
+    @staticmethod
+    def _line_range(lines, count):
+        '''
+        Turns a selection like 5, 1:5, :5 or 5: into the (start, end) indexes
+        of the lines it selects in a file of count lines
+
+        raises:
+            IndexError: if a single line selected is past the end of the file
+        '''
         # Single line
         if ':' not in lines:
-            # Line counting starts at 1. Need to offset by -1
-            return code_file[(int(lines) - 1)]
+            # Line counting starts at 1. Need to offset by -1 (so, like a
+            # list index, 0 is the last line)
+            start = int(lines) - 1
+            if start < 0:
+                start += count
+            if not 0 <= start < count:
+                raise IndexError('list index out of range')
+            return start, start + 1
 
         # Multiline python style e.g. 1:5, :5, 5:
         from_line, to_line = [int(x) if x else None for x in lines.split(':')]
         if from_line is None or from_line <= 0:
             from_line = 1
-        if to_line is None or to_line > len(code_file):
-            to_line = len(code_file)
+        if to_line is None or to_line > count:
+            to_line = count
         # Line counting starts at 1. Need to offset by -1
-        return code_file[(from_line - 1):to_line]
+        return from_line - 1, max(from_line - 1, to_line)
 
     def include_code(self, match, pwd=""):
-        dirname = path.dirname(PROJECT_DIR.INPUT_FILE)
+        dirname = path.dirname(self.context.input_file)
 
         code_file = match.group(1) or match.group(2)
         code_file = path.join(dirname, code_file)
@@ -81,16 +177,76 @@ class IncludeCode(Module):
             code_file = path.join(pwd, code_file)
 
         try:
-            with open(code_file, "r") as fs:
-                code_data = fs.readlines()
-
-            return (
-                "```" + (str(lang) if lang is not None else "") + "\n"
-                + "".join(self._select_lines(code_data, lines))
-                + "\n```\n"
-            )
+            cache = self.context.cache
+            if cache is None:
+                return self.render_code(code_file, lang, lines)
+            return cache.cached(('includecode', code_file, lang, lines),
+                                lambda: self.render_code(code_file, lang, lines))
 
         except (IOError, OSError) as exc:
             print(exc)
+        except (LookupError, SyntaxError) as exc:
+            return [f'!ERROR "{match.string.rstrip()}" <!-- !ERROR: {exc} -->\n']
 
         return []
+
+    def render_code(self, code_file, lang, lines):
+        return (
+            "```" + (str(lang) if lang is not None else "") + "\n"
+            + "".join(self.read_lines(code_file, lines))
+            + "\n```\n"
+        )
+
+    def read_lines(self, code_file, lines):
+        '''
+        Reads the lines of code_file selected by lines (all of them if None),
+        or the definition lines names (eg def:exploit). A range of a large
+        file is read through its LineIndex, which only touches the part of
+        the file holding the range.
+        '''
+        if lines is not None and lines[:1].isalpha():
+            kind, _, name = lines.partition(':')
+            code = self.code_file(code_file)
+            start, end = code.symbol(kind, name)
+            return code.lines[start:end]
+
+        if lines is not None and path.getsize(code_file) >= self.index_size:
+            index = self.line_index(code_file)
+            if index is not None:
+                raw = index.read(*self._line_range(lines, index.lines))
+                if self.context.cache is not None:
+                    self.context.cache.depend('stat', code_file, index.signature + (None,))
+                if self.context.profile is not None:
+                    self.context.profile.count(read=len(raw))
+                return decode_lines(raw)
+
+        return self._select_lines(self.code_file(code_file).lines, lines)
+
+    def code_file(self, code_file):
+        '''
+        Returns the CodeFile of code_file, read through the files cache
+        '''
+        encoding = getpreferredencoding(False)
+        return self.files.get(code_file, lambda raw: CodeFile(decode_lines(raw, encoding)), encoding)
+
+    def line_index(self, code_file):
+        '''
+        Returns the LineIndex of a file, building it on first use and again
+        when the file changed, or None if the file has to be read in full
+        '''
+        if '\n'.encode(getpreferredencoding(False)) != b'\n':
+            return None
+
+        key = path.abspath(code_file)
+        st = stat(code_file)
+        with self.index_lock:
+            index = self.indexes.get(key)
+        if index is None or index.signature != (st.st_mtime_ns, st.st_size):
+            # Scanned without holding the lock, other threads keep using their indexes
+            index = LineIndex(code_file)
+        with self.index_lock:
+            self.indexes[key] = index
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.indexed:
+                self.indexes.popitem(last=False)
+        return index if index.usable else None
@@ -8,83 +8,122 @@ from __future__ import unicode_literals
 import re
 
 from os import path
-from os import walk, listdir
-
-from MarkdownPP.Common import PROJECT_DIR
 
 from MarkdownPP.Module import Module
 from MarkdownPP.Transform import Transform
-#from MarkdownPP.Modules.Include import Include
+from MarkdownPP.Modules.Include import IncludeLimitError
+
+from MarkdownPP.Common import include_code_regex
+from MarkdownPP.Common import embedded_image_regex
 
 
 class IncludeDir(Module):
     """
     Module for recursively including the contents of all supported files in a specified directory.
+
+    Files are expanded in place by the Include and IncludeCode modules of
+    the build, and images embedded as Include embeds them. When one of those
+    modules isn't running, its files are left as `!INCLUDE` or `!INCLUDECODE`
+    directives.
     """
     DEFAULT = True
     REMOTE = False
+    RESOLVES = True
         
-    includedir_re = re.compile(r"^!INCLUDEDIR\s+(?:\"([^\"]+)\"|'([^']+)')\s*(?:,\s*RECURSE)?\s*(?:,\s*FORMATS \(([ .,\-a-zA-Z0-9]+)\))?$")
+    includedir_re = re.compile(r"^!INCLUDEDIR\s+(?:\"([^\"]+)\"|'([^']+)')\s*(?:,\s*RECURSE)?\s*(?:,\s*FORMATS \(([ .,\-a-zA-Z0-9]+)\))?"
+                               r"\s*(?:,\s*LEVEL\s*(\d+))?$")
 
-    # include dir should happen after before everything else
-    priority = 0
+    images = ['.png','.apng', '.avif', '.gif', '.jpeg', '.jpg', '.svg', '.webp', '.bmp']
+    md = ['.md', '.mdpp', '.txt']
 
+    # include dir runs right after includes (so directories are included from
+    # included files too), and before the code includes and frontmatter
+    # tables its files need
+    priority = 2
 
-    def transform(self, data):
+
+    # Lines handed to this module by the Processor's scanner
+    scanre = re.compile(r"^!INCLUDEDIR\s")
+    directives = ('INCLUDEDIR',)
+
+    def transform_lines(self, data, linenums):
         transforms = []
 
-        literal = False
-
-        for linenum, line in enumerate(data):
-            match = self.includedir_re.search(line)
-            
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
+        for linenum in linenums:
+            match = self.includedir_re.search(data[linenum])
+
+            if match:
                 include_dir = path.abspath(match.group(1))
                 recurse = 'RECURSE' in match.group(0)
 
-                # Get a list of all subfiles in specified folder
+                file_types = []
+                if match.group(3):
+                    file_types = ['.'+x.strip() for x in match.group(3).split(',')]
+                    #print('FORMATS:', file_types) REMME
+                shift = int(match.group(4) or 0)
+
+                # Files are expanded as the listing goes
+                subfiles = []
                 try:
-                    if recurse:
-                        subfiles_by_dir = [sorted([path.join(root, file) for file in files]) for root, dirs, files in walk(include_dir)]
-                        subfiles = [file for directory in subfiles_by_dir for file in directory]
-                        # print(subfiles_by_dir, '\n\n', subfiles) REMME
-                    else:
-                        subfiles = sorted([path.join(path.abspath(include_dir), file) for file in listdir(include_dir)])
-                        subfiles = [file for file in subfiles if path.isfile(file)]
+                    lines = []
+                    for file in self.context.listing.iter_files(include_dir, recurse):
+                        subfiles.append(file)
+                        name, ext = path.splitext(file)
+                        # If the extension is in the list of specified extensions OR extensions were unspecified
+                        if ext in file_types or not file_types:
+                            lines += self.expand(file, name, ext, shift)
                 except FileNotFoundError:
+                    subfiles = lines = None
+
+                if self.context.cache is not None:
+                    self.context.cache.depend_files(include_dir, recurse, subfiles)
+
+                if subfiles is None:
                     error = [f'!ERROR "{match.string.rstrip()}" <!-- !ERROR: Included directory not found -->\n']
                     transform = Transform(linenum=linenum, oper="swap", data=error)
                     transforms.append(transform)
                     continue
 
-                images = ['.png','.apng', '.avif', '.gif', '.jpeg', '.jpg', '.svg', '.webp', '.bmp']
-                md = ['.md', '.mdpp', '.txt']
-
-                file_types = []
-                if match.group(3):
-                    file_types = ['.'+x.strip() for x in match.group(3).split(',')]
-                    #print('FORMATS:', file_types) REMME
-
-                data = []
-                for file in subfiles:
-                    name, ext = path.splitext(file)
-                    # If the extension is in the list of specified extensions OR extensions were unspecified 
-                    if ext in file_types or not file_types:
-                        if ext in images:
-                            data.append(f'![{path.basename(name)}]({file})\n\n')
-                        elif ext in md:
-                            data.append(f'!INCLUDE "{file}"\n\n')
-                        else:
-                            # Embed as code TODO: from here. Test this
-                            data.append(f'!INCLUDECODE "{file}"\n\n')
-
-                transform = Transform(linenum=linenum, oper="swap", data=data)
+                transform = Transform(linenum=linenum, oper="swap", data=lines)
                 transforms.append(transform)
-            
-            linenum += 1
+
         return transforms
+
+    def expand(self, file, name, ext, shift=0):
+        '''
+        Expands a file of an included directory, with what the directive
+        including it would have been replaced with
+
+        returns:
+            list: lines
+        '''
+        if ext in self.images:
+            line = f'![{path.basename(name)}]({file})\n\n'
+            include = self.peer('Include')
+            image_match = embedded_image_regex.search(line)
+            if include is None or not image_match:
+                return [line]
+            return [include.embed(line, image_match)]
+
+        if ext in self.md:
+            line = f'!INCLUDE "{file}"' + (f', LEVEL {shift}' if shift else '') + '\n\n'
+            include = self.peer('Include')
+            if include is None:
+                return [line]
+            if include.exceeded is not None:
+                return [f'!ERROR "{line.rstrip()}" <!-- !ERROR: Not included ({include.exceeded}) -->\n']
+            try:
+                return include.include_file(file, shift=shift)
+            except IncludeLimitError as exc:
+                # Stop including anything, rather than exhaust memory
+                include.exceeded = exc
+                return [f'!ERROR "{line.rstrip()}" <!-- !ERROR: {exc} -->\n']
+
+        # Embed as code
+        line = f'!INCLUDECODE "{file}"\n\n'
+        include_code = self.peer('IncludeCode')
+        code_match = include_code_regex.search(line)
+        if include_code is None or not code_match:
+            return [line]
+        code = include_code.include_code(code_match)
+        return [code] if isinstance(code, str) else code
@@ -6,25 +6,32 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import re
-import yaml
+import time
 
-from urllib.request import urlopen
-from urllib.parse import urlparse
-from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urlparse
 
 from MarkdownPP.Module import Module
 from MarkdownPP.Transform import Transform
+from MarkdownPP.Fetch import ConnectionPool
 
-from MarkdownPP.Common import frontmatter_regex
+from MarkdownPP.Common import read_frontmatter, frontmatter_body, load_yaml
 from MarkdownPP.Common import frontmatter_this_regex
-from MarkdownPP.Common import frontmatter_storage
 
 class IncludeURL(Module):
     """
     Module for recursively including the contents of other remote files into
     the current document using a command like
     `!INCLUDEURL "http://www.example.com"`.
-    Targets must be valid, absolute urls.
+    Targets must be valid, absolute urls; !INCLUDEURL in fetched content may
+    give urls relative to the page they are in.
+
+    Every url of a document is fetched before anything is included: the
+    urls of its directives first, then those of the directives in the
+    fetched pages, a level at a time, on a pool of threads sharing kept
+    alive connections to each host (see Fetch.ConnectionPool). A url is
+    fetched once however many times it's included. The pages are then
+    assembled in document order.
     """
     DEFAULT = False
     REMOTE = True
@@ -32,71 +39,158 @@ class IncludeURL(Module):
     includere = re.compile(r"^!INCLUDEURL\s+(?:\"([^\"]+)\"|'([^']+)')\s*(?:,\s*L?E?V?E?L?\s?(\d+))?\s*$")
 
     # include urls should happen after includes, but before everything else
-    priority = 2
+    priority = 3
 
+    # Threads fetching urls at the same time
+    workers = 8
+
+    # Seconds a request may wait for the server, and seconds all the
+    # fetching of a build may take (None for no limit). Builds override these
+    # with BuildContext.url_timeouts
+    timeouts = {'request': 10, 'total': 60}
+
+    # Lines handed to this module by the Processor's scanner
+    scanre = re.compile(r"^!INCLUDEURL\s")
+    directives = ('INCLUDEURL',)
+
+    def __init__(self):
+        super().__init__()
+        self.pages = {}             # url -> (frontmatter, lines) or the exception fetching it failed with
+
+    def transform_lines(self, data, linenums):
+        matches = {}
+        for linenum in linenums:
+            match = self.includere.search(data[linenum])
+            if match:
+                matches[linenum] = match
+
+        # Fetched again every build, the pages may have changed
+        self.pages = self.fetch([self.url(match) for match in matches.values()])
 
-    def transform(self, data):
         transforms = []
-        literal = False
-        for linenum, line in enumerate(data):
-            match = self.includere.search(line)
-
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
-                include_url_data = self.include(match)
-                transform = Transform(linenum=linenum, oper="swap", data=include_url_data)
-                transforms.append(transform)
-            
-            linenum += 1
+        for linenum, match in matches.items():
+            include_url_data = self.include(match)
+            transform = Transform(linenum=linenum, oper="swap", data=include_url_data)
+            transforms.append(transform)
+
         return transforms
 
+    def url_timeouts(self):
+        return {**self.timeouts, **(self.context.url_timeouts or {})}
 
-    def include(self, match):
-        # TODO: add shift functionality like in !INCLUDE
+    @staticmethod
+    def url(match, base=None):
         url = match.group(1) or match.group(2)
+        return urljoin(base, url) if base else url
+
+    def fetch(self, urls):
+        '''
+        Fetches urls and, breadth first, the urls included by the pages
+        fetched, each only once. Urls not fetched when the total timeout
+        runs out are given up on.
+
+        returns:
+            dict: {url: (frontmatter or None, lines) or the exception it failed with}
+        '''
+        timeouts = self.url_timeouts()
+        deadline = None if timeouts['total'] is None else time.monotonic() + timeouts['total']
+        pages = {}
+        urls = [url for url in dict.fromkeys(urls) if self.valid(url)]
+
+        pool = ConnectionPool(timeout=timeouts['request'], maxsize=self.workers)
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while urls:
+                futures = {executor.submit(pool.get, url): url for url in urls}
+                done, pending = wait(futures, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+
+                nested = []
+                for future, url in futures.items():
+                    if future in pending:
+                        future.cancel()
+                        pages[url] = TimeoutError(f"gave up after {timeouts['total']} seconds fetching the document's urls")
+                        continue
+                    try:
+                        body = future.result()
+                        if self.context.profile is not None:
+                            self.context.profile.count(read=len(body))
+                        page = self.parse(body)
+                    except Exception as exc:
+                        # Pages that can't be fetched (HTTPError and URLError are OSErrors,
+                        # unknown url types ValueErrors), decoded or parsed become errors
+                        pages[url] = exc
+                        continue
+                    pages[url] = page
+                    for line in page[1]:
+                        match = self.includere.search(line)
+                        if match:
+                            nested.append(self.url(match, url))
+
+                urls = [url for url in dict.fromkeys(nested) if url not in pages and self.valid(url)]
+        finally:
+            # Requests still running end with their own timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+            pool.close()
+        return pages
+
+    @staticmethod
+    def valid(url):
+        parsed_url = urlparse(url)
+        return parsed_url.netloc or parsed_url.path
+
+    def parse(self, body):
+        '''
+        Splits a page in lines and reads its YAML frontmatter
+
+        returns:
+            tuple: (frontmatter or None, lines without the frontmatter)
+        '''
+        # Lines as the server sent them, even if it doesn't split them
+        data = [line for line in re.split(r'(?<=\n)', body.decode()) if line]
+        frontmatter, end, rest = read_frontmatter(data)      # get yaml frontmatter as string
+        if frontmatter is None:
+            return None, data
+
+        frontmatter = load_yaml(frontmatter)   # get yaml frontmatter as dictionary from string
+        # Sneakily substitute "!FRONTMATTER this," to "!FRONTMATTER id.id,"
+        this_id = f"id.{frontmatter.get('id', 'UNDEF') if isinstance(frontmatter, dict) else 'UNDEF'}"
+        data = [frontmatter_this_regex.sub(f"!FRONTMATTER {this_id},", line)
+                for line in frontmatter_body(data, end, rest)]
+        return frontmatter, data
+
+    def include(self, match, base=None, parents=()):
+        # TODO: add shift functionality like in !INCLUDE
+        url = self.url(match, base)
 
         shift = int(match.group(3) or 0)
 
-        parsed_url = urlparse(url)
-        if not parsed_url.netloc and not parsed_url.path:
+        if not self.valid(url):
             return [] # TODO: add !ERROR for unresolved URL
 
-        try:
-            binary_data = urlopen(url).readlines()
-            data = []
-            for datum in binary_data:
-                data.append(datum.decode())
-            if data:
-                # YAML Frontmatter is detected, parsed and stored in memory
-                frontmatter = ''
-                match = frontmatter_regex.match(''.join(data))
-                if match:
-                    frontmatter, data = match.groups()         # get yaml frontmatter as string
-                    frontmatter = yaml.safe_load(frontmatter)   # get yaml frontmatter as dictionary from string
-                    if isinstance(frontmatter, list) or isinstance(frontmatter, dict):
-                        frontmatter_storage.frontmatter[parsed_url.geturl()] = frontmatter
-                    
-                    # Sneakily substitute "!FRONTMATTER this," to "!FRONTMATTER id.id,"
-                    this_id = f"id.{frontmatter.get('id', 'UNDEF')}"
-                    data = frontmatter_this_regex.sub(f"!FRONTMATTER {this_id},", data)
-
-                    data = [line+'\n' for line in data.split('\n')]
-
-                # recursively include url data
-                for line_num, line in enumerate(data):
-                    match = self.includere.search(line)
-                    if match:
-                        data[line_num:line_num+1] = self.include(match)
-
-                    line_num += 1
-
-                return data
-
-            return []
-        
-        except HTTPError as e:
-            return [ f'!ERROR "{match.string.rstrip()}" <!-- !ERROR: {e} -->\n']
+        if url in parents:
+            return [f'!ERROR "{match.string.rstrip()}" <!-- !ERROR: {url} includes itself -->\n']
+
+        page = self.pages.get(url)
+        if page is None:
+            # Not fetched with the document, eg include() called on its own
+            page = self.fetch([url])[url]
+            self.pages[url] = page
+        if isinstance(page, Exception):
+            # The error tag is a single line, YAML errors span several
+            error = ' '.join(str(page).split())
+            return [ f'!ERROR "{match.string.rstrip()}" <!-- !ERROR: {error} -->\n']
+
+        frontmatter, lines = page
+        # YAML Frontmatter is stored in memory
+        if isinstance(frontmatter, list) or isinstance(frontmatter, dict):
+            self.context.frontmatter[urlparse(url).geturl()] = frontmatter
+
+        # recursively include url data
+        data = []
+        for line in lines:
+            nested = self.includere.search(line)
+            if nested:
+                data.extend(self.include(nested, url, parents + (url,)))
+            else:
+                data.append(line)
+        return data
@@ -12,10 +12,8 @@ from http.client import HTTPConnection
 from urllib.parse import urlencode
 
 from MarkdownPP.Module import Module
-from MarkdownPP.Transform import Transform
-from MarkdownPP.Common import PROJECT_DIR
+from MarkdownPP.Transform import TransformBatch
 
-from sympy import preview
 from secrets import token_hex
 
 from os import path
@@ -25,12 +23,8 @@ singlelinere = re.compile(r"\$(\$?)..*\$(\$?)")
 # $... or ...$ (or $$... or ...$$)
 startorendre = re.compile(r"^\$(\$?)|^\S.*\$(\$?)$")
 
-codere = re.compile(r"^(    |\t)")
 spancodere = re.compile(r'(`[^`]+\`)')  # code between backticks
 
-# Support for Pandoc style code blocks with attributes
-fencedcodere = re.compile(r"^((> *)?```\w*|(> *)?~~~~*(\s*{.*})?)$")
-
 
 class LaTeXRender(Module):
     """
@@ -43,24 +37,17 @@ class LaTeXRender(Module):
     REMOTE = False
 
     def transform(self, data):
-        transforms = []
+        transforms = TransformBatch()
         in_block = False
         current_block = ""
-        in_fenced_code_block = False
+        literals = self.literal_index(data)
 
         for linenum, line in enumerate(data):
-            # Handling fenced code blocks (for Github-flavored markdown)
-            if fencedcodere.search(line):
-                if in_fenced_code_block:
-                    in_fenced_code_block = False
-                else:
-                    in_fenced_code_block = True
-
-            # Are we in a code block?
-            if not in_fenced_code_block and not codere.search(line):
+            # Are we in a code block? (fenced, indented, in blockquotes...)
+            if not literals[linenum]:
                 # Is this line part of an existing LaTeX block?
                 if in_block:
-                    transforms.append(Transform(linenum, "drop"))
+                    transforms.add(linenum, "drop")
                     current_block += "\n" + line
 
                 match = singlelinere.search(line)
@@ -77,10 +64,10 @@ class LaTeXRender(Module):
                         before_tex = line[0:line.find(tex)]
                         after_tex = line[(line.find(tex) + len(tex)):
                                          len(line)]
-                        transforms.append(Transform(linenum, "swap",
-                                                    before_tex +
-                                                    self.render(tex) +
-                                                    after_tex))
+                        transforms.add(linenum, "swap",
+                                       before_tex +
+                                       self.render(tex) +
+                                       after_tex)
                 else:
                     match = startorendre.search(line)
                     if match:
@@ -88,12 +75,12 @@ class LaTeXRender(Module):
                         if in_block:
                             # Ending a LaTeX block
                             transforms.pop()  # undo last drop
-                            transforms.append(Transform(linenum, "swap",
-                                              self.render(current_block)))
+                            transforms.add(linenum, "swap",
+                                           self.render(current_block))
                         else:
                             # Starting a LaTeX block
                             current_block = line
-                            transforms.append(Transform(linenum, "drop"))
+                            transforms.add(linenum, "drop")
                         in_block = not in_block
 
             linenum += 1
@@ -103,12 +90,18 @@ class LaTeXRender(Module):
 
 
     def render(self, formula):
-        img_file = path.join(PROJECT_DIR.IMAGES_DIR, f'latex_render_{token_hex(4)}.png')
+        # sympy takes a long time to import, only pay for it with actual math
+        from sympy import preview
+
+        img_file = path.join(self.context.images_dir, f'latex_render_{token_hex(4)}.png')
         preview(formula, viewer='file', filename=img_file)
+        self.context.outputs.append(img_file)
+        if self.context.profile is not None:
+            self.context.profile.count(written=path.getsize(img_file))
         
         # Display as Markdown image
         display_formula = formula.replace("\n", "")
-        rel_path = path.relpath(img_file, PROJECT_DIR.TOPLEVEL)
+        rel_path = path.relpath(img_file, self.context.toplevel)
         rendered_tex = '![{0}]({1} "{0}")\n'.format(display_formula, rel_path)
         return rendered_tex
         
\ No newline at end of file
@@ -22,26 +22,27 @@ class Reference(Module):
     DEFAULT = True
     REMOTE = False
 
-    def transform(self, data):
+    # Lines handed to this module by the Processor's scanner: !REF markers
+    # and link definitions
+    scanre = re.compile(r"^(!REF|\[)")
+    directives = ('REF',)
+    prefixes = ('[',)
+
+    def transform_lines(self, data, linenums):
         transforms = []
 
         reffound = False
         reflines = []
         refdata = ""
-        literal = False
 
         links = []
 
-        # iterate through the document looking for !REF markers and links
-        for linenum, line in enumerate(data):
+        # iterate through the candidate lines looking for !REF markers and links
+        for linenum in linenums:
+            line = data[linenum]
 
             match = refre.search(line)
-            if line[:3] == '```':
-                literal = not literal
-                continue
-            elif literal:
-                continue
-            elif match:
+            if match:
                 reffound = True
                 reflines.append(linenum)
 
@@ -55,8 +56,6 @@ class Reference(Module):
 
                 links.append((name, title))
 
-            linenum += 1
-
         # short circuit if no markers found
         if not reffound:
             return []
@@ -8,7 +8,7 @@ from __future__ import unicode_literals
 import re
 
 from MarkdownPP.Module import Module
-from MarkdownPP.Transform import Transform
+from MarkdownPP.Transform import TransformBatch
 
 tocre = re.compile(r"^!(TOC|TABLE_OF_CONTENTS),?\s?(LEVEL\s?)?([1-6])?\s*?$") 
 # Match group 1 contains the tag (TOC), group2 contains string 'level' (optional), group 3 is the subheader number
@@ -17,8 +17,6 @@ atxre = re.compile(r"^(#+)\s*(.+)$")
 
 setextre = re.compile(r"^(=+|-+)\s*$")
 
-fencedcodere = re.compile(r"^```[ \w]*$")
-
 linkre = re.compile(r"(\[(.*?)\][\(\[].*?[\)\]])")
 
 
@@ -51,7 +49,7 @@ class TableOfContents(Module):
         return title
 
     def transform(self, data):
-        transforms = []
+        transforms = TransformBatch()
 
         lowestdepth = 10
 
@@ -62,20 +60,17 @@ class TableOfContents(Module):
 
         headers = {}
 
-        infencedcodeblock = False
+        literals = self.literal_index(data)
 
         # iterate through the document looking for markers and headers
         linenum = 0
         lastline = ''
         for linenum, line in enumerate(data):
 
-            # Fenced code blocks (Github-flavored markdown)
-            match = fencedcodere.search(line)
-            if match:
-                if infencedcodeblock:
-                    infencedcodeblock = False
-                else:
-                    infencedcodeblock = True
+            # Markers and headers in code blocks are just examples
+            if literals[linenum]:
+                lastline = ''
+                continue
 
             # !TOC markers
             match = tocre.search(line)
@@ -89,7 +84,7 @@ class TableOfContents(Module):
 
             # hash headers
             match = atxre.search(line)
-            if match and not infencedcodeblock:
+            if match:
                 depth = len(match.group(1))
                 title = match.group(2).strip()
                 headers[linenum] = (depth, title)
@@ -99,7 +94,7 @@ class TableOfContents(Module):
 
             # underlined headers
             match = setextre.search(line)
-            if match and not infencedcodeblock and lastline.strip():
+            if match and lastline.strip():
                 depth = 1 if match.group(1)[0] == "=" else 2
                 title = lastline.strip()
                 headers[linenum-1] = (depth, title)
@@ -173,13 +168,13 @@ class TableOfContents(Module):
             tocdata += ("%s [%s](#%s)  \n" %
                         (section, TableOfContents.clean_title(title), short))
 
-            transforms.append(Transform(linenum, "swap",
-                              data[linenum].replace(title, section + title)))
-            transforms.append(Transform(linenum, "prepend",
-                              "<a name=\"%s\"></a>\n\n" % short))
+            transforms.add(linenum, "swap",
+                           data[linenum].replace(title, section + title))
+            transforms.add(linenum, "prepend",
+                           "<a name=\"%s\"></a>\n\n" % short)
 
         # create transforms for the !TOC markers
         for linenum in toclines:
-            transforms.append(Transform(linenum, "swap", tocdata))
+            transforms.add(linenum, "swap", tocdata)
 
         return transforms
@@ -15,8 +15,6 @@ youtube_url_re = re.compile(r'^!VIDEO\s+"https?://www\.youtube\.com'
                             r'/embed/([a-zA-Z0-9_\-]*)"')
 glowfoto_server_re = re.compile(r"<uploadform>(.*)</uploadform>")
 glowfoto_image_re = re.compile(r"<thumburl>(.*)</thumburl>")
-codere = re.compile(r"^(    |\t)")
-fencedcodere = re.compile(r"^```\w*$")
 
 play_button_url = 'http://i.imgur.com/1IHylPh.png'
 
@@ -29,43 +27,40 @@ class YoutubeEmbed(Module):
     DEFAULT = False
     REMOTE = True
 
-    def transform(self, data):
+    # Lines handed to this module by the Processor's scanner
+    scanre = youtube_url_re
+    directives = ('VIDEO',)
+
+    # Directives are swapped for their output in place, so the module can be
+    # streamed
+    LINE_LOCAL = True
+
+    def transform_lines(self, data, linenums):
         transforms = []
-        in_fenced_code_block = False
-
-        for linenum, line in enumerate(data):
-            # Handling fenced code blocks (for Github-flavored markdown)
-            if fencedcodere.search(line):
-                if in_fenced_code_block:
-                    in_fenced_code_block = False
-                else:
-                    in_fenced_code_block = True
-
-            # Are we in a code block?
-            if not in_fenced_code_block and not codere.search(line):
-                match = youtube_url_re.search(line)
-                if match:
-                    # find URL of youtube video and screenshot
-                    url = match.group(1)
-                    image_url = 'http://img.youtube.com/vi/%s/0.jpg' % url
-                    video_url = 'http://www.youtube.com/watch?v=%s' % url
-                    processed_image_dir = os.path.join('images', 'youtube')
-                    processed_image_path = os.path.join(processed_image_dir,
-                                                        '%s.png' % url)
-
-                    # do we already have a screenshot?
-                    if not os.path.isfile(processed_image_path):
-                        # create directories if needed
-                        if not os.path.exists(processed_image_dir):
-                            os.makedirs(processed_image_dir)
-
-                        self._add_play_button(image_url, processed_image_path)
-
-                    image_link = ('[![Link to Youtube video](%s)](%s)\n' %
-                                  (processed_image_path, video_url))
-                    transforms.append(Transform(linenum, "swap", image_link))
-
-            linenum += 1
+
+        for linenum in linenums:
+            match = youtube_url_re.search(data[linenum])
+            if match:
+                # find URL of youtube video and screenshot
+                url = match.group(1)
+                image_url = 'http://img.youtube.com/vi/%s/0.jpg' % url
+                video_url = 'http://www.youtube.com/watch?v=%s' % url
+                processed_image_dir = os.path.join('images', 'youtube')
+                processed_image_path = os.path.join(processed_image_dir,
+                                                    '%s.png' % url)
+
+                # do we already have a screenshot?
+                if not os.path.isfile(processed_image_path):
+                    # create directories if needed
+                    if not os.path.exists(processed_image_dir):
+                        os.makedirs(processed_image_dir)
+
+                    self._add_play_button(image_url, processed_image_path)
+                self.context.outputs.append(os.path.abspath(processed_image_path))
+
+                image_link = ('[![Link to Youtube video](%s)](%s)\n' %
+                              (processed_image_path, video_url))
+                transforms.append(Transform(linenum, "swap", image_link))
 
         return transforms
 
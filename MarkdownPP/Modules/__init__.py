@@ -5,10 +5,86 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import ast
 import os
+import re
+from collections import namedtuple
+from collections.abc import Mapping
+from importlib import import_module
 from os import path
 
-modules = {}
+
+ModuleInfo = namedtuple('ModuleInfo', ['name', 'classname', 'priority', 'DEFAULT', 'REMOTE', 'RESOLVES'])
+ModuleInfo.__doc__ = '''
+Metadata of a module, read from its source without importing it
+'''
+
+
+def read_info(filename, modulename):
+    '''
+    Reads the class attributes of the module class in filename, falling back
+    to the defaults of MarkdownPP.Module for those it doesn't set. Only the
+    attribute assignments in the class body are parsed, which is much quicker
+    than importing (or even parsing) the whole module.
+
+    returns:
+        ModuleInfo, or None if the file doesn't define a class named modulename
+    '''
+    with open(filename, encoding='utf-8') as f:
+        source = f.read()
+
+    start = classre(modulename).search(source)
+    if start is None:
+        return None
+    end = toplevelre.search(source, start.end())
+    body = source[start.end():end.start() if end else len(source)]
+
+    attributes = {'priority': 5, 'DEFAULT': False, 'REMOTE': True, 'RESOLVES': False}
+    for match in attributere.finditer(body):
+        statement = ast.parse(match.group(0).strip()).body[0]
+        attributes[match.group(1)] = ast.literal_eval(statement.value)
+    return ModuleInfo(modulename.lower(), modulename, **attributes)
+
+
+def classre(name):
+    return re.compile(rf'^class {name}\b.*$', flags=re.MULTILINE)
+
+# start of the next top level statement, ending a class body
+toplevelre = re.compile(r'^(?=[^\s#])', flags=re.MULTILINE)
+
+# class level assignments of the attributes in ModuleInfo
+attributere = re.compile(r'^    (priority|DEFAULT|REMOTE|RESOLVES)\s*=.*$', flags=re.MULTILINE)
+
+
+class LazyModules(Mapping):
+    """
+    Maps module nicknames to module classes, importing each module file only
+    when its class is first looked up. `info` holds the metadata of every
+    module, which is all the CLI needs for --help and the default selection.
+    """
+
+    def __init__(self):
+        self.info = {}
+        self.classes = {}
+
+    def __getitem__(self, name):
+        if name not in self.classes:
+            info = self.info[name]
+            module = import_module(f'MarkdownPP.Modules.{info.classname}')
+            self.classes[name] = getattr(module, info.classname)
+        return self.classes[name]
+
+    def __iter__(self):
+        return iter(self.info)
+
+    def __len__(self):
+        return len(self.info)
+
+    def __contains__(self, name):
+        return name in self.info
+
+
+modules = LazyModules()
 
 
 def load_modules():
@@ -17,10 +93,8 @@ def load_modules():
     for filename in os.listdir(dirname):
         (modulename, extension) = path.splitext(filename)
         if extension.lower() == ".py" and modulename.lower() != "__init__":
-            module = __import__("MarkdownPP.Modules.%s" % modulename,
-                                fromlist=[modulename])
-            if modulename in dir(module):
-                nickname = modulename.lower()
-                modules[nickname] = module.__dict__[modulename]
+            info = read_info(path.join(dirname, filename), modulename)
+            if info is not None:
+                modules.info[info.name] = info
 
 load_modules()
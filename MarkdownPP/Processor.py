@@ -5,10 +5,13 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import sys
+import logging
 
-if sys.version_info[0] != 2:
-    basestring = str
+from contextlib import nullcontext
+
+from MarkdownPP.Literal import LiteralIndex
+from MarkdownPP.Scanner import Scanner
+from MarkdownPP.Transform import apply_transforms
 
 
 class Processor:
@@ -16,32 +19,72 @@ class Processor:
     Framework for allowing modules to modify the input data as a set of
     transforms. Once the original input data is loaded, the preprocessor
     iteratively allows Modules to inspect the data and generate a list of
-    Transforms against the data.  The Transforms are applied in descending
-    order by line number, and the resulting data is used for the next pass.
+    Transforms against the data.  The Transforms are applied as if in
+    descending order by line number (see apply_transforms), and the resulting
+    data is used for the next pass.
     Once all modules have transformed the data, it is ready for writing out
     to a file.
+
+    Modules with a `scanre` don't walk the data themselves: a shared Scanner
+    classifies every line for all of them in a single pass, and only needs to
+    walk the data again once a module has actually changed it.
+    `scan_counts` records how many lines each module had to look at.
+    Which lines are code, and so off limits to modules, is worked out once
+    per document into a LiteralIndex that is updated along with the data.
+
+    When every registered module is LINE_LOCAL the document is never loaded
+    as a whole: input() keeps a lazy iterator over the file, process() chains
+    the modules' stream() generators and output() writes each line as soon
+    as it comes out of the last one.
+
+    Setting `profile` to a Profile records timings and counters per module.
+    The BuildContext given to the Processor is handed to every module it
+    registers, and provides the profile.
     """
 
     data = []
     transforms = {}
     modules = []
+    scanner = None
+    literals = None
+    profile = None
 
-    def __init__(self,encoding):
+    def __init__(self,encoding, context=None):
         self.encoding = encoding
         self.modules = []
+        self.scan_counts = {}
+        self.context = context
+        if context is not None:
+            self.profile = context.profile
     
     def register(self, module):
         """
         This method registers an individual module to be called when processing
         """
+        if self.context is not None:
+            module.context = self.context
+        module.peers = self.modules
         self.modules.append(module)
 
+    @property
+    def streaming(self):
+        """
+        True when the registered modules allow streaming the document
+        """
+        if self.profile is not None and self.profile.dump_dir is not None:
+            # cProfile can't tell apart modules interleaved in a stream
+            return False
+        return all(module.LINE_LOCAL for module in self.modules)
+
     def input(self, file):
         """
         This method reads the original data from an object following
         the file interface.
         """
-        self.data = file.readlines()
+        if self.streaming:
+            self.data = iter(file)
+        else:
+            self.data = file.readlines()
 
     def process(self):
         """
@@ -49,29 +92,53 @@ class Processor:
         """
         self.modules.sort(key=lambda x: x.priority)
 
-        for module in self.modules:
-            transforms = module.transform(self.data)
-            transforms.sort(key=lambda x: x.linenum, reverse=True)
-            for transform in transforms:
-                linenum = transform.linenum
+        scanner = self.scanner = Scanner(self.modules, counts=self.scan_counts)
+        profile = self.profile
 
-                if isinstance(transform.data, basestring):
-                    transform.data = [transform.data]
+        if self.streaming:
+            # Nothing is read until output() starts pulling lines through
+            upstream = None
+            for module in self.modules:
+                name = module.__class__.__name__.lower()
+                self.data = module.stream(self.data, scanner)
+                if profile is not None:
+                    profile.module(name)    # keep the report in run order
+                    self.data = profile.stream(name, self.data, upstream)
+                upstream = name
+            return
 
-                if transform.oper == "prepend":
-                    self.data[linenum:linenum] = transform.data
+        hits = None
+        literals = self.literals = LiteralIndex(self.data)
 
-                elif transform.oper == "append":
-                    self.data[linenum+1:linenum+1] = transform.data
+        for index, module in enumerate(self.modules):
+            name = module.__class__.__name__.lower()
+            module.literals = literals
 
-                elif transform.oper == "swap":
-                    self.data[linenum:linenum+1] = transform.data
+            with profile.measure(name) if profile is not None else nullcontext():
+                if module.scanre is None:
+                    transforms = module.transform(self.data)
+                    self.scan_counts[name] = self.scan_counts.get(name, 0) + len(self.data)
+                else:
+                    if hits is None:
+                        # Classify lines for this and all following modules at once
+                        hits = scanner.scan(self.data, self.modules[index:], literals)
+                    transforms = module.transform_lines(self.data, hits[module])
 
-                elif transform.oper == "drop":
-                    self.data[linenum:linenum+1] = []
+            if profile is not None:
+                profile.module(name)['transforms'] += len(transforms or ())
 
-                elif transform.oper == "noop":
-                    pass
+            if not transforms:
+                continue
+
+            # The data is about to change, so any classification is stale
+            hits = None
+
+            with profile.measure(name, 'apply') if profile is not None else nullcontext():
+                self.data = apply_transforms(self.data, transforms)
+                literals.update(self.data, transforms)
+
+        logging.debug(f'scanner passes: {scanner.passes}, lines tested against module regexes: {scanner.tested}, '
+                      f'lines scanned per module: {self.scan_counts}')
 
 
     def output(self, file):
@@ -79,4 +146,11 @@ class Processor:
         This method writes the resulting data to an object following
         the file interface.
         """
+        # When streaming, self.data is a generator and lines are processed
+        # and written one at a time
         file.writelines(self.data)
+
+        if self.profile is not None:
+            # Complete once a stream has been written out
+            for name, stats in self.profile.stats.items():
+                stats['lines'] = self.scan_counts.get(name, 0)
@@ -0,0 +1,187 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import time
+
+from contextlib import contextmanager
+from os import path, mkdir
+
+
+class Profile:
+    """
+    Collects per module timings and counters for a Processor run.
+
+    For every module it records the wall and CPU time spent in the module,
+    the lines the scanner handed to it, the transforms it emitted, the time
+    spent applying those transforms, the bytes it read and wrote (through
+    read_file(), IncludeURL downloads, copied images and rendered LaTeX) and
+    how many files it found in the parsed file cache (hits) or had to parse
+    (misses), see FileCache.
+
+    When `dump_dir` is given every module also runs under cProfile and its
+    statistics are written to `<dump_dir>/<module>.pstats`, to be inspected
+    with the pstats module or a viewer like snakeviz.
+
+    Nothing here is touched unless a Profile is set as the BuildContext's
+    `profile`, so a build without --profile only pays for a few `is None`
+    checks.
+    """
+    COLUMNS = ('wall', 'cpu', 'lines', 'transforms', 'apply', 'read', 'written', 'hits', 'misses')
+    TIMES = ('wall', 'cpu', 'apply')
+    # Counted for the whole run by count(), and attributed to the module
+    # running at the time
+    COUNTERS = ('read', 'written', 'hits', 'misses')
+
+    def __init__(self, dump_dir=None):
+        self.dump_dir = dump_dir
+        self.stats = {}         # module -> {column: value}
+        self.profilers = {}     # module -> cProfile.Profile
+        self.counters = dict.fromkeys(self.COUNTERS, 0)     # so far in the run
+        self.inclusive = {}     # module -> (wall, cpu, counters) including upstream modules, when streaming
+
+    def module(self, name):
+        '''
+        Returns the statistics of a module, creating them on first use
+        '''
+        if name not in self.stats:
+            self.stats[name] = {column: 0.0 if column in self.TIMES else 0 for column in self.COLUMNS}
+        return self.stats[name]
+
+    def count(self, **counts):
+        '''
+        Adds to the run's counters, eg count(read=1024) or count(hits=1)
+        '''
+        for counter, value in counts.items():
+            self.counters[counter] += value
+
+    @property
+    def read(self):
+        return self.counters['read']
+
+    @property
+    def written(self):
+        return self.counters['written']
+
+    def counted(self, since):
+        '''
+        Returns how much each counter grew since the `since` snapshot of counters
+        '''
+        return {counter: value - since[counter] for counter, value in self.counters.items()}
+
+    @contextmanager
+    def measure(self, name, column='wall'):
+        '''
+        Times the with block, adding it to the module's wall and CPU time (or
+        to `column`, eg 'apply'), together with what was counted meanwhile.
+        '''
+        stats = self.module(name)
+        profiler = self.profiler(name) if column == 'wall' else None
+        counters = dict(self.counters)
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stats
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            stats[column] += time.perf_counter() - wall
+            if column == 'wall':
+                stats['cpu'] += time.process_time() - cpu
+            for counter, value in self.counted(counters).items():
+                stats[counter] += value
+
+    def profiler(self, name):
+        if self.dump_dir is None:
+            return None
+        if name not in self.profilers:
+            import cProfile
+            self.profilers[name] = cProfile.Profile()
+        return self.profilers[name]
+
+    def stream(self, name, lines, upstream=None):
+        '''
+        Wraps the generator a module returned from stream(). Lines are pulled
+        through the whole chain of modules, so the time spent in the
+        upstream modules is subtracted once the document was streamed.
+
+        parameters:
+            name (str): the module's name
+            lines (iterator): the module's output
+            upstream (str): name of the module feeding it, if any
+        '''
+        stats = self.module(name)
+        wall = cpu = 0
+        counters = dict(self.counters)
+        try:
+            while True:
+                start, start_cpu = time.perf_counter(), time.process_time()
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    return
+                finally:
+                    wall += time.perf_counter() - start
+                    cpu += time.process_time() - start_cpu
+                yield line
+        finally:
+            counted = self.counted(counters)
+            self.inclusive[name] = (wall, cpu, counted)
+            up = self.inclusive.get(upstream, (0, 0, {}))
+            stats['wall'] += wall - up[0]
+            stats['cpu'] += cpu - up[1]
+            for counter, value in counted.items():
+                stats[counter] += value - up[2].get(counter, 0)
+
+    def dump(self):
+        '''
+        Writes the cProfile statistics of each module to dump_dir
+        '''
+        if self.dump_dir is None:
+            return
+        if not path.isdir(self.dump_dir):
+            mkdir(self.dump_dir)
+        for name, profiler in self.profilers.items():
+            profiler.dump_stats(path.join(self.dump_dir, f'{name}.pstats'))
+
+    # Reports
+    # ===
+
+    def totals(self):
+        totals = {column: 0.0 if column in self.TIMES else 0 for column in self.COLUMNS}
+        for stats in self.stats.values():
+            for column in self.COLUMNS:
+                totals[column] += stats[column]
+        return totals
+
+    def as_dict(self):
+        return {'modules': self.stats, 'total': self.totals()}
+
+    def json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def table(self):
+        '''
+        Returns the statistics as a plain text table, one row per module in
+        run order followed by the totals.
+        '''
+        header = ('module', 'wall (s)', 'cpu (s)', 'lines', 'transforms', 'apply (s)', 'read (B)', 'written (B)',
+                  'file hits', 'file misses')
+        rows = [header]
+        for name, stats in list(self.stats.items()) + [('total', self.totals())]:
+            rows.append((name,) + tuple(
+                f'{stats[column]:.4f}' if isinstance(stats[column], float) else str(stats[column])
+                for column in self.COLUMNS))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = []
+        for row in rows:
+            lines.append('  '.join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]))
+        lines.insert(1, '-' * len(lines[0]))
+        lines.insert(len(lines) - 1, '-' * len(lines[0]))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,156 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+
+from MarkdownPP.Literal import LiteralIndex, BLANK, classify
+
+
+# Keyword of a `!KEYWORD` directive at the start of a line
+directivere = re.compile(r"!(\w+)")
+
+
+class Scanner:
+    """
+    Single pass line classifier shared by all modules in a Processor run.
+    Modules register interest in lines by setting a `scanre` regular
+    expression. The scanner walks the document once, skips literal lines
+    (code blocks, see LiteralIndex) and hands each module only the line
+    numbers its `scanre` matched, instead of every module walking the whole
+    document with its own regexes.
+
+    Modules also declare the keywords of the `!` directives they handle
+    (`directives`) and any other line starts their scanre matches
+    (`prefixes`). Together these are a registry the scanner routes lines
+    with: a line whose first character starts none of them is skipped on a
+    single dictionary lookup, a directive line goes through one keyword
+    regex and a dictionary to the modules owning the keyword, and only
+    those modules' scanre confirm it. Prose never meets a module regex.
+    Modules declaring neither still get their scanre run on every line.
+
+    `counts` keeps track of how many lines were handed to (and so scanned by)
+    each module, keyed by module name, and `tested` how many lines got past
+    the routing to a module regex.
+    """
+
+    def __init__(self, modules=(), counts=None):
+        self.modules = [m for m in modules if m.scanre is not None]
+        self.counts = {} if counts is None else counts
+        self.passes = 0
+        self.tested = 0
+
+    @staticmethod
+    def routes(matchers):
+        '''
+        Builds the routing tables for (module, value) pairs
+
+        returns:
+            tuple: ({first character: [(prefix, value), ...]},
+                    {directive keyword: [value, ...]},
+                    [value, ...] of modules matching anywhere)
+        '''
+        prefixes, keywords, anywhere = {}, {}, []
+        for module, value in matchers:
+            if not (module.directives or module.prefixes):
+                anywhere.append(value)
+                continue
+            for keyword in module.directives:
+                keywords.setdefault(keyword, []).append(value)
+            if module.directives:
+                prefixes.setdefault('!', [])
+            for prefix in module.prefixes:
+                prefixes.setdefault(prefix[0], []).append((prefix, value))
+        return prefixes, keywords, anywhere
+
+    def scan(self, data, modules=None, literals=None):
+        '''
+        Walks the data once and classifies each line for the given modules.
+
+        parameters:
+            data (list): the document as a list of lines
+            modules (list): modules to classify for (defaults to all registered)
+            literals (LiteralIndex): index of data, built if not given
+
+        returns:
+            dict: {module: [linenum, ...]} for every module with a `scanre`
+        '''
+        if modules is None:
+            modules = self.modules
+        modules = [m for m in modules if m.scanre is not None]
+        hits = {module: [] for module in modules}
+        if not modules:
+            return hits
+
+        if literals is None or literals.lines is not data:
+            literals = LiteralIndex(data)
+        kinds = literals.kinds
+
+        self.passes += 1
+        prefixes, keywords, anywhere = self.routes(
+            (module, (module.scanre.search, hits[module])) for module in modules)
+        directive = directivere.match
+        tested = 0
+
+        for linenum, line in enumerate(data):
+            routed = prefixes.get(line[:1])
+            if routed is None and not anywhere or kinds[linenum]:
+                continue
+
+            candidates = list(anywhere)
+            if routed:
+                candidates += [value for prefix, value in routed if line.startswith(prefix)]
+            match = directive(line) if routed is not None else None
+            if match:
+                candidates += keywords.get(match.group(1), ())
+
+            tested += bool(candidates)
+            for search, lines in candidates:
+                if (not lines or lines[-1] != linenum) and search(line):
+                    lines.append(linenum)
+
+        self.tested += tested
+        for module, lines in hits.items():
+            name = module.__class__.__name__.lower()
+            self.counts[name] = self.counts.get(name, 0) + len(lines)
+
+        return hits
+
+    def classify(self, module, lines):
+        '''
+        Streaming counterpart of scan() for a single module: walks an iterable
+        of lines lazily and yields (line, candidate) pairs, where candidate is
+        True for the lines the module's scanre matched outside of code blocks.
+
+        parameters:
+            module (Module): the module to classify lines for
+            lines (iterable): the document, one line at a time
+
+        yields:
+            tuple: (line, candidate)
+        '''
+        name = module.__class__.__name__.lower()
+        search = module.scanre.search
+        prefixes, keywords, anywhere = self.routes([(module, True)])
+        state = BLANK
+        count = 0
+        tested = 0
+
+        try:
+            for line in lines:
+                literal, state = classify(line, state)
+                if literal or not anywhere and line[:1] not in prefixes:
+                    yield line, False
+                    continue
+                tested += 1
+                if search(line):
+                    count += 1
+                    yield line, True
+                else:
+                    yield line, False
+        finally:
+            self.counts[name] = self.counts.get(name, 0) + count
+            self.tested += tested
@@ -5,6 +5,17 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import sys
+from array import array
+
+if sys.version_info[0] != 2:
+    basestring = str
+
+# Operation codes used by TransformBatch
+NOOP, PREPEND, APPEND, SWAP, DROP = range(5)
+OPERATIONS = ("noop", "prepend", "append", "swap", "drop")
+OPCODES = {oper: code for code, oper in enumerate(OPERATIONS)}
+
 
 class Transform:
     """
@@ -25,3 +36,135 @@ class Transform:
     def __str__(self):
         return ("Transform: (line: %d, oper: %s, data: %s)" %
                 (self.linenum, self.oper, self.data))
+
+
+class TransformBatch:
+    """
+    Compact, column oriented list of Transforms. Line numbers and operation
+    codes are kept in parallel arrays and the data in a plain list, so
+    modules generating a lot of transforms (eg TableOfContents) don't pay
+    for a Python object per edit. The Processor consumes batches directly,
+    and iterating over one yields Transform objects for everything else.
+    """
+
+    __slots__ = ('linenums', 'opers', 'data')
+
+    def __init__(self, transforms=()):
+        self.linenums = array('q')
+        self.opers = array('b')
+        self.data = []
+        self.extend(transforms)
+
+    def add(self, linenum, oper="noop", data=""):
+        """
+        Adds a single transform, same arguments as Transform()
+        """
+        self.linenums.append(linenum)
+        self.opers.append(OPCODES[oper])
+        self.data.append(data)
+
+    def extend(self, transforms):
+        """
+        Adds all transforms from another batch or an iterable of Transforms
+        """
+        if isinstance(transforms, TransformBatch):
+            self.linenums.extend(transforms.linenums)
+            self.opers.extend(transforms.opers)
+            self.data.extend(transforms.data)
+        else:
+            for transform in transforms:
+                self.add(transform.linenum, transform.oper, transform.data)
+
+    def pop(self):
+        """
+        Removes and returns the last transform added
+        """
+        return Transform(self.linenums.pop(), OPERATIONS[self.opers.pop()], self.data.pop())
+
+    def __len__(self):
+        return len(self.linenums)
+
+    def __iter__(self):
+        for linenum, oper, data in zip(self.linenums, self.opers, self.data):
+            yield Transform(linenum, OPERATIONS[oper], data)
+
+
+def apply_transforms(data, transforms):
+    """
+    Applies a list of Transforms (or a TransformBatch) to data and returns
+    the resulting list of lines. The result is the same as applying the transforms one by one in
+    descending order by line number (transforms on the same line keep the
+    order they were generated in), but the new document is built in a single
+    merge pass instead of shifting the tail of the list for every transform.
+
+    The output is assembled back to front as a reversed list of pieces:
+    untouched runs of the original data are copied in between the lines that
+    have transforms. Those lines are edited in a small local segment, which
+    borrows the first line of the already finished tail only when an
+    operation reaches past the segment (eg two drops on the same line).
+    Transforms past the end of the data apply at the end of the document.
+    """
+    if not transforms:
+        return data
+
+    if not isinstance(transforms, TransformBatch):
+        transforms = TransformBatch(transforms)
+    linenums, opers, payloads = transforms.linenums, transforms.opers, transforms.data
+
+    size = len(data)
+    # Stable sort, so transforms on the same line keep their order
+    order = sorted(range(len(linenums)), key=linenums.__getitem__)
+
+    out = []        # the finished document, reversed
+    end = size      # original lines from here on are already in out
+
+    last = len(order)
+    while last > 0:
+        # Find the group of transforms sharing the highest remaining line
+        first = last - 1
+        linenum = linenums[order[first]]
+        while first > 0 and linenums[order[first - 1]] == linenum:
+            first -= 1
+        group = order[first:last]
+        last = first
+        linenum = min(max(linenum, 0), size)
+
+        # Copy the untouched lines following this one
+        if linenum < end:
+            out.extend(reversed(data[linenum+1:end]))
+            segment = data[linenum:linenum+1]
+            end = linenum
+        else:
+            segment = []
+
+        for index in group:
+            oper = opers[index]
+            if oper == NOOP:
+                continue
+
+            lines = payloads[index]
+            if isinstance(lines, basestring):
+                lines = [lines]
+
+            if oper == PREPEND:
+                segment[0:0] = lines
+                continue
+
+            # Every other operation needs the line at (or after) linenum
+            if not segment and out:
+                segment.append(out.pop())
+
+            if oper == APPEND:
+                segment[1:1] = lines
+
+            elif oper == SWAP:
+                segment[0:1] = lines
+
+            elif oper == DROP:
+                segment[0:1] = []
+
+        out.extend(reversed(segment))
+
+    out.extend(reversed(data[0:end]))
+    out.reverse()
+    return out
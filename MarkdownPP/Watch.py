@@ -0,0 +1,96 @@
+# Copyright 2015 John Reese
+# Licensed under the MIT license
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+
+from contextlib import contextmanager
+from os import path, remove, replace
+
+
+def changed(cache, deps):
+    '''
+    Returns the dependencies that no longer match their recorded signature.
+
+    parameters:
+        cache (BuildCache): used to compute the current signatures
+        deps (dict): {(kind, target): signature} as collected in BuildCache.deps
+
+    returns:
+        list of (kind, target) that changed, were created or were removed
+    '''
+    current = signatures(cache, deps)
+    return [dep for dep, signature in deps.items() if current[dep] != signature]
+
+
+def signatures(cache, deps):
+    '''
+    Returns the current signature of each dependency in deps
+    '''
+    # Signatures are memoised per build, forget them to look at the disk again
+    cache.recheck()
+    return {dep: cache.signature(dep[0], dep[1], signature) for dep, signature in deps.items()}
+
+
+def wait_for_changes(cache, deps, interval=0.5, debounce=0.2, timeout=None):
+    '''
+    Polls the dependencies of the last build until one of them changes, then
+    waits for the changes to settle so a burst of saves (editors writing a
+    backup, several files saved at once) triggers a single rebuild.
+
+    Polling keeps the watcher dependency free. Unchanged files only cost a
+    stat() call, their content is only hashed again when their modification
+    time or size changed.
+
+    parameters:
+        cache (BuildCache): used to compute the current signatures
+        deps (dict): {(kind, target): signature} of the last build
+        interval (float): seconds between polls
+        debounce (float): seconds without further changes before returning
+        timeout (float): give up after this many seconds, None to wait forever
+
+    returns:
+        list of (kind, target) that changed, empty on timeout
+    '''
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    while True:
+        if changed(cache, deps):
+            # Debounce: wait until the signatures stop moving
+            snapshot = None
+            while True:
+                current = signatures(cache, deps)
+                if current == snapshot:
+                    break
+                snapshot = current
+                time.sleep(debounce)
+            found = [dep for dep, signature in deps.items() if current[dep] != signature]
+            if found:
+                return found
+            # Changed and changed back again, keep waiting
+        if deadline is not None and time.monotonic() >= deadline:
+            return []
+        time.sleep(interval)
+
+
+@contextmanager
+def atomic_output(filename, mode='w', encoding=None):
+    '''
+    Opens a temporary file next to filename and moves it over filename once
+    the with block completes, so readers never see a partially written
+    file. The temporary file is removed if the block raises.
+    '''
+    directory, name = path.split(path.abspath(filename))
+    tmp = path.join(directory, f'.{name}.tmp')
+    f = open(tmp, mode, encoding=encoding)
+    try:
+        with f:
+            yield f
+        replace(tmp, filename)
+    except BaseException:
+        if path.exists(tmp):
+            remove(tmp)
+        raise
@@ -13,14 +13,24 @@ import sys
 import MarkdownPP
 import click
 import sys
+import glob
+import time
 import logging
 
+from io import StringIO
+
 from os import path
-from os import mkdir, access, getcwd, remove
+from os import mkdir, makedirs, access, getcwd, remove, cpu_count
 from os import W_OK, X_OK
 
 from MarkdownPP import Modules
-from MarkdownPP.Common import PROJECT_DIR
+from MarkdownPP.Common import PROJECT_DIR, set_toplevel
+from MarkdownPP.Context import BuildContext, current_context
+from MarkdownPP.Cache import BuildCache
+from MarkdownPP.Watch import wait_for_changes, atomic_output
+from MarkdownPP.Depfile import dependencies, display, write_depfile
+from MarkdownPP.Profile import Profile
+from MarkdownPP.Listing import DirectoryListing
 
 
 # Terminal output ANSI color codes
@@ -34,9 +44,10 @@ class colors:
 
 # Create help string
 help_str = '\b\nModules: (in run order)\n '
-modules = sorted(Modules.modules, key = lambda x: Modules.modules[x]().priority)
+# Module metadata is read without importing the modules themselves
+modules = sorted(Modules.modules, key = lambda x: Modules.modules.info[x].priority)
 for name in modules:
-    m = Modules.modules[name]()
+    m = Modules.modules.info[name]
     d = 'enabled |' if m.DEFAULT else '* disabled |'
     r = (colors.RED + 'REMOTE CALLS' + colors.NORMAL) if m.REMOTE else (colors.GREEN + 'local only' + colors.NORMAL)
     help_str += "\n{: >18} {: >12} {: >15}".format(f'{name} |', d, r)
@@ -45,18 +56,30 @@ for name in modules:
 @click.command(help=help_str)
 @click.option('--output', '-o', help='Output single file.', type=click.File(mode='w'))
 @click.option('--collect', '-c', help='Output self-contained report and all files to a directory.', type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--output-dir', '-d', help='Output one file per input to a directory.', type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--jobs', '-j', help='Worker processes rendering several inputs (default: one per CPU).', type=click.IntRange(min=1))
 @click.option('--include', '-i', help='Run only the specified modules (comma separated)', type=str)
 @click.option('--exclude', '-e', help='Run all modules except the specified modules (comma separated)', type=str)
 @click.option('--all-modules', '-a', help='Run all modules', is_flag=True)
+@click.option('--cache', help='Reuse include expansions whose files did not change since the last build (cache is kept next to the output).', is_flag=True)
+@click.option('--include-once', help='Expand files included several times in a report only the first time.', is_flag=True)
+@click.option('--include-limit', help='Limit the include tree, eg depth=16, lines=100000 or bytes=10000000 (none for no limit, repeatable).', multiple=True, callback=lambda ctx, param, value: parse_limits(value))
+@click.option('--url-timeout', help='Give up on !INCLUDEURL requests after request=10 seconds each, or fetching after total=60 seconds (none for no limit, repeatable).', multiple=True, callback=lambda ctx, param, value: parse_timeouts(value))
+@click.option('--depfile', help='Write a make style rule listing every file the report depends on to this file.', type=click.Path(dir_okay=False))
+@click.option('--list-deps', help='Only resolve includes (without running the other modules) and print the files the inputs depend on.', is_flag=True)
+@click.option('--watch', '-w', help='Keep running and rebuild whenever a file read by the build changes.', is_flag=True)
+@click.option('--profile', help='Print the time, lines, transforms and bytes of each module to stderr.', is_flag=True)
+@click.option('--profile-json', help='Write the --profile statistics as JSON to a file (- for stderr).', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--profile-dir', help='Run each module under cProfile and write <module>.pstats files to this directory.', type=click.Path(dir_okay=True, file_okay=False))
 # @click.option('--log', '-l', help='Enable debug, warn and error logging', is_flag=True)                # Not yet implemented
-@click.argument('input', type=click.File(mode='r'))
-def cli(output, collect, include, exclude, all_modules, input):
+@click.argument('inputs', nargs=-1, required=True, type=click.Path(allow_dash=True))
+def cli(output, collect, output_dir, jobs, include, exclude, all_modules, cache, include_once, include_limit, url_timeout, depfile, list_deps, watch, profile, profile_json, profile_dir, inputs):
 
     PROJECT_DIR.COLLECT = collect
+    PROJECT_DIR.INCLUDE_ONCE = include_once
+    PROJECT_DIR.INCLUDE_LIMITS = include_limit
+    PROJECT_DIR.URL_TIMEOUTS = url_timeout
 
-    # Save the input file path 
-    PROJECT_DIR.INPUT_FILE = path.abspath(input.name)
- 
     # Set modules to run
     modules = list(MarkdownPP.modules)
     if include and exclude:
@@ -75,7 +98,25 @@ def cli(output, collect, include, exclude, all_modules, input):
             modules = [mod for mod in modules if mod not in input_modules]
     elif not all_modules:
         # Run default only unless all_modeuls is true
-        modules = [name for name in Modules.modules if Modules.modules[name]().DEFAULT]
+        modules = [name for name in Modules.modules if Modules.modules.info[name].DEFAULT]
+
+    sources = expand_inputs(inputs)
+    if list_deps:
+        return list_dependencies(sources, modules)
+
+    if len(sources) > 1 or output_dir:
+        if output or watch or depfile or profile or profile_json or profile_dir:
+            click.echo('Several inputs are written with --output-dir or --collect, and can not be watched, profiled or get a --depfile.')
+            return -1
+        if bool(output_dir) == bool(collect):
+            click.echo('Several inputs need either --output-dir or --collect.')
+            return -1
+        return render_batch(sources, output_dir or collect, bool(collect), modules, cache, jobs)
+
+    input = click.open_file(sources[0])
+
+    # Save the input file path 
+    PROJECT_DIR.INPUT_FILE = path.abspath(input.name)
     
     # Handle output file / directory
     if output and collect:
@@ -94,28 +135,285 @@ def cli(output, collect, include, exclude, all_modules, input):
                 click.echo('Path to directory must be valid. Only collection directory will be created')
                 return -1
         # Set output to be in collection directory
-        output = open(path.join(collection_dir, 'Report.md'), mode='w')
+        output = path.join(collection_dir, 'Report.md')
         if path.isdir(collection_dir) and access(collection_dir, W_OK | X_OK):
             # If collection dir is a directory and writable, set accordingly
-            PROJECT_DIR.TOPLEVEL = collection_dir
-            PROJECT_DIR.IMAGES_DIR = path.join(collection_dir, 'images')
-            PROJECT_DIR.FRONTMATTER_FILE = path.join(collection_dir, 'frontmatter.yaml')
-            PROJECT_DIR.LOG_FILE = path.join(collection_dir, 'debug.log')
+            set_toplevel(collection_dir)
         else:
             click.echo(f'Make sure collection directory is not a file and is writable.\n\t{collect} ')
             return -1
     else:
         # Otherwise set current working directory
-        cwd = getcwd()
-        PROJECT_DIR.TOPLEVEL = cwd
-        PROJECT_DIR.IMAGES_DIR = path.join(cwd, 'images')
-        PROJECT_DIR.FRONTMATTER_FILE = path.join(cwd, 'frontmatter.yaml')
-        PROJECT_DIR.LOG_FILE = path.join(cwd, 'debug.log')
-        
-    # Run preprocessor
-    MarkdownPP.MarkdownPP(input=input, output=output, modules=modules)
+        set_toplevel(getcwd())
 
-    # Close the handlers
+    # Write to a file by name, so it can be replaced atomically
+    if output is not sys.stdout and not collect:
+        if output.name == '-':
+            output = sys.stdout
+        else:
+            output = path.abspath(output.name)
+
+    if depfile and output is sys.stdout:
+        click.echo('A --depfile needs the report written to a file, give --output or --collect.')
+        return -1
+
+    if watch and not path.isfile(PROJECT_DIR.INPUT_FILE):
+        click.echo("Can't watch standard input, give the input file by name.")
+        return -1
+
+    # Incremental build cache, next to the output
+    if cache:
+        if output is not sys.stdout and not collect:
+            cache_file = output + '.mdpp-cache'
+        else:
+            cache_file = path.join(PROJECT_DIR.TOPLEVEL, '.mdpp-cache')
+        PROJECT_DIR.CACHE = BuildCache(cache_file)
+    elif watch or depfile:
+        # Only kept in memory, but it tracks what the build read
+        PROJECT_DIR.CACHE = BuildCache()
+
+    if profile or profile_json or profile_dir:
+        profile = (profile, profile_json, profile_dir)
+
+    build(input, output, modules, profile, depfile=depfile)
     input.close()
-    if output:
-        output.close()
\ No newline at end of file
+
+    while watch:
+        deps = PROJECT_DIR.CACHE.deps
+        try:
+            found = wait_for_changes(PROJECT_DIR.CACHE, deps)
+        except KeyboardInterrupt:
+            break
+        click.echo(f'Rebuilding, changed: {", ".join(str(target) for kind, target in found)}', err=True)
+        try:
+            with open(PROJECT_DIR.INPUT_FILE, mode='r') as input:
+                build(input, output, modules, profile, depfile=depfile)
+        except KeyboardInterrupt:
+            break
+        except Exception as exc:
+            # Keep watching what both builds read until the error is fixed
+            logging.exception(exc)
+            PROJECT_DIR.CACHE.deps = {**deps, **PROJECT_DIR.CACHE.deps}
+
+
+def parse_limits(values):
+    '''
+    Parses --include-limit values like "depth=16" into Include.limits overrides
+    '''
+    limits = {}
+    for value in values:
+        name, _, limit = value.partition('=')
+        if name not in ('depth', 'lines', 'bytes') or not (limit.isdigit() or limit == 'none'):
+            raise click.BadParameter(f"'{value}': expected depth, lines or bytes=<number or none>",
+                                     param_hint="'--include-limit'")
+        limits[name] = None if limit == 'none' else int(limit)
+    return limits
+
+
+def parse_timeouts(values):
+    '''
+    Parses --url-timeout values like "request=5" into IncludeURL.timeouts overrides
+    '''
+    timeouts = {}
+    for value in values:
+        name, _, seconds = value.partition('=')
+        try:
+            timeout = None if seconds == 'none' else float(seconds)
+        except ValueError:
+            timeout = 0
+        if name not in ('request', 'total') or timeout is not None and timeout <= 0:
+            raise click.BadParameter(f"'{value}': expected request or total=<seconds or none>",
+                                     param_hint="'--url-timeout'")
+        timeouts[name] = timeout
+    return timeouts
+
+
+def expand_inputs(inputs):
+    '''
+    Expands glob patterns in the input arguments (quoted so the shell leaves
+    them alone, eg "reports/**/*.mdpp")
+    '''
+    sources = []
+    for name in inputs:
+        if name == '-' or path.exists(name):
+            sources.append(name)
+        elif glob.has_magic(name) and glob.glob(name, recursive=True):
+            sources.extend(sorted(glob.glob(name, recursive=True)))
+        else:
+            raise click.BadParameter(f"'{name}': No such file or directory", param_hint="'INPUTS...'")
+    return sources
+
+
+def destinations(sources, directory, collect):
+    '''
+    Maps each input to its output: <directory>/<path>.md, or
+    <directory>/<path>/Report.md when collecting, where <path> is the input's
+    path relative to the deepest directory common to all inputs, without its
+    extension.
+    '''
+    sources = [path.abspath(source) for source in sources]
+    base = path.commonpath([path.dirname(source) for source in sources])
+    directory = path.abspath(directory)
+    outputs = []
+    for source in sources:
+        name = path.splitext(path.relpath(source, base))[0]
+        if collect:
+            outputs.append(path.join(directory, name, 'Report.md'))
+        else:
+            outputs.append(path.join(directory, name + '.md'))
+    return list(zip(sources, outputs))
+
+
+def render_batch(sources, directory, collect, modules, cache, jobs):
+    '''
+    Renders several documents on a pool of worker processes, reusing each
+    worker (and its imported modules) for many documents, then prints a
+    summary of the time taken by each document and any failures.
+    '''
+    jobs = jobs or cpu_count() or 1
+    start = time.perf_counter()
+
+    documents = destinations(sources, directory, collect)
+    if any(source == output for source, output in documents):
+        click.echo('Refusing to overwrite inputs, choose another --output-dir.')
+        return -1
+    # Worker processes don't share the CLI's context, the include settings go along
+    includes = (current_context().include_once, current_context().include_limits, current_context().url_timeouts)
+    args = [(source, output, collect, modules, cache, *includes) for source, output in documents]
+
+    if jobs == 1 or len(args) == 1:
+        results = [render_document(*arg) for arg in args]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(jobs, len(args))) as pool:
+            results = list(pool.map(render_document, *zip(*args), chunksize=max(1, len(args) // (jobs * 8))))
+
+    failed = [(source, error) for source, seconds, error in results if error]
+    width = max(len(path.relpath(source)) for source, seconds, error in results)
+    for source, seconds, error in results:
+        status = (colors.RED + 'FAILED' + colors.NORMAL) if error else (colors.GREEN + 'ok' + colors.NORMAL)
+        click.echo(f'{path.relpath(source):<{width}} {seconds:>8.3f}s {status}', err=True)
+    for source, error in failed:
+        click.echo(f'{path.relpath(source)}: {error}', err=True)
+    click.echo(f'{len(results) - len(failed)} rendered, {len(failed)} failed in '
+               f'{time.perf_counter() - start:.2f}s (worker processes: {min(jobs, len(args))})', err=True)
+    if failed:
+        sys.exit(1)
+
+
+def list_dependencies(sources, modules):
+    '''
+    Prints the files the inputs depend on, one per line, running only the
+    selected modules that resolve them (see Module.RESOLVES). Nothing is
+    written: embedded files are referenced where they are rather than
+    copied, and the rendered documents are thrown away.
+    '''
+    modules = [name for name in modules if name in Modules.modules and Modules.modules.info[name].RESOLVES]
+    found = set()
+    for source in sources:
+        context = current_context().copy()
+        context.input_file = '' if source == '-' else path.abspath(source)
+        context.collect = False
+        context.set_toplevel(getcwd())
+        context.cache = BuildCache()
+        context.profile = None
+        if context.input_file:
+            context.cache.depend_file(context.input_file)
+        with click.open_file(source) as input:
+            MarkdownPP.MarkdownPP(input=input, output=StringIO(), modules=modules, context=context)
+        found.update(dependencies(context.cache.deps))
+
+    for filename in sorted(found):
+        click.echo(display(filename))
+
+
+def render_document(source, output, collect, modules, cache, include_once=False, include_limits=None,
+                    url_timeouts=None):
+    '''
+    Renders one document of a batch. Runs in a worker process that renders
+    other documents before and after this one, each with its own
+    BuildContext.
+
+    returns:
+        tuple: (source, seconds, error message or None)
+    '''
+    start = time.perf_counter()
+    try:
+        context = BuildContext(input_file=source, collect=collect,
+                               include_once=include_once, include_limits=include_limits,
+                               url_timeouts=url_timeouts)
+        makedirs(path.dirname(output), exist_ok=True)
+        context.set_toplevel(path.dirname(output) if collect else getcwd())
+        if cache:
+            context.cache = BuildCache(path.join(context.toplevel, '.mdpp-cache') if collect
+                                       else output + '.mdpp-cache')
+        with open(source, mode='r') as input:
+            build(input, output, modules, context=context)
+    except Exception as exc:
+        return source, time.perf_counter() - start, f'{exc.__class__.__name__}: {exc}'
+    return source, time.perf_counter() - start, None
+
+
+def build(input, output, modules, profile=None, context=None, depfile=None):
+    '''
+    Runs the preprocessor once. Modules, imports and the build cache stay
+    loaded between calls, so --watch only pays for the work that changed.
+
+    parameters:
+        input (file): the input markdown file
+        output: sys.stdout, or the name of the output file, which is
+            replaced atomically once the build is complete
+        modules (list): names of the modules to run
+        profile (tuple): (table, json file, pstats directory) when profiling
+        context (BuildContext): the build's configuration, defaults to the
+            one the CLI set up through PROJECT_DIR
+        depfile (str): writes the files the output depends on to this file,
+            as a make rule (needs context.cache to collect them)
+    '''
+    if context is None:
+        context = current_context()
+    if profile:
+        table, json_file, dump_dir = profile
+        context.profile = Profile(dump_dir)
+
+    # Every build looks at the directories again, or --watch would miss new files
+    context.outputs = []
+    context.listing = DirectoryListing()
+    cache = context.cache
+    if cache is not None:
+        cache.begin()
+        cache.depend('file', context.input_file, cache.signature('file', context.input_file))
+
+    # Run preprocessor
+    if output is sys.stdout:
+        MarkdownPP.MarkdownPP(input=input, output=output, modules=modules, context=context)
+        output.flush()
+    else:
+        with atomic_output(output) as f:
+            MarkdownPP.MarkdownPP(input=input, output=f, modules=modules, context=context)
+
+    if cache is not None:
+        cache.save()
+
+    if depfile:
+        outputs = set(context.outputs)
+        write_depfile(depfile, [output] + context.outputs,
+                      [name for name in dependencies(cache.deps) if name not in outputs])
+
+    if profile:
+        report(context.profile, table, json_file)
+        context.profile = None
+
+
+def report(profile, table, json_file):
+    '''
+    Writes the per module statistics of a profiled build
+    '''
+    profile.dump()
+    if table:
+        click.echo(profile.table(), err=True, nl=False)
+    if json_file == '-':
+        click.echo(profile.json(), err=True)
+    elif json_file:
+        with open(json_file, 'w') as f:
+            f.write(profile.json() + '\n')
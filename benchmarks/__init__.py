@@ -0,0 +1,23 @@
+"""
+benchmarks
+----------
+
+Speed benchmarks for MarkdownPP. Each module in this package can be run on
+its own, eg `python -m benchmarks.transforms`.
+
+`python -m benchmarks.pipeline` runs every module and the full pipeline over
+synthetic corpora (see corpus.py) and compares the results to a baseline.
+`python -m benchmarks.startup` measures how long mdpp takes to start.
+`python -m benchmarks.tables` compares the table renderer with pandas, and
+`python -m benchmarks.scanner` the Scanner's directive routing with running
+every module regex on every line, and `python -m benchmarks.prefetch`
+include expansion with and without reading the include tree ahead.
+`python -m benchmarks.expansion` times expanding large included files, and
+`python -m benchmarks.listing` resolving glob patterns on cached listings.
+`python -m benchmarks.linerange` reads line ranges of a large file for
+!INCLUDECODE through a line index, and `python -m benchmarks.includedir`
+expands a large !INCLUDEDIR folder in place. `python -m benchmarks.includeurl`
+fetches !INCLUDEURL pages from a slow local server one after the other and
+concurrently.
+
+"""
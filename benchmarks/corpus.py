@@ -0,0 +1,237 @@
+"""
+corpus.py
+---------
+
+Synthetic corpora for the benchmarks. Each scenario writes a realistic
+document (and the files it pulls in) into a directory and returns the
+input file along with the modules that should process it.
+
+    python -m benchmarks.corpus DIRECTORY [--size 1000]
+
+writes every scenario for inspection.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+
+from os import path, makedirs
+
+
+PROSE = [
+    'The quick brown fox jumps over the lazy dog.',
+    'Results are collected into a single *self-contained* report.',
+    'See the `Processor` for how transforms are applied.',
+    'Lorem ipsum dolor sit amet, consectetur adipiscing elit.',
+    'Each section is written by a different team member.',
+]
+
+
+def write(directory, name, lines):
+    filename = path.join(directory, name)
+    makedirs(path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+    return filename
+
+
+def prose(rng, paragraphs=1):
+    lines = []
+    for _ in range(paragraphs):
+        lines.append(' '.join(rng.choice(PROSE) for _ in range(3)) + '\n')
+        lines.append('\n')
+    return lines
+
+
+def section(rng, title, level=2, paragraphs=1):
+    return [f'{"#" * level} {title}\n', '\n'] + prose(rng, paragraphs)
+
+
+# Scenarios
+# ===
+# Each takes the corpus directory, a size and a random generator and returns
+# (input file, modules)
+
+def include_tree(directory, size, rng):
+    '''
+    A binary tree of `size` included files, plus a chain of nested includes
+    as deep as the include stack comfortably allows
+    '''
+    for i in range(size):
+        lines = section(rng, f'Node {i}', 1)
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < size:
+                lines += [f'!INCLUDE "node_{child}.md", 1\n', '\n']
+        write(directory, f'tree/node_{i}.md', lines)
+
+    depth = min(size, 50)
+    for i in range(depth):
+        lines = section(rng, f'Level {i}', 1)
+        if i + 1 < depth:
+            lines += [f'!INCLUDE "deep_{i + 1}.md"\n']
+        write(directory, f'tree/deep_{i}.md', lines)
+
+    filename = write(directory, 'include_tree.md',
+                     ['# Include tree\n', '\n', '!INCLUDE "tree/node_0.md", 1\n', '\n', '!INCLUDE "tree/deep_0.md", 1\n'])
+    return filename, ['include']
+
+
+def include_dir(directory, size, rng):
+    '''
+    A folder of `size` files pulled in with !INCLUDEDIR
+    '''
+    for i in range(size):
+        write(directory, f'wide/sub_{i % 10}/file_{i:05}.md', section(rng, f'File {i}', 2, 2))
+    filename = write(directory, 'include_dir.md', ['# Include dir\n', '\n', '!INCLUDEDIR "wide/", RECURSE\n'])
+    return filename, ['includedir', 'include']
+
+
+def headings(directory, size, rng):
+    '''
+    `size` headings at mixed levels below a table of contents
+    '''
+    lines = ['# Headings\n', '\n', '!TOC\n', '\n']
+    for i in range(size):
+        lines += section(rng, f'Heading [{i}](#heading-{i})', rng.randint(2, 4))
+    lines += ['```\n', '# not a heading\n', '```\n']
+    return write(directory, 'headings.md', lines), ['tableofcontents']
+
+
+def todos(directory, size, rng):
+    '''
+    `size` comments and todos, with a table of todos at the top
+    '''
+    lines = ['# Todos\n', '\n', '!TABLE_OF_TODOS\n', '\n']
+    for i in range(size):
+        lines += prose(rng)
+        lines.append(f'!TODO "Todo number {i}"\n' if i % 2 else f'!COMMENT "Comment number {i}" Green\n')
+    return write(directory, 'todos.md', lines), ['comment']
+
+
+def errors(directory, size, rng):
+    '''
+    `size` errors, with a table of errors at the top
+    '''
+    lines = ['# Errors\n', '\n', '!TABLE_OF_ERRORS\n', '\n']
+    for i in range(size):
+        lines += prose(rng)
+        lines.append(f'!ERROR "Error number {i}" <!-- !INCLUDE "missing_{i}.md" -->\n')
+    return write(directory, 'errors.md', lines), ['error']
+
+
+def frontmatter(directory, size, rng):
+    '''
+    `size` included files with frontmatter, tabulated with !FRONTMATTER
+    '''
+    lines = ['# Frontmatter\n', '\n', '!FRONTMATTER all, table(id, owner, status)\n', '\n']
+    for i in range(size):
+        write(directory, f'frontmatter/item_{i}.md',
+              ['---\n', f'id: item_{i}\n', f'owner: person {rng.randint(1, 20)}\n',
+               f'status: {rng.choice(["open", "closed", "blocked"])}\n', f'tags: [a, b, c{i}]\n', '---\n']
+              + section(rng, f'Item {i}'))
+        lines.append(f'!INCLUDE "frontmatter/item_{i}.md"\n')
+    return write(directory, 'frontmatter.md', lines), ['include', 'frontmatter']
+
+
+def include_code(directory, size, rng):
+    '''
+    A code file of `size` * 10 lines included whole, and `size` // 10 times
+    in slices
+    '''
+    code = []
+    for i in range(size):
+        code += [f'def function_{i}(x):\n', f'    """Function {i}"""\n', f'    y = x * {i}\n',
+                 '    for j in range(y):\n', '        y += j\n', '    return y\n', '\n', '\n',
+                 f'CONSTANT_{i} = function_{i}(1)\n', '\n']
+    write(directory, 'code/big.py', code)
+
+    lines = ['# Code\n', '\n', '!INCLUDECODE "code/big.py" (python)\n', '\n']
+    for i in range(max(1, size // 10)):
+        start = rng.randint(1, len(code))
+        lines += prose(rng) + [f'!INCLUDECODE "code/big.py" (python), {start}:{start + 20}\n', '\n']
+    return write(directory, 'include_code.md', lines), ['includecode']
+
+
+def include_url(directory, size, rng, base_url=None):
+    '''
+    `size` // 10 remote includes, served by the benchmarks' local HTTP server
+    '''
+    count = max(1, size // 10)
+    for i in range(count):
+        write(directory, f'remote/page_{i}.md', section(rng, f'Remote {i}', 1, 3))
+    lines = ['# Remote\n', '\n']
+    for i in range(count):
+        lines.append(f'!INCLUDEURL "{base_url}/remote/page_{i}.md"\n')
+    return write(directory, 'include_url.md', lines), ['includeurl']
+
+
+def full(directory, size, rng, base_url=None):
+    '''
+    Every scenario included into one report, run through all default
+    modules (and IncludeURL against the local server)
+    '''
+    parts = [scenario(directory, max(1, size // 10), rng)[0] if scenario is not include_url
+             else scenario(directory, max(1, size // 10), rng, base_url)[0]
+             for scenario in (include_tree, include_dir, headings, todos, errors, frontmatter, include_code, include_url)]
+    lines = ['# Full report\n', '\n', '!TOC\n', '\n', '!TABLE_OF_TODOS\n', '\n', '!TABLE_OF_ERRORS\n', '\n']
+    for part in parts:
+        lines.append(f'!INCLUDE "{path.basename(part)}", 1\n')
+    modules = ['includedir', 'include', 'frontmatter', 'includecode', 'includeurl',
+               'tableofcontents', 'latexrender', 'reference', 'comment', 'error']
+    return write(directory, 'full.md', lines), modules
+
+
+SCENARIOS = {
+    'include': include_tree,
+    'includedir': include_dir,
+    'tableofcontents': headings,
+    'comment': todos,
+    'error': errors,
+    'frontmatter': frontmatter,
+    'includecode': include_code,
+    'includeurl': include_url,
+    'full': full,
+}
+
+REMOTE = ('includeurl', 'full')
+
+
+def generate(name, directory, size, base_url=None, seed=0):
+    '''
+    Writes the corpus of a scenario to directory.
+
+    parameters:
+        name (str): one of SCENARIOS
+        directory (str): where to write the corpus
+        size (int): how many items (files, headings, tags...) to generate
+        base_url (str): URL the local HTTP server serves directory on
+        seed (int): seed for the random content, so corpora are repeatable
+
+    returns:
+        tuple: (input file, modules to run)
+    '''
+    rng = random.Random(seed)
+    directory = path.join(directory, f'{name}_{size}')
+    makedirs(directory, exist_ok=True)
+    if name in REMOTE:
+        return SCENARIOS[name](directory, size, rng, f'{base_url}/{name}_{size}')
+    return SCENARIOS[name](directory, size, rng)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('directory')
+    parser.add_argument('--size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    for name in SCENARIOS:
+        filename, modules = generate(name, args.directory, args.size, 'http://127.0.0.1:8000')
+        print(f'{filename} ({", ".join(modules)})')
+
+
+if __name__ == '__main__':
+    main()
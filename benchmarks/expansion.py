@@ -0,0 +1,129 @@
+"""
+expansion.py
+------------
+
+Times expanding a large included file (every `--every`th line a setext
+header, an image, an !INCLUDECODE or a nested !INCLUDE, headers shifted by
+one level) with
+Include.expand_file, against the loop it replaced, which spliced each
+rewritten line into the list it was walking. The per line time of the
+generator stays flat as the file grows, where the splicing one's grew with
+the size of the file.
+
+    python -m benchmarks.expansion [--sizes 10000,100000,300000] [--every 10]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import re
+import time
+
+from os import path
+from tempfile import TemporaryDirectory
+
+from MarkdownPP import modules as Modules
+from MarkdownPP.Common import embed_path, embedded_image_regex, include_code_regex, md_title_regex
+from MarkdownPP.Context import BuildContext
+
+from benchmarks.corpus import PROSE, write
+
+
+def splicing_expand(include, filename, data, shift):
+    '''
+    Include.expand_file as it was, without the file reading and frontmatter
+    '''
+    linenum = 0
+    includednum = 0
+    for line in data:
+        include_match = include.includere.search(line)
+        image_match = embedded_image_regex.search(line)
+        include_code_match = include_code_regex.search(line)
+
+        if include_match:
+            data[linenum:linenum+1] = include.include(include_match, path.dirname(filename))
+            includednum = linenum
+            line = data[linenum]
+        elif image_match:
+            embed_img = image_match.group(3)
+            replace_path = embed_path(md_file=filename, file_to_embed=embed_img)
+            data[linenum:linenum+1] = [line.replace(embed_img, replace_path)]
+        elif include_code_match:
+            code_file = include_code_match.group(1) or include_code_match.group(2)
+            replace_path = path.join(path.dirname(filename), code_file)
+            data[linenum:linenum+1] = [line.replace(code_file, replace_path)]
+
+        if shift:
+            titlematch = md_title_regex.search(line)
+            if titlematch:
+                to_del = []
+                for _ in range(shift):
+                    prevtxt = re.sub(include.formatre, '', data[linenum - 1]).strip()
+                    isunderlined = prevtxt and linenum > includednum
+                    if data[linenum][0] == '#':
+                        data[linenum] = "#" + data[linenum]
+                    elif data[linenum][0] == '=' and isunderlined:
+                        data[linenum] = data[linenum].replace("=", '-')
+                    elif data[linenum][0] == '-' and isunderlined:
+                        data[linenum] = '### ' + data[linenum - 1]
+                        to_del.append(linenum - 1)
+                for l in to_del:
+                    del data[l]
+        linenum += 1
+    return data
+
+
+SPECIAL = [
+    ['Section\n', '=======\n', '\n'],
+    ['![image](image.png)\n'],
+    ['!INCLUDECODE "code.py"\n'],
+    ['## Subsection\n'],
+    ['!INCLUDE "snippet.md"\n'],
+]
+
+
+def make_file(directory, size, every):
+    lines = []
+    while len(lines) < size:
+        if len(lines) % every == 0:
+            lines += SPECIAL[len(lines) // every % len(SPECIAL)]
+        else:
+            lines.append(PROSE[len(lines) % len(PROSE)] + '\n')
+    write(directory, 'image.png', [''])
+    write(directory, 'snippet.md', ['Snippet\n', '-------\n'] + [line + '\n' for line in PROSE])
+    return write(directory, f'large{size}.md', lines), lines
+
+
+def best(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='10000,100000,300000', help='comma separated file sizes, in lines')
+    parser.add_argument('--every', type=int, default=10, help='lines per header, image or include')
+    args = parser.parse_args(argv)
+
+    include = Modules['include']()
+    include.context = BuildContext()
+    print(f'{"lines":>8} {"generator":>11} {"splicing":>11} {"speedup":>8} {"per line":>10}')
+    with TemporaryDirectory() as directory, include.context.activate():
+        for size in map(int, args.sizes.split(',')):
+            filename, lines = make_file(directory, size, args.every)
+            generator, result = best(lambda: include.expand_file(filename, shift=1))
+            splicing, expected = best(lambda: splicing_expand(include, filename, list(lines), 1))
+            assert result == expected, 'expansion changed the output'
+            print(f'{size:>8} {generator * 1000:>9.1f}ms {splicing * 1000:>9.1f}ms '
+                  f'{splicing / generator:>7.1f}x {generator / size * 1e6:>8.2f}us')
+
+
+if __name__ == '__main__':
+    main()
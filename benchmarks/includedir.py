@@ -0,0 +1,95 @@
+"""
+includedir.py
+-------------
+
+Times a report including an evidence folder of `--files` findings and
+code files with !INCLUDEDIR, expanded the way IncludeDir used to (a pass
+writing an !INCLUDE or !INCLUDECODE directive per file, which Include and
+IncludeCode then match, glob and expand in passes of their own) against
+IncludeDir expanding each file in place as it lists the folder.
+
+    python -m benchmarks.includedir [--files 2000]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import time
+
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from MarkdownPP.MarkdownPP import MarkdownPP
+from MarkdownPP.Modules.Include import Include
+from MarkdownPP.Modules.IncludeCode import IncludeCode
+from MarkdownPP.Modules.IncludeDir import IncludeDir
+
+from benchmarks.corpus import write, section
+
+
+def make_folder(directory, files, seed=0):
+    rng = random.Random(seed)
+    for i in range(files):
+        if i % 4 == 3:
+            write(directory, f'evidence/host{i % 10}/request{i:05}.http',
+                  [f'GET /api/items/{i} HTTP/1.1\n', 'Host: example.com\n'])
+        else:
+            write(directory, f'evidence/host{i % 10}/finding{i:05}.md', section(rng, f'Finding {i}', 1, 2))
+    return write(directory, 'report.mdpp', ['# Evidence\n', '\n', f'!INCLUDEDIR "{directory}/evidence", RECURSE\n'])
+
+
+def render(source, modules):
+    output = StringIO()
+    with open(source) as input:
+        MarkdownPP(input=input, output=output, modules=modules)
+    return output.getvalue()
+
+
+def directives(source, modules):
+    '''
+    IncludeDir as it was: running first, and leaving a directive per file
+    (as it does when it runs on its own) for the next passes
+    '''
+    IncludeDir.priority, IncludeDir.peer = 0, lambda self, name: None
+    try:
+        return render(source, modules)
+    finally:
+        IncludeDir.priority = 2
+        del IncludeDir.peer
+
+
+def best(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        # Start cold every time, the file caches would hide the expansion
+        Include.files.clear()
+        IncludeCode.files.clear()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--files', type=int, default=2000, help='files in the evidence folder')
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory:
+        source = make_folder(directory, args.files)
+        modules = ['includedir', 'include', 'includecode']
+
+        two_pass, expected = best(lambda: directives(source, modules))
+        direct, result = best(lambda: render(source, modules))
+        assert result == expected, 'expanding in place changed the report'
+
+    print(f'{"files":>8} {"directives":>12} {"in place":>10} {"speedup":>8}')
+    print(f'{args.files:>8} {two_pass * 1000:>10.1f}ms {direct * 1000:>8.1f}ms {two_pass / direct:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
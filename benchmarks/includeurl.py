@@ -0,0 +1,97 @@
+"""
+includeurl.py
+-------------
+
+Times a report of `--pages` !INCLUDEURL directives, each page including
+two of `--shared` pages in turn, served with `--latency` milliseconds of
+delay per request. Compares fetching them as IncludeURL used to (one
+urlopen after the other, a new connection each, shared pages fetched
+again every time) against fetching every url once, concurrently, on
+kept alive connections.
+
+    python -m benchmarks.includeurl [--pages 40] [--shared 5] [--latency 20]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import re
+import time
+
+from io import StringIO
+from tempfile import TemporaryDirectory
+from urllib.request import urlopen
+
+from MarkdownPP.MarkdownPP import MarkdownPP
+from MarkdownPP.Modules.IncludeURL import IncludeURL
+
+from benchmarks.corpus import write
+from benchmarks.server import serve
+
+
+def make_pages(directory, pages, shared):
+    for i in range(shared):
+        write(directory, f'shared/{i}.md', [f'Shared page {i}\n'])
+    lines = ['# Remote\n', '\n']
+    for i in range(pages):
+        write(directory, f'pages/{i}.md', [f'## Page {i}\n', '\n', f'!INCLUDEURL "../shared/{i % shared}.md"\n',
+                                           f'!INCLUDEURL "../shared/{(i + 1) % shared}.md"\n'])
+        lines.append(f'!INCLUDEURL "pages/{i}.md"\n')
+    return lines
+
+
+def serial(lines, base_url):
+    '''
+    IncludeURL as it was: a urlopen per directive, nested ones included
+    as they are found
+    '''
+    result = []
+    for line in lines:
+        match = IncludeURL.includere.search(line)
+        if not match:
+            result.append(line)
+            continue
+        url = f'{base_url}/{match.group(1)}'
+        data = [line for line in re.split(r'(?<=\n)', b''.join(urlopen(url).readlines()).decode()) if line]
+        base = url.rsplit('/', 1)[0]
+        result += serial(data, base)
+    return result
+
+
+def render(lines, base_url, modules=['includeurl']):
+    output = StringIO()
+    text = ''.join(line.replace('!INCLUDEURL "', f'!INCLUDEURL "{base_url}/') for line in lines)
+    MarkdownPP(input=StringIO(text), output=output, modules=modules)
+    return output.getvalue()
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--pages', type=int, default=40, help='pages included by the report')
+    parser.add_argument('--shared', type=int, default=5, help='pages included by the pages')
+    parser.add_argument('--latency', type=float, default=20, help='milliseconds the server takes to answer')
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory, serve(directory, args.latency / 1000) as base_url:
+        lines = make_pages(directory, args.pages, args.shared)
+        before, expected = timed(lambda: ''.join(serial(lines, base_url)))
+        after, result = timed(lambda: render(lines, base_url))
+        assert result == expected, 'fetching concurrently changed the report'
+
+    requests = args.pages * 3
+    print(f'{"requests":>9} {"urls":>6} {"serial":>10} {"concurrent":>11} {"speedup":>8}')
+    print(f'{requests:>9} {args.pages + args.shared:>6} {before * 1000:>8.1f}ms {after * 1000:>9.1f}ms '
+          f'{before / after:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+linerange.py
+------------
+
+Times `--directives` !INCLUDECODE line ranges of a large log capture
+(`--lines` lines) read as IncludeCode used to, loading the whole file and
+slicing it, against reading them through the file's LineIndex, which is
+built by the first directive and reused by the others. Also reports the
+peak memory allocated by each.
+
+    python -m benchmarks.linerange [--lines 2000000] [--directives 10]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from os import path
+from tempfile import TemporaryDirectory
+
+from MarkdownPP.Common import read_file
+from MarkdownPP.Modules.IncludeCode import IncludeCode
+
+
+def make_log(filename, lines, seed=0):
+    rng = random.Random(seed)
+    with open(filename, 'w') as f:
+        for i in range(lines):
+            f.write(f'{i:>9} 10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)} GET /api/v1/items/{rng.randint(0, 99999)} '
+                    f'{rng.choice((200, 200, 200, 302, 404, 500))}\n')
+
+
+def measured(function, reset=lambda: None):
+    '''
+    Times function, then runs it again tracing memory allocations (which
+    slows it down) for its peak memory
+    '''
+    reset()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    reset()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--lines', type=int, default=2000000, help='lines of the log')
+    parser.add_argument('--directives', type=int, default=10, help='line ranges included from it')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(1)
+    ranges = []
+    for _ in range(args.directives):
+        first = rng.randint(1, args.lines - 20)
+        ranges.append(f'{first}:{first + 20}')
+
+    with TemporaryDirectory() as directory:
+        filename = path.join(directory, 'capture.log')
+        make_log(filename, args.lines)
+        module = IncludeCode()
+
+        whole, whole_peak, expected = measured(
+            lambda: [''.join(module._select_lines(read_file(filename), lines)) for lines in ranges])
+        first, first_peak, _ = measured(lambda: module.read_lines(filename, ranges[0]), IncludeCode.indexes.clear)
+        indexed, indexed_peak, result = measured(
+            lambda: [''.join(module.read_lines(filename, lines)) for lines in ranges])
+        assert result == expected, 'the index read other lines than slicing the file'
+
+        size = path.getsize(filename) / 1e6
+
+    print(f'{size:.0f} MB, {args.lines} lines, {args.directives} ranges of 20 lines')
+    print(f'{"":>16} {"time":>10} {"peak memory":>12}')
+    print(f'{"whole file":>16} {whole * 1000:>8.1f}ms {whole_peak / 1e6:>10.1f}MB')
+    print(f'{"building index":>16} {first * 1000:>8.1f}ms {first_peak / 1e6:>10.1f}MB')
+    print(f'{"indexed":>16} {indexed * 1000:>8.1f}ms {indexed_peak / 1e6:>10.1f}MB')
+    print(f'speedup: {whole / (first + indexed):.1f}x including the index, {whole / indexed:.0f}x once built')
+
+
+if __name__ == '__main__':
+    main()
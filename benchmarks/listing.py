@@ -0,0 +1,70 @@
+"""
+listing.py
+----------
+
+Times resolving the glob patterns of a report that globs the same findings
+folders over and over (`--patterns` times, over `--dirs` folders of
+`--files` findings each) with glob.glob, as Include used to, against a
+build's DirectoryListing, which lists each folder once.
+
+    python -m benchmarks.listing [--dirs 20] [--files 50] [--patterns 200]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import glob
+import time
+
+from os import path
+from tempfile import TemporaryDirectory
+
+from MarkdownPP.Listing import DirectoryListing
+
+from benchmarks.corpus import write
+
+
+def make_tree(directory, dirs, files):
+    for i in range(dirs):
+        for j in range(files):
+            write(directory, f'findings/host{i:02}/finding{j:03}.md', [f'# Finding {j}\n'])
+    return [path.join(directory, 'findings', f'host{i % dirs:02}', '*.md') for i in range(dirs)] \
+        + [path.join(directory, 'findings', '*', f'finding{j % files:03}.md') for j in range(files)]
+
+
+def best(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--dirs', type=int, default=20, help='findings folders')
+    parser.add_argument('--files', type=int, default=50, help='findings per folder')
+    parser.add_argument('--patterns', type=int, default=200, help='glob patterns in the report')
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory:
+        kinds = make_tree(directory, args.dirs, args.files)
+        patterns = [kinds[i % len(kinds)] for i in range(args.patterns)]
+
+        globbed, expected = best(lambda: [sorted(glob.glob(pattern)) for pattern in patterns])
+        # A new listing per run, as every build gets one
+        listing = DirectoryListing()
+        listed, result = best(lambda: [sorted(listing.glob(pattern)) for pattern in patterns], repeat=1)
+        assert result == expected, 'the listing matched other files than glob'
+
+    print(f'{"patterns":>8} {"glob.glob":>11} {"listing":>10} {"speedup":>8} {"listed":>7}')
+    print(f'{args.patterns:>8} {globbed * 1000:>9.1f}ms {listed * 1000:>8.1f}ms '
+          f'{globbed / listed:>7.1f}x {listing.scanned:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+pipeline.py
+-----------
+
+Runs each module, and the full MarkdownPP pipeline, over synthetic corpora
+(see benchmarks.corpus) of growing size, recording the time and peak
+memory of each run. Results can be saved as a baseline and later runs
+compared against it to flag regressions.
+
+    python -m benchmarks.pipeline [--sizes 100,1000] [--scenarios include,full]
+                                  [--save baseline.json] [--compare baseline.json]
+
+Exits with status 1 when --compare finds a scenario that got slower or
+bigger than --threshold times the baseline.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from io import StringIO
+from os import path, getcwd, chdir
+from tempfile import TemporaryDirectory
+
+from MarkdownPP import MarkdownPP
+from MarkdownPP.Context import BuildContext
+
+from benchmarks.corpus import SCENARIOS, generate
+from benchmarks.server import serve
+
+
+def run(filename, modules, output_dir):
+    '''
+    Runs MarkdownPP on filename the way the CLI does, returning the output.
+    Top level includes are relative to the working directory, so the run
+    happens in the directory of filename.
+    '''
+    context = BuildContext(input_file=filename)
+    context.set_toplevel(output_dir)
+
+    output = StringIO()
+    cwd = getcwd()
+    chdir(path.dirname(filename))
+    try:
+        with open(filename) as input:
+            MarkdownPP(input=input, output=output, modules=modules, context=context)
+    finally:
+        chdir(cwd)
+    return output.getvalue()
+
+
+def measure(filename, modules, output_dir, repeat):
+    '''
+    Best time of `repeat` runs after a warm up run (which pays for lazy
+    imports like yaml), and the peak memory of one more run under
+    tracemalloc (which would skew the timings)
+
+    returns:
+        dict: {'time': seconds, 'memory': MB, 'lines': output lines}
+    '''
+    run(filename, modules, output_dir)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run(filename, modules, output_dir)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run(filename, modules, output_dir)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'time': min(times), 'memory': peak / 2**20, 'lines': result.count('\n')}
+
+
+def compare(results, baseline, threshold):
+    '''
+    Returns the (key, measure, ratio) of every result more than threshold
+    times its baseline
+    '''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for quantity in ('time', 'memory'):
+            old = baseline[key][quantity]
+            if old > 0 and result[quantity] / old > threshold:
+                regressions.append((key, quantity, result[quantity] / old))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='100,1000',
+                        help='comma separated corpus sizes')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated scenarios: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measurement, the fastest one counts')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results to a baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='ratio to the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    scenarios = args.scenarios.split(',')
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f'{"scenario":>16} {"size":>6} {"lines":>8} {"time":>10} {"memory":>10} {"baseline":>10}')
+    with TemporaryDirectory() as directory, serve(directory) as base_url:
+        for name in scenarios:
+            for size in sizes:
+                filename, modules = generate(name, directory, size, base_url)
+                key = f'{name}@{size}'
+                results[key] = result = measure(filename, modules, path.dirname(filename), args.repeat)
+                old = f'{baseline[key]["time"]:>9.3f}s' if key in baseline else ''
+                print(f'{name:>16} {size:>6} {result["lines"]:>8} {result["time"]:>9.3f}s'
+                      f' {result["memory"]:>8.1f}MB {old:>10}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    regressions = compare(results, baseline, args.threshold)
+    for key, quantity, ratio in regressions:
+        print(f'REGRESSION {key}: {quantity} {ratio:.2f}x baseline')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+prefetch.py
+-----------
+
+Times expanding an include tree (a report including `--files` findings,
+each including a shared snippet) with and without Include.prefetch, on a
+file system where every stat and open takes `--latency` milliseconds, as
+on the network shares reports are built from.
+
+    python -m benchmarks.prefetch [--files 50] [--latency 5] [--workers 8]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+from io import StringIO
+from os import path
+from tempfile import TemporaryDirectory
+
+from MarkdownPP import MarkdownPP
+from MarkdownPP import Cache, Common
+from MarkdownPP import modules as Modules
+
+from benchmarks.corpus import PROSE, write
+
+
+def make_tree(directory, files):
+    write(directory, 'snippets/shared.md', [PROSE[0] + '\n'])
+    for i in range(files):
+        write(directory, f'findings/finding{i:03}.md',
+              [f'# Finding {i}\n', PROSE[i % len(PROSE)] + '\n', '!INCLUDE "../snippets/shared.md"\n'])
+    return f'!INCLUDE "{path.join(directory, "findings", "*.md")}", 1\n'
+
+
+def render(text, workers):
+    include = Modules['include']
+    include.files.clear()
+    include.workers = workers
+    output = StringIO()
+    start = time.perf_counter()
+    MarkdownPP(input=StringIO(text), modules=['include'], output=output)
+    return time.perf_counter() - start, output.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--files', type=int, default=50, help='included files')
+    parser.add_argument('--latency', type=float, default=5, help='milliseconds per stat or open')
+    parser.add_argument('--workers', type=int, default=8, help='prefetch threads')
+    args = parser.parse_args(argv)
+
+    def slow(function):
+        def call(*args_, **kwargs):
+            time.sleep(args.latency / 1000)
+            return function(*args_, **kwargs)
+        return call
+
+    stat = Cache.stat
+    workers = Modules['include'].workers
+    Cache.stat = slow(stat)
+    Cache.open = Common.open = slow(open)
+    try:
+        with TemporaryDirectory() as directory:
+            text = make_tree(directory, args.files)
+            serial, expected = render(text, 1)
+            prefetched, result = render(text, args.workers)
+            assert result == expected, 'prefetching changed the output'
+    finally:
+        Cache.stat = stat
+        del Cache.open, Common.open
+        Modules['include'].workers = workers
+
+    print(f'{"files":>6} {"serial":>10} {"prefetch":>10} {"speedup":>8}')
+    print(f'{args.files:>6} {serial * 1000:>8.1f}ms {prefetched * 1000:>8.1f}ms {serial / prefetched:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+scanner.py
+----------
+
+Compares the Scanner's directive routing with running every module's
+scanre against every line, on prose heavy documents with a directive every
+`--every` lines, for all modules that have a scanre. Also reports the share
+of lines that got past the routing to a module regex.
+
+    python -m benchmarks.scanner [--sizes 10000,100000] [--every 100]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import time
+
+from MarkdownPP import modules as Modules
+from MarkdownPP.Literal import LiteralIndex
+from MarkdownPP.Scanner import Scanner
+
+from benchmarks.corpus import PROSE
+
+
+DIRECTIVES = [
+    '!COMMENT "a comment"\n',
+    '!TODO "a todo"\n',
+    '!ERROR "an error" <!-- missing -->\n',
+    '!FRONTMATTER all, table(id)\n',
+    '!INCLUDECODE "code.py"\n',
+    '![image](images/image.png)\n',
+    '[link]: http://example.com\n',
+    '!REF\n',
+]
+
+
+def make_document(size, every, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(size):
+        if i % every == 0:
+            lines.append(rng.choice(DIRECTIVES))
+        elif i % 10 == 0:
+            lines.append(f'{"#" * rng.randint(1, 3)} Section {i}\n')
+        elif i % 5 == 0:
+            lines.append('\n')
+        else:
+            lines.append(rng.choice(PROSE) + '\n')
+    return lines
+
+
+def scan_everything(data, modules, literals):
+    '''
+    The scan before directive routing: every scanre on every prose line
+    '''
+    hits = {module: [] for module in modules}
+    matchers = [(module.scanre.search, hits[module]) for module in modules]
+    for linenum, line in enumerate(data):
+        if literals.kinds[linenum]:
+            continue
+        for search, lines in matchers:
+            if search(line):
+                lines.append(linenum)
+    return hits
+
+
+def timed(function, *args, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='10000,100000', help='comma separated document sizes, in lines')
+    parser.add_argument('--every', type=int, default=100, help='lines per directive')
+    args = parser.parse_args(argv)
+
+    modules = [Modules[name]() for name in Modules if Modules[name].scanre is not None]
+    print(f'modules: {", ".join(sorted(module.__class__.__name__ for module in modules))}')
+    print(f'{"lines":>8} {"everything":>12} {"routed":>10} {"speedup":>8} {"tested":>8}')
+    for size in map(int, args.sizes.split(',')):
+        data = make_document(size, args.every)
+        literals = LiteralIndex(data)
+
+        everything, expected = timed(scan_everything, data, modules, literals)
+        scanner = Scanner(modules)
+        routed, hits = timed(scanner.scan, data, modules, literals)
+        assert hits == expected, 'routing changed the scan results'
+
+        tested = scanner.tested / scanner.passes / size
+        print(f'{size:>8} {everything * 1000:>10.1f}ms {routed * 1000:>8.1f}ms '
+              f'{everything / routed:>7.1f}x {tested:>7.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+server.py
+---------
+
+Local HTTP stand-in for the network dependent modules, so benchmarks of
+!INCLUDEURL measure MarkdownPP rather than the internet.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from contextlib import contextmanager
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    # Keeps connections alive, like the servers !INCLUDEURL talks to, and
+    # like them sends the body without waiting for the headers to be acked
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve(directory, latency=0):
+    '''
+    Serves directory over HTTP on a free local port for the duration of the
+    with block, answering each request after latency seconds (the round
+    trips to a remote server).
+
+    yields:
+        str: the base URL, eg http://127.0.0.1:41234
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(type('Handler', (QuietHandler,), {'latency': latency}), directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,75 @@
+"""
+startup.py
+----------
+
+Measures how long `mdpp` takes to start: importing the CLI, printing
+--help and rendering a small document without math, each in a fresh
+interpreter. Also lists the heavy optional dependencies each of them ended
+up importing, which should be none.
+
+    python -m benchmarks.startup [--repeat 10]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from os import path
+from tempfile import TemporaryDirectory
+
+
+HEAVY = ('sympy', 'pandas', 'yaml', 'PIL', 'tabulate')
+
+REPORT = "import sys; print(' '.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)"
+
+SCENARIOS = {
+    'import': 'import MarkdownPP.main',
+    'help': 'from MarkdownPP.main import cli; cli(["--help"], standalone_mode=False)',
+    'render': 'from MarkdownPP.main import cli; cli([{document!r}], standalone_mode=False)',
+}
+
+DOCUMENT = '# Title\n\n!TOC\n\n## Section\n\nSome text with a [link][1].\n\n!COMMENT "hello"\n\n[1]: http://example.com\n'
+
+
+def run(code, cwd):
+    '''
+    Runs code in a fresh interpreter, returning the time taken and the heavy
+    modules it imported
+    '''
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', f'{code}\n{REPORT.format(heavy=HEAVY)}'],
+                            cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    return time.perf_counter() - start, result.stderr.split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    package_dir = path.dirname(path.dirname(path.abspath(__file__)))
+    baseline = statistics.median(run('pass', package_dir)[0] for _ in range(args.repeat))
+
+    with TemporaryDirectory() as directory:
+        document = path.join(directory, 'document.mdpp')
+        with open(document, 'w') as f:
+            f.write(DOCUMENT)
+
+        print(f'{"scenario":>10} {"median":>10} {"over python":>12}  heavy imports')
+        for name, code in SCENARIOS.items():
+            # Run from the package directory so the working tree is imported
+            runs = [run(code.format(document=document), package_dir) for _ in range(args.repeat)]
+            median = statistics.median(seconds for seconds, heavy in runs)
+            print(f'{name:>10} {median * 1000:>8.1f}ms {(median - baseline) * 1000:>10.1f}ms  {" ".join(runs[0][1]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+tables.py
+---------
+
+Times Common.markdown_table, aligned and unaligned, against the pandas
+to_markdown path it replaced on the tables MarkdownPP makes: the table of
+todos, the table of errors and !FRONTMATTER tables. Each pandas table is
+also compared with the native one, and any difference is reported.
+
+    python -m benchmarks.tables [--sizes 10,100,1000,10000] [--repeat 5]
+
+The pandas column is left out when pandas and tabulate aren't installed.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import time
+import warnings
+
+from secrets import token_hex
+
+from MarkdownPP.Common import markdown_table
+
+
+def pandas_table(data, first_row_header=False):
+    '''
+    The table as MarkdownPP made it with pandas and tabulate
+    '''
+    from pandas import DataFrame
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)    # applymap
+        df = DataFrame(data).applymap(lambda x: '<ul><li>'+'</li><li>'.join(x)+'</li></ul>' if isinstance(x, list) else x)
+
+    if first_row_header:
+        new_header = df.iloc[0]
+        df = df[1:]
+        df.columns = new_header
+
+    table = df.to_markdown(index=False, tablefmt="pipe")
+    return [l+'\n' for l in table.split('\n') if l]
+
+
+# Tables
+# ===
+# Each takes a size and a random generator and returns
+# (data, first_row_header) for markdown_table
+
+def todos(size, rng):
+    return [('Search Me', 'TO DO')] + [(token_hex(5), f'Todo number {i}') for i in range(size)], True
+
+
+def errors(size, rng):
+    return ([('Search Me', 'Error Tag', 'Error Cause')]
+            + [(token_hex(5), f'!INCLUDE "missing_{i}.md"', f'File not found: missing_{i}.md') for i in range(size)],
+            True)
+
+
+def frontmatter(size, rng):
+    return [{'id': f'item_{i}', 'cvss': round(rng.uniform(0, 10), 1), 'owner': f'person {rng.randint(1, 20)}',
+             'status': rng.choice(['open', 'closed', 'blocked']), 'tags': ['a', 'b', f'c{i}']}
+            for i in range(size)], False
+
+
+TABLES = {
+    'todos': todos,
+    'errors': errors,
+    'frontmatter': frontmatter,
+}
+
+
+def best(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma separated table sizes, in rows')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per measurement, the fastest one counts')
+    args = parser.parse_args(argv)
+
+    try:
+        pandas_table([{'a': 1}])
+    except ImportError:
+        compare = False
+    else:
+        compare = True
+
+    print(f'{"table":>12} {"rows":>6} {"native":>10} {"unaligned":>10} {"pandas":>10} {"speedup":>8}')
+    for name, table in TABLES.items():
+        for size in map(int, args.sizes.split(',')):
+            data, first_row_header = table(size, random.Random(0))
+            native = best(lambda: markdown_table(data, first_row_header), args.repeat)
+            unaligned = best(lambda: markdown_table(data, first_row_header, align=False), args.repeat)
+            line = f'{name:>12} {size:>6} {native * 1000:>8.2f}ms {unaligned * 1000:>8.2f}ms'
+            if compare:
+                reference = best(lambda: pandas_table(data, first_row_header), args.repeat)
+                line += f' {reference * 1000:>8.2f}ms {reference / native:>7.1f}x'
+                if pandas_table(data, first_row_header) != markdown_table(data, first_row_header):
+                    line += '  OUTPUT DIFFERS'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+transforms.py
+-------------
+
+Compares the single merge pass transform applier against the original
+slice assignment applier on documents with a growing number of transforms,
+and the memory held by a list of Transform objects against a TransformBatch.
+
+    python -m benchmarks.transforms [--sizes 1000,10000,50000]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from MarkdownPP.Transform import Transform, TransformBatch, apply_transforms
+
+
+def apply_sequentially(data, transforms):
+    '''
+    The original Processor applier: slice assignment in descending line order
+    '''
+    data = list(data)
+    for transform in sorted(transforms, key=lambda x: x.linenum, reverse=True):
+        linenum = transform.linenum
+        lines = [transform.data] if isinstance(transform.data, str) else transform.data
+        if transform.oper == "prepend":
+            data[linenum:linenum] = lines
+        elif transform.oper == "append":
+            data[linenum+1:linenum+1] = lines
+        elif transform.oper == "swap":
+            data[linenum:linenum+1] = lines
+        elif transform.oper == "drop":
+            data[linenum:linenum+1] = []
+    return data
+
+
+def make_document(transforms, seed=0, batch=False):
+    '''
+    Builds a document of 4 lines per transform, with transforms shaped like
+    the ones TableOfContents, Comment and Error generate.
+    '''
+    data = [f'line {i}\n' for i in range(transforms * 4)]
+    return data, make_edits(data, transforms, seed, batch)
+
+
+def make_edits(data, transforms, seed=0, batch=False):
+    rng = random.Random(seed)
+    edits = TransformBatch() if batch else []
+    add = edits.add if batch else lambda *args: edits.append(Transform(*args))
+    for linenum in sorted(rng.sample(range(len(data)), transforms // 2)):
+        add(linenum, 'swap', f'# {linenum}\n')
+        add(linenum, 'prepend', f'<a name="{linenum}"></a>\n\n')
+    return edits
+
+
+def peak_memory(function, *args):
+    '''
+    Peak memory in MB allocated while running function
+    '''
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help='comma separated transform counts')
+    args = parser.parse_args(argv)
+
+    print(f'{"transforms":>10} {"lines":>8} {"sequential":>12} {"merge":>10} {"batch":>10} {"speedup":>8}'
+          f' {"objects":>10} {"batch":>10}')
+    for size in [int(s) for s in args.sizes.split(',')]:
+        data, edits = make_document(size)
+        batch = make_edits(data, size, batch=True)
+        expected, sequential = timed(apply_sequentially, data, edits)
+        result, merge = timed(apply_transforms, data, edits)
+        batch_result, batch_merge = timed(apply_transforms, data, batch)
+        assert result == expected == batch_result, 'appliers disagree'
+
+        objects_mb = peak_memory(make_edits, data, size)
+        batch_mb = peak_memory(make_edits, data, size, 0, True)
+        print(f'{size:>10} {len(data):>8} {sequential:>11.3f}s {merge:>9.3f}s {batch_merge:>9.3f}s'
+              f' {sequential / batch_merge:>7.1f}x {objects_mb:>8.1f}MB {batch_mb:>8.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
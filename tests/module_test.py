@@ -1,17 +1,29 @@
 import unittest
 import secrets
+import subprocess
+import sys
+import threading
+import time
 import yaml
 
 from MarkdownPP import MarkdownPP
 from MarkdownPP import modules as Modules
 from MarkdownPP.Common import frontmatter_storage
+from MarkdownPP.Common import PROJECT_DIR
+from MarkdownPP.Common import read_frontmatter, frontmatter_body
+from MarkdownPP.Cache import BuildCache
+from MarkdownPP.Context import BuildContext
+from MarkdownPP.Profile import Profile
+from MarkdownPP.Watch import changed, wait_for_changes, atomic_output
 
 from tempfile import NamedTemporaryFile as tmpfile
 from tempfile import TemporaryDirectory as tmpdir
 from tempfile import gettempdir
 
 from io import StringIO
-from os import path
+from os import path, listdir, makedirs
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 
 
 
@@ -114,6 +126,28 @@ class IncludeDir_Test(unittest.TestCase):
                         self.assertTrue(find in output.read())
                         output.seek(0) #TODO: figure out why INCLUDECODE is running without explicit approval
 
+    def test_includedir_expand(self):
+        '''With Include and IncludeCode running, files are expanded in place, LEVEL shifts their headers'''
+        with tmpdir() as topleveldir:
+            files = {'a.md': '# A\n\n!INCLUDE "nested.txt"\n', 'nested.txt': '## Nested\n', 'b.py': 'print()\n',
+                     'c.png': ''}
+            for name, text in files.items():
+                with open(path.join(topleveldir, name), 'w') as f:
+                    f.write(text)
+
+            output = StringIO()
+            MarkdownPP(input=StringIO(f'foobar\n!INCLUDEDIR "{topleveldir}", FORMATS (md, py, png), LEVEL 1\n'),
+                       modules=['includedir', 'include', 'includecode'], output=output)
+            self.assertEqual(output.getvalue(), f'foobar\n## A\n\n### Nested\n```\nprint()\n\n```\n'
+                                                f'![c]({path.join(topleveldir, "c.png")})\n\n')
+
+            # Left as directives for the modules that aren't running
+            output = StringIO()
+            MarkdownPP(input=StringIO(f'!INCLUDEDIR "{topleveldir}", FORMATS (md, py), LEVEL 1\n'),
+                       modules=['includedir', 'includecode'], output=output)
+            self.assertEqual(output.getvalue(), f'!INCLUDE "{path.join(topleveldir, "a.md")}", LEVEL 1\n\n'
+                                                f'```\nprint()\n\n```\n')
+
 
 
 class Include_Test(unittest.TestCase):
@@ -160,6 +194,49 @@ class Include_Test(unittest.TestCase):
 
                 self.assertEqual(output.read(), result)
 
+    def test_include_shift_setext(self):
+        '''Setext headers are shifted, along with the line after them'''
+        with tmpfile(suffix='.md', mode='w+') as testfile:
+            testfile.write('Title\n=====\ntext\n\nSection\n-------\n## Subsection\n')
+            testfile.flush()
+
+            output = StringIO()
+            MarkdownPP(input=StringIO(f'!INCLUDE "{testfile.name}", 1\n'), modules=['include'], output=output)
+            self.assertEqual(output.getvalue(), 'Title\n-----\ntext\n\n### Section\n### Subsection\n')
+
+            output = StringIO()
+            MarkdownPP(input=StringIO(f'!INCLUDE "{testfile.name}", 2\n'), modules=['include'], output=output)
+            self.assertEqual(output.getvalue(), '### Title\ntext\n\n#### Section\n#### Subsection\n')
+
+    def test_include_cycle(self):
+        '''Include cycles, repeated includes and include limits end up as errors'''
+        with tmpdir() as dirname:
+            def write(name, text):
+                with open(path.join(dirname, name), 'w') as f:
+                    f.write(text)
+
+            def render(text, **config):
+                context = BuildContext(**config)
+                output = StringIO()
+                MarkdownPP(input=StringIO(text), modules=['include'], output=output, context=context)
+                return output.getvalue()
+
+            write('a.md', '# A\n!INCLUDE "b.md", 1\n')
+            write('b.md', '# B\n!INCLUDE "a.md"\n!INCLUDE "c.md"\n')
+            write('c.md', 'c\n')
+            text = f'!INCLUDE "{dirname}/a.md"\n!INCLUDE "{dirname}/c.md"\n'
+
+            self.assertEqual(render(text), f'# A\n## B\n!ERROR "!INCLUDE "{dirname}/a.md"" '
+                             f'<!-- !ERROR: Include cycle: {dirname}/a.md -> {dirname}/b.md -> {dirname}/a.md -->\nc\nc\n')
+            self.assertTrue(render(text, include_once=True).endswith('-->\nc\n'))
+
+            result = render(text, include_limits={'depth': 1})
+            self.assertIn('Includes nested more than 1 deep', result)
+            self.assertIn('!ERROR "!INCLUDE "', result.splitlines()[1])
+            self.assertIn('Included more than 3 lines', render(text, include_limits={'lines': 3}))
+            self.assertIn('Included more than 10 bytes', render(text, include_limits={'bytes': 10}))
+            self.assertNotIn('more than', render(text, include_limits={'lines': 7, 'bytes': 63}))
+
     def test_include_glob(self):
         '''Tests the unix path expansion in the include tag'''
         secret = secrets.token_hex(6)
@@ -212,6 +289,20 @@ class Include_Test(unittest.TestCase):
             self.assertEqual(frontmatter_storage.frontmatter[tempfile.name], yaml.safe_load(test_yaml))
 
 
+    def test_read_frontmatter(self):
+        '''The frontmatter reader stops at the closing delimiter and gives what the regex did'''
+        lines = ['---\n', 'id: a\n', 'cvss: 5\n', '---\n', '\n', '  # Title\n', 'text  \n', '\n']
+        self.assertEqual(read_frontmatter(lines), ('\nid: a\ncvss: 5\n', 4, '\n'))
+        self.assertEqual(frontmatter_body(lines, 4), ['# Title\n', 'text\n'])
+        self.assertEqual(read_frontmatter(['# Title\n', '---\n']), (None, 0, ''))
+        self.assertEqual(read_frontmatter(['---\n', 'id: a\n']), (None, 0, ''))
+
+        # Text after the closing delimiter starts the body
+        frontmatter, end, rest = read_frontmatter(['---\n', 'id: a\n', '--- text\n', '\n', 'more\n'])
+        self.assertEqual(frontmatter_body(['---\n', 'id: a\n', '--- text\n', '\n', 'more\n'], end, rest),
+                         ['text\n', '\n', 'more\n'])
+        self.assertEqual(frontmatter_body(['---\n', '---\n', '\n'], 2), ['\n'])
+
     def test_include_frontmatter_this(self):
         '''Tests replacement of `!FRONTMATTER this, ...` to `!FRONTMATTER id.$id, ...` which is handled at include time'''
         id = secrets.token_hex(4)
@@ -236,6 +327,240 @@ class Include_Test(unittest.TestCase):
             self.assertEqual(output.read(), result)
 
 
+class IncludeCache_Test(unittest.TestCase):
+
+    def tearDown(self):
+        PROJECT_DIR.CACHE = None
+
+    def render(self, text, cache_file):
+        PROJECT_DIR.CACHE = BuildCache(cache_file)
+        output = StringIO()
+        MarkdownPP(input=StringIO(text), modules=['include', 'includecode'], output=output)
+        PROJECT_DIR.CACHE.save()
+        return output.getvalue()
+
+    def test_file_cache_oversized(self):
+        '''A file larger than the cache's maxbytes is parsed but not kept, and evicts nothing'''
+        from MarkdownPP.Cache import FileCache
+
+        with tmpdir() as dirname:
+            files = FileCache(maxsize=10, maxbytes=100)
+            for i in range(5):
+                with open(path.join(dirname, f'{i}.md'), 'w') as f:
+                    f.write(f'small {i}\n')
+                self.assertEqual(files.get(path.join(dirname, f'{i}.md'), bytes.upper), f'SMALL {i}\n'.encode())
+
+            with open(path.join(dirname, 'large.md'), 'w') as f:
+                f.write('x' * 1000)
+            self.assertEqual(files.get(path.join(dirname, 'large.md'), len), 1000)
+            self.assertEqual(len(files.entries), 5)
+            self.assertEqual(files.bytes, 5 * len('small 0\n'))
+
+    def test_include_cache(self):
+        '''Unchanged include subtrees are reused from the cache, changed ones expanded again'''
+        with tmpdir() as dirname:
+            def write(name, text):
+                with open(path.join(dirname, name), 'w') as f:
+                    f.write(text)
+
+            write('a.md', '---\nid: a\n---\n# A\n!INCLUDE "b.md"\n')
+            write('b.md', 'b text\n')
+            write('c.md', '# C\n!INCLUDECODE "code.py"\n')
+            write('code.py', 'print(1)\n')
+
+            cache_file = path.join(dirname, '.mdpp-cache')
+            text = f'!INCLUDE "{dirname}/a.md"\n!INCLUDE "{dirname}/c.md", 1\n'
+            first = self.render(text, cache_file)
+            self.assertEqual(PROJECT_DIR.CACHE.hits, 0)
+
+            # Nothing changed: both top level includes and the code come from
+            # the cache, along with the frontmatter they stored
+            self.assertEqual(self.render(text, cache_file), first)
+            self.assertEqual(PROJECT_DIR.CACHE.hits, 3)
+            self.assertEqual(PROJECT_DIR.CACHE.misses, 0)
+            self.assertEqual(frontmatter_storage.frontmatter, {f'{dirname}/a.md': {'id': 'a'}})
+            self.assertIn(('file', f'{dirname}/b.md'), PROJECT_DIR.CACHE.deps)
+
+            # Only the subtree of the changed file is expanded again
+            write('b.md', 'new b text\n')
+            self.assertEqual(self.render(text, cache_file), first.replace('b text', 'new b text'))
+            self.assertEqual(PROJECT_DIR.CACHE.hits, 2)
+            self.assertEqual(PROJECT_DIR.CACHE.misses, 2)
+
+            # Files matching an include glob are picked up
+            write('d.md', 'd text\n')
+            self.assertIn('d text', self.render(f'!INCLUDE "{dirname}/[bd].md"\n', cache_file))
+            write('e.md', 'e text\n')
+            write('d.md', 'd text\n!INCLUDE "e.md"\n')
+            self.assertIn('e text', self.render(f'!INCLUDE "{dirname}/[bd].md"\n', cache_file))
+
+    def test_file_cache(self):
+        '''Included files are parsed once, until they change'''
+        units = Modules['include'].files
+        units.clear()
+        with tmpdir() as dirname:
+            filename = path.join(dirname, 'a.md')
+            with open(filename, 'w') as f:
+                f.write('---\nid: a\n---\n# A\n!FRONTMATTER this, id\n')
+
+            PROJECT_DIR.PROFILE = Profile()
+            text = f'!INCLUDE "{filename}", 1\n!INCLUDE "{filename}"\n'
+            output = StringIO()
+            MarkdownPP(input=StringIO(text), modules=['include'], output=output)
+            self.assertEqual(output.getvalue(), '## A\n!FRONTMATTER id.a, id\n# A\n!FRONTMATTER id.a, id\n')
+            self.assertEqual(PROJECT_DIR.PROFILE.stats['include']['misses'], 1)
+            self.assertEqual(PROJECT_DIR.PROFILE.stats['include']['hits'], 1)
+            PROJECT_DIR.PROFILE = None
+
+            # Shared across builds, and read again once the file changes
+            misses = units.misses
+            self.render(f'!INCLUDE "{filename}"\n', None)
+            self.assertEqual(units.misses, misses)
+            self.assertIn(('file', filename), PROJECT_DIR.CACHE.deps)
+            with open(filename, 'w') as f:
+                f.write('# B\n')
+            self.assertEqual(self.render(f'!INCLUDE "{filename}"\n', None), '# B\n')
+            self.assertEqual(units.misses, misses + 1)
+
+            # Only the least recently used files are kept
+            with open(path.join(dirname, 'b.md'), 'w') as f:
+                f.write('b text\n')
+            units.maxsize = 1
+            self.render(f'!INCLUDE "{filename}"\n!INCLUDE "{dirname}/b.md"\n', None)
+            self.assertEqual([key[0] for key in units.entries], [path.join(dirname, 'b.md')])
+            units.maxsize = 256
+
+    def test_prefetch(self):
+        '''The include tree is read ahead, level by level, and expanded in order'''
+        units = Modules['include'].files
+        units.clear()
+        with tmpdir() as dirname:
+            def write(name, text):
+                with open(path.join(dirname, name), 'w') as f:
+                    f.write(text)
+
+            write('a.md', '# A\n!INCLUDE "b*.md", 1\n')
+            write('b2.md', 'b2 text\n!INCLUDE "c.md"\n')
+            write('b1.md', 'b1 text\n!INCLUDE "a.md"\n')
+            write('c.md', 'c text\n')
+
+            include = Modules['include']()
+            include.prefetch([f'{dirname}/a.md'])
+            self.assertEqual(sorted(key[0] for key in units.entries),
+                             [path.join(dirname, name) for name in ['a.md', 'b1.md', 'b2.md', 'c.md']])
+
+            # Prefetched files count as misses when a build first uses them
+            units.clear()
+            PROJECT_DIR.PROFILE = Profile()
+            output = StringIO()
+            text = f'!INCLUDE "{dirname}/b2.md"\n!INCLUDE "{dirname}/c.md"\n'
+            MarkdownPP(input=StringIO(text), modules=['include'], output=output)
+            self.assertEqual(output.getvalue(), 'b2 text\nc text\nc text\n')
+            self.assertEqual(PROJECT_DIR.PROFILE.stats['include']['misses'], 2)
+            self.assertEqual(PROJECT_DIR.PROFILE.stats['include']['hits'], 1)
+            PROJECT_DIR.PROFILE = None
+
+    def test_watch(self):
+        '''Watching picks up changes to included files and new glob matches only'''
+        with tmpdir() as dirname:
+            def write(name, text):
+                with open(path.join(dirname, name), 'w') as f:
+                    f.write(text)
+
+            write('a.md', 'a text\n')
+            write('b.md', 'b text\n')
+            self.render(f'!INCLUDE "{dirname}/a.md"\n!INCLUDE "{dirname}/c*.md"\n', None)
+            cache, deps = PROJECT_DIR.CACHE, dict(PROJECT_DIR.CACHE.deps)
+            self.assertEqual(changed(cache, deps), [])
+            self.assertEqual(wait_for_changes(cache, deps, interval=0.01, debounce=0.01, timeout=0.05), [])
+
+            write('b.md', 'new b text\n')
+            self.assertEqual(changed(cache, deps), [])
+            write('c1.md', 'c text\n')
+            write('a.md', 'new a text\n')
+            self.assertEqual(sorted(wait_for_changes(cache, deps, interval=0.01, debounce=0.01)),
+                             [('file', f'{dirname}/a.md'), ('glob', f'{dirname}/c*.md')])
+
+    def test_watch_collect_rebuild(self):
+        '''A rebuild with --collect copies embedded images that changed again, to the same place'''
+        from MarkdownPP.main import build
+
+        with tmpdir() as dirname, tmpdir() as collect:
+            image = path.join(dirname, 'shot.png')
+            with open(image, 'wb') as f:
+                f.write(b'old image')
+            with open(path.join(dirname, 'report.mdpp'), 'w') as f:
+                f.write('# Report\n![shot](shot.png)\n')
+            context = BuildContext(input_file=path.join(dirname, 'report.mdpp'), collect=True, cache=BuildCache())
+            context.set_toplevel(collect)
+
+            def rebuild():
+                with open(context.input_file) as input:
+                    build(input, path.join(collect, 'Report.md'), ['include'], context=context)
+                with open(path.join(collect, 'Report.md')) as f:
+                    report = f.read()
+                with open(path.join(collect, 'images', 'shot.png'), 'rb') as f:
+                    return report, f.read()
+
+            report, copy = rebuild()
+            self.assertEqual(copy, b'old image')
+            with open(image, 'wb') as f:
+                f.write(b'new image!')
+            self.assertEqual(rebuild(), (report, b'new image!'))
+            self.assertEqual(listdir(path.join(collect, 'images')), ['shot.png'])
+
+    def test_watch_rebuild(self):
+        '''A rebuild includes files added to globbed and !INCLUDEDIR directories since the last build'''
+        from MarkdownPP.main import build
+
+        with tmpdir() as dirname:
+            def write(name, text):
+                makedirs(path.dirname(path.join(dirname, name)), exist_ok=True)
+                with open(path.join(dirname, name), 'w') as f:
+                    f.write(text)
+
+            write('notes/a.md', 'a text\n')
+            write('findings/1.md', 'finding 1\n')
+            write('report.mdpp', f'!INCLUDE "{dirname}/notes/*.md"\n!INCLUDEDIR "{dirname}/findings"\n')
+            output = path.join(dirname, 'report.md')
+            context = BuildContext(input_file=path.join(dirname, 'report.mdpp'), cache=BuildCache())
+            context.set_toplevel(dirname)
+
+            def rebuild():
+                with open(context.input_file) as input:
+                    build(input, output, ['includedir', 'include'], context=context)
+                with open(output) as f:
+                    return f.read()
+
+            self.assertEqual(rebuild(), 'a text\nfinding 1\n')
+            deps = dict(context.cache.deps)
+
+            write('notes/b.md', 'b text\n')
+            write('findings/2.md', 'finding 2\n')
+            self.assertEqual(sorted(kind for kind, target in wait_for_changes(context.cache, deps, interval=0.01, debounce=0.01)),
+                             ['files', 'glob'])
+            self.assertEqual(rebuild(), 'a text\nb text\nfinding 1\nfinding 2\n')
+
+    def test_atomic_output(self):
+        '''The output file is only replaced once it is completely written'''
+        with tmpdir() as dirname:
+            filename = path.join(dirname, 'out.md')
+            with open(filename, 'w') as f:
+                f.write('old\n')
+            with self.assertRaises(ValueError):
+                with atomic_output(filename) as f:
+                    f.write('half')
+                    raise ValueError
+            with open(filename) as f:
+                self.assertEqual(f.read(), 'old\n')
+            with atomic_output(filename) as f:
+                f.write('new\n')
+            with open(filename) as f:
+                self.assertEqual(f.read(), 'new\n')
+            self.assertEqual(sorted(listdir(dirname)), ['out.md'])
+
+
+
 class IncludeCode_Test(unittest.TestCase):
     test_code = '''
     def bob():
@@ -283,73 +608,341 @@ class IncludeCode_Test(unittest.TestCase):
 
             self.assertEqual(output.read(), result)
 
+    def test_includecode_symbols(self):
+        '''def:name and class:name include a definition, the file is read once for all directives'''
+        from MarkdownPP.Cache import FileCache
+        from MarkdownPP.Modules.IncludeCode import IncludeCode
+
+        code = ('import os\n\n\n@decorator\ndef exploit(target):\n    return run(target)\n\n\n'
+                'class Exploit:\n    def run(self):\n        pass\n\n\ndef run():\n    pass\n')
+        with tmpdir() as dirname:
+            filename = path.join(dirname, 'poc.py')
+            with open(filename, 'w') as f:
+                f.write(code)
+
+            files = IncludeCode.files
+            IncludeCode.files = FileCache(maxsize=4, maxbytes=len(code))
+            try:
+                input = StringIO(f'!INCLUDECODE "{filename}" (python), def:exploit\n'
+                                 f'!INCLUDECODE "{filename}", def:run\n'
+                                 f'!INCLUDECODE "{filename}", def:Exploit.run\n'
+                                 f'!INCLUDECODE "{filename}", class:Exploit\n'
+                                 f'!INCLUDECODE "{filename}", 1:1\n'
+                                 f'!INCLUDECODE "{filename}", def:missing\n')
+                output = StringIO()
+                MarkdownPP(input=input, modules=['includecode'], output=output)
+                self.assertEqual((IncludeCode.files.misses, IncludeCode.files.hits), (1, 5))
+
+                # Files larger than the cache aren't kept
+                IncludeCode.files.maxbytes = len(code) - 1
+                IncludeCode.files.clear()
+                MarkdownPP(input=StringIO(f'!INCLUDECODE "{filename}", 1:1\n'), modules=['includecode'], output=StringIO())
+                self.assertFalse(IncludeCode.files.entries)
+            finally:
+                IncludeCode.files = files
+
+        self.assertEqual(output.getvalue().split('```')[1::2], [
+            'python\n@decorator\ndef exploit(target):\n    return run(target)\n\n',
+            '\ndef run():\n    pass\n\n',
+            '\n    def run(self):\n        pass\n\n',
+            '\nclass Exploit:\n    def run(self):\n        pass\n\n',
+            '\nimport os\n\n'])
+        self.assertIn('<!-- !ERROR: No def missing found -->', output.getvalue())
+
+    def test_includecode_line_index(self):
+        '''Line ranges of large files are read through a line index, with the same result'''
+        from MarkdownPP.Lines import LineIndex
+        from MarkdownPP.Modules.IncludeCode import IncludeCode
+
+        code = ''.join(f'line {i}\n' if i % 3 else f'line {i}\r\n' for i in range(1, 101)) + 'last'
+        selections = ['', ', 1', ', 50', ', 101', ', 0', ', 10:20', ', :5', ', 95:', ', 30:10', ', 1:500']
+        with tmpdir() as dirname:
+            filename = path.join(dirname, 'capture.log')
+            with open(filename, 'w', newline='') as f:
+                f.write(code)
+            document = ''.join(f'!INCLUDECODE "{filename}"{lines}\n' for lines in selections)
+
+            def render():
+                output = StringIO()
+                MarkdownPP(input=StringIO(document), modules=['includecode'], output=output)
+                return output.getvalue()
+
+            expected = render()
+            self.assertIn('```\nline 10\nline 11\n', expected)
+            self.assertFalse(IncludeCode.indexes)
+
+            index_size, block = IncludeCode.index_size, LineIndex.BLOCK
+            IncludeCode.index_size, LineIndex.BLOCK = 0, 16
+            try:
+                self.assertEqual(render(), expected)
+                self.assertEqual(IncludeCode.indexes[filename].lines, 101)
+
+                # Lone carriage returns end lines too, those files are read in full
+                with open(filename, 'w', newline='') as f:
+                    f.write(code.replace('\r\n', '\r'))
+                self.assertEqual(render(), expected)
+                self.assertFalse(IncludeCode.indexes[filename].usable)
+            finally:
+                IncludeCode.index_size, LineIndex.BLOCK = index_size, block
+                IncludeCode.indexes.clear()
+
+    def test_includecode_line_index_threads(self):
+        '''Builds in several threads share the line indexes, which stay within their limit'''
+        from MarkdownPP.Modules.IncludeCode import IncludeCode
+
+        with tmpdir() as dirname:
+            filenames = []
+            for i in range(12):
+                filenames.append(path.join(dirname, f'capture{i}.log'))
+                with open(filenames[-1], 'w') as f:
+                    f.writelines(f'{i} line {n}\n' for n in range(1, 51))
+
+            errors = []
+            def read(offset):
+                module = IncludeCode()
+                try:
+                    for n in range(200):
+                        filename = filenames[(offset + n) % len(filenames)]
+                        self.assertEqual(module.read_lines(filename, '10:11'), [f'{filenames.index(filename)} line 10\n',
+                                                                               f'{filenames.index(filename)} line 11\n'])
+                except Exception as exc:
+                    errors.append(exc)
+
+            index_size, indexed = IncludeCode.index_size, IncludeCode.indexed
+            IncludeCode.index_size, IncludeCode.indexed = 0, 4
+            # Switch threads often, to interleave them inside line_index()
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+            try:
+                threads = [threading.Thread(target=read, args=(i,)) for i in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(errors, [])
+                self.assertLessEqual(len(IncludeCode.indexes), 4)
+            finally:
+                sys.setswitchinterval(interval)
+                IncludeCode.index_size, IncludeCode.indexed = index_size, indexed
+                IncludeCode.indexes.clear()
+
+
+
+class Server_Handler(SimpleHTTPRequestHandler):
+    '''
+    Serves the test's directory over kept alive connections, recording the
+    paths requested and the client port (one per connection) of each request
+    '''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
 
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address[1]))
+        if self.path == '/slow.md':
+            time.sleep(1)
+        super().do_GET()
 
-class IncludeUrl_Test(unittest.TestCase):
-
-    def test_includeurl_basic(self):
-        '''Test !INCLUDEURL basic functionality'''
-        from MarkdownPP.Modules import IncludeURL
-
-        test_string = b"YOU'VE GOT MAIL!"
-
-        class mock_urllib:
-            netloc = True
-            path == True
-            def readlines(self):
-                return [test_string]
+    def log_message(self, format, *args):
+        pass
 
-        # Mock urllib in the module to return what we want
-        IncludeURL.urlparse = lambda x: mock_urllib()
-        IncludeURL.urlopen = lambda x: mock_urllib()
 
-        input = StringIO(f'foobar\n!INCLUDEURL "http://127.0.0.1:8000/TEST.md"\n')
-        result =f'foobar\n{test_string.decode()}' 
+class IncludeUrl_Test(unittest.TestCase):
 
+    def setUp(self):
+        self.directory = tmpdir()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(Server_Handler, directory=self.directory.name))
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.directory.cleanup()
+
+    def serve(self, name, content):
+        with open(path.join(self.directory.name, name), 'w') as f:
+            f.write(content)
+
+    def render(self, text, context=None):
         output = StringIO()
-        mdpp = MarkdownPP(input=input, modules=['includeurl'], output=output)
-        output.seek(0)
+        MarkdownPP(input=StringIO(text), modules=['includeurl'], output=output, context=context)
+        return output.getvalue()
 
-        self.assertEqual(output.read(), result)
+    def test_includeurl_basic(self):
+        '''Test !INCLUDEURL basic functionality'''
+        test_string = "YOU'VE GOT MAIL!"
+        self.serve('TEST.md', test_string)
 
+        result = self.render(f'foobar\n!INCLUDEURL "{self.url}/TEST.md"\n')
 
+        self.assertEqual(result, f'foobar\n{test_string}')
 
     def test_includeurl_frontmatter(self):
         '''Test YAML frontmatter inclusion in !INCLUDEURL embedded file'''
-        from MarkdownPP.Modules import IncludeURL
-
-        link = 'http://127.0.0.1:8000/TEST.md'
+        link = f'{self.url}/TEST.md'
 
         test_yaml = "engineer: spy"
         test_string = "The engineer is a spy!"
+        self.serve('TEST.md', f"---\n{test_yaml}\n---\n{test_string}")
 
-        test_file = f"---\n{test_yaml}\n---\n{test_string}".encode()
-
-        class mock_urllib:
-            netloc = True
-            path = True
-            def geturl(self):
-                return link
-            def readlines(self):
-                return [test_file]
-
-        # Mock urllib in the module to return what we want
-        IncludeURL.urlparse = lambda x: mock_urllib()
-        IncludeURL.urlopen = lambda x: mock_urllib()
-
-        input = StringIO(f'foobar\n!INCLUDEURL "{link}"\n')
-        result =f'foobar\n{test_string}\n' 
-
-        output = StringIO()
-        mdpp = MarkdownPP(input=input, modules=['includeurl'], output=output)
-        output.seek(0)
+        context = BuildContext()
+        result = self.render(f'foobar\n!INCLUDEURL "{link}"\n', context)
 
         # Assume file processed correctly
-        self.assertEqual(output.read(), result)
-
-        
+        self.assertEqual(result, f'foobar\n{test_string}\n')
+        self.assertEqual(context.frontmatter[link], {'engineer': 'spy'})
+
+    def test_includeurl_nested(self):
+        '''Test nested !INCLUDEURL are fetched once each, and included in document order'''
+        self.serve('a.md', 'A1\n!INCLUDEURL "b.md"\nA2\n')
+        self.serve('b.md', 'B\n')
+        self.serve('c.md', 'C\n!INCLUDEURL "a.md"\n')
+
+        result = self.render(f'!INCLUDEURL "{self.url}/a.md"\n!INCLUDEURL "{self.url}/c.md"\n'
+                             f'!INCLUDEURL "{self.url}/a.md"\n')
+
+        self.assertEqual(result, 'A1\nB\nA2\nC\nA1\nB\nA2\nA1\nB\nA2\n')
+        paths = [request for request, port in self.server.requests]
+        self.assertEqual(sorted(paths), ['/a.md', '/b.md', '/c.md'])
+        # b.md, a level down, is fetched on a connection opened for the level above
+        self.assertEqual(paths[-1], '/b.md')
+        self.assertLess(len({port for request, port in self.server.requests}), 3)
+
+    def test_includeurl_errors(self):
+        '''Test urls that can't be fetched, or include themselves, are replaced by errors'''
+        self.serve('loop.md', 'L\n!INCLUDEURL "loop.md"\n')
+        self.serve('slow.md', 'S\n')
+
+        result = self.render(f'!INCLUDEURL "{self.url}/missing.md"\n!INCLUDEURL "{self.url}/loop.md"\n'
+                             f'!INCLUDEURL "{self.url}/slow.md"\n',
+                             BuildContext(url_timeouts={'request': 0.2}))
+
+        self.assertEqual(result, f'!ERROR "!INCLUDEURL "{self.url}/missing.md"" <!-- !ERROR: HTTP Error 404: File not found -->\n'
+                                 f'L\n!ERROR "!INCLUDEURL "loop.md"" <!-- !ERROR: {self.url}/loop.md includes itself -->\n'
+                                 f'!ERROR "!INCLUDEURL "{self.url}/slow.md"" <!-- !ERROR: timed out -->\n')
+
+    def test_includeurl_unreadable(self):
+        '''Test pages that can't be decoded or parsed become errors, and the other pages are still included'''
+        with open(path.join(self.directory.name, 'binary.md'), 'wb') as f:
+            f.write(b'\xff\xfe\x00bad\n')
+        self.serve('yaml.md', '---\nkey: [unclosed\n---\nbody\n')
+        self.serve('TEST.md', 'T\n!INCLUDEURL "binary.md"\n')
+
+        result = self.render(f'!INCLUDEURL "{self.url}/TEST.md"\n!INCLUDEURL "{self.url}/yaml.md"\n')
+
+        lines = result.splitlines()
+        self.assertEqual(lines[0], 'T')
+        self.assertRegex(lines[1], r'^!ERROR "!INCLUDEURL "binary.md"" <!-- !ERROR: .utf-8. codec can.t decode')
+        self.assertRegex(lines[2], rf'^!ERROR "!INCLUDEURL "{self.url}/yaml.md"" <!-- !ERROR: ')
+        self.assertEqual(len(lines), 3)
+
+    def test_includeurl_total_timeout(self):
+        '''Test urls not fetched in the total timeout are given up on'''
+        self.serve('slow.md', 'S\n')
+        self.serve('TEST.md', 'T\n')
+
+        start = time.monotonic()
+        result = self.render(f'!INCLUDEURL "{self.url}/TEST.md"\n!INCLUDEURL "{self.url}/slow.md"\n',
+                             BuildContext(url_timeouts={'total': 0.2}))
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(result, f'T\n!ERROR "!INCLUDEURL "{self.url}/slow.md"" <!-- !ERROR: gave up after 0.2 seconds '
+                                 "fetching the document's urls -->\n")
+
+
+class Registry_Test(unittest.TestCase):
+
+    def test_metadata(self):
+        '''Metadata read from the module sources matches the module classes'''
+        for name, info in Modules.info.items():
+            module = Modules[name]
+            self.assertEqual((info.priority, info.DEFAULT, info.REMOTE),
+                             (module.priority, module.DEFAULT, module.REMOTE))
+
+    def test_startup_imports(self):
+        '''Starting mdpp and rendering a document without math imports no heavy dependencies'''
+        code = ('import sys\n'
+                'from io import StringIO\n'
+                'from MarkdownPP.main import cli\n'
+                'from MarkdownPP import MarkdownPP\n'
+                'MarkdownPP(input=StringIO("# Title\\n!TOC\\n"), output=StringIO(),\n'
+                '           modules=["tableofcontents", "latexrender", "include", "frontmatter"])\n'
+                'print(" ".join(m for m in ("sympy", "pandas", "yaml", "PIL") if m in sys.modules))\n')
+        result = subprocess.run([sys.executable, '-c', code], cwd=path.dirname(path.dirname(path.abspath(__file__))),
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class Table_Test(unittest.TestCase):
+
+    def test_table_of_todos(self):
+        '''Tables with a header row, as !TABLE_OF_TODOS and !TABLE_OF_ERRORS make them'''
+        from MarkdownPP.Common import markdown_table
+
+        data = [('Search Me', 'TO DO'), ('1a2b3c4d5e', 'Write the summary'), ('0123456789', 'Fix it')]
+        result = ['| Search Me   | TO DO             |\n',
+                  '|:------------|:------------------|\n',
+                  '| 1a2b3c4d5e  | Write the summary |\n',
+                  '| 0123456789  | Fix it            |\n']
+        self.assertEqual(markdown_table(data, first_row_header=True), result)
+
+        result = ['| Search Me   | TO DO   |\n',
+                  '|-------------|---------|\n']
+        self.assertEqual(markdown_table(data[:1], first_row_header=True), result)
+
+    def test_frontmatter_table(self):
+        '''!FRONTMATTER tables: numbers right aligned on the decimal point, lists as html'''
+        from MarkdownPP.Modules.Frontmatter import Frontmatter
+
+        data = [{'id': 'a', 'cvss': 9.8, 'count': 12, 'refs': ['x', 'y'], 'owner': None},
+                {'id': 'bb', 'cvss': 10, 'count': '7', 'refs': 'N/A', 'owner': 'spy'}]
+        result = ['| id   |   cvss |   count | refs                          | owner   |\n',
+                  '|:-----|-------:|--------:|:------------------------------|:--------|\n',
+                  '| a    |    9.8 |      12 | <ul><li>x</li><li>y</li></ul> |         |\n',
+                  '| bb   |   10   |       7 | N/A                           | spy     |\n']
+        self.assertEqual(Frontmatter.markdown_table(data), result)
+
+    def test_missing_values(self):
+        '''Keys a row doesn't have, and None values, are blank cells rather than nan'''
+        from MarkdownPP.Common import markdown_table
+
+        data = [{'id': 'a', 'cvss': 9.8}, {'id': 'b'}, {'id': None, 'cvss': 5}]
+        result = ['| id   |   cvss |\n',
+                  '|:-----|-------:|\n',
+                  '| a    |    9.8 |\n',
+                  '| b    |        |\n',
+                  '|      |    5   |\n']
+        self.assertEqual(markdown_table(data), result)
+        self.assertEqual(markdown_table(data, align=False)[3:], ['| b |  |\n', '|  | 5 |\n'])
+
+    def test_booleans(self):
+        '''Booleans are True and False, also in columns with missing values (pandas made those 1 and 0)'''
+        from MarkdownPP.Common import markdown_table
+
+        data = [{'id': 'a', 'fixed': True}, {'id': 'b', 'fixed': False}]
+        result = ['| id   | fixed   |\n',
+                  '|:-----|:--------|\n',
+                  '| a    | True    |\n',
+                  '| b    | False   |\n']
+        self.assertEqual(markdown_table(data), result)
+
+        result = result + ['| c    |         |\n']
+        self.assertEqual(markdown_table(data + [{'id': 'c'}]), result)
+
+    def test_unaligned_table(self):
+        '''Tables without alignment padding'''
+        from MarkdownPP.Common import markdown_table
+
+        data = [{'id': 'a', 'text': 'two\nlines'}, {'id': 'bb', 'text': 1.5}]
+        result = ['| id | text |\n',
+                  '|---|---|\n',
+                  '| a | two<br>lines |\n',
+                  '| bb | 1.5 |\n']
+        self.assertEqual(markdown_table(data, align=False), result)
 
 
-    
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,530 @@
+import unittest
+import random
+import re
+import json
+import threading
+import glob
+
+from MarkdownPP import MarkdownPP
+from MarkdownPP.Processor import Processor
+from MarkdownPP.Scanner import Scanner
+from MarkdownPP.Modules.Comment import Comment
+from MarkdownPP.Modules.Error import Error
+from MarkdownPP.Modules.Frontmatter import Frontmatter
+from MarkdownPP.Modules.Reference import Reference
+from MarkdownPP.Transform import Transform, TransformBatch, apply_transforms
+from MarkdownPP.Literal import LiteralIndex, PROSE, FENCE, FENCED, INDENTED
+from MarkdownPP.Listing import DirectoryListing
+from MarkdownPP.Profile import Profile
+from MarkdownPP.Common import PROJECT_DIR, frontmatter_storage
+from MarkdownPP.Context import BuildContext
+from MarkdownPP.main import cli, destinations, render_document
+
+from io import StringIO
+from unittest import mock
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from os import path, makedirs, walk, getcwd, chdir
+from click.testing import CliRunner
+
+
+
+class Scanner_Test(unittest.TestCase):
+
+    def test_scan_counts(self):
+        '''Modules with a scanre are only handed the lines they are interested in'''
+        lines = ['Some prose\n'] * 100 + ['!COMMENT "hello"\n', '```\n', '!COMMENT "literal"\n', '```\n']
+
+        output = StringIO()
+        mdpp = MarkdownPP(input=StringIO(''.join(lines)), modules=['comment', 'error'], output=output)
+        output.seek(0)
+
+        self.assertIn('<span style="color:DodgerBlue">COMMENT: hello</span>', output.read())
+        # One comment outside of the fence, no errors at all
+        self.assertEqual(mdpp.scan_counts, {'comment': 1, 'error': 0})
+
+    def test_single_pass(self):
+        '''Unchanged data is classified once for all following modules'''
+        pp = Processor('utf-8')
+        pp.register(Frontmatter())
+        pp.register(Reference())
+        pp.input(StringIO('foo\nbar\n'))
+        pp.process()
+
+        self.assertEqual(pp.scanner.passes, 1)
+        self.assertEqual(pp.scan_counts, {'frontmatter': 0, 'reference': 0})
+        self.assertEqual(pp.data, ['foo\n', 'bar\n'])
+
+    def test_routing(self):
+        '''Only lines starting with a registered directive or prefix are tested against module regexes'''
+        class Anywhere(Comment):
+            directives = ()
+            scanre = re.compile(r'hello')
+
+        lines = ['Some prose, hello\n'] * 100 + ['!COMMENT "hello"\n', '!TOTAL\n', '[link]: http://example.com\n']
+        comment, reference, anywhere = Comment(), Reference(), Anywhere()
+        scanner = Scanner([comment, reference])
+        hits = scanner.scan(lines)
+
+        self.assertEqual(hits, {comment: [100], reference: [102]})
+        self.assertEqual(scanner.tested, 2)
+
+        # Modules that don't declare their directives see every line
+        hits = Scanner([anywhere]).scan(lines)
+        self.assertEqual(hits[anywhere], list(range(101)))
+
+
+
+class Streaming_Test(unittest.TestCase):
+
+    class LineReader:
+        '''File like object keeping track of how many lines were read'''
+        def __init__(self, lines):
+            self.lines = lines
+            self.read = 0
+
+        def __iter__(self):
+            for line in self.lines:
+                self.read += 1
+                yield line
+
+    def test_streaming_is_lazy(self):
+        '''Line local modules are streamed, nothing is read before output starts'''
+        reader = self.LineReader(['foo\n', '!COMMENT "hello"\n', '!ERROR "bar" <!-- baz -->\n'])
+        pp = Processor('utf-8')
+        pp.register(Comment())
+        pp.register(Error())
+        self.assertTrue(pp.streaming)
+
+        pp.input(reader)
+        pp.process()
+        self.assertEqual(reader.read, 0)
+
+        output = StringIO()
+        pp.output(output)
+        self.assertEqual(reader.read, 3)
+        self.assertIn('COMMENT: hello', output.getvalue())
+        self.assertIn('ERROR', output.getvalue())
+        self.assertEqual(pp.scan_counts, {'comment': 1, 'error': 1})
+
+    def test_whole_document_module_buffers(self):
+        '''A module that needs the whole document turns streaming off'''
+        pp = Processor('utf-8')
+        pp.register(Comment())
+        pp.register(Reference())
+        self.assertFalse(pp.streaming)
+
+    def test_streamed_table_of_todos(self):
+        '''A table of todos before the todos still lists them when streamed'''
+        lines = '!TABLE_OF_TODOS\nfoo\n!TODO "first"\n```\n!TODO "literal"\n```\n!TODO "second"\n'
+
+        # Nonces differ between runs, and all digit ones would align the column as numbers
+        with mock.patch('MarkdownPP.Modules.Comment.token_hex', return_value='nonce'):
+            streamed = StringIO()
+            MarkdownPP(input=StringIO(lines), modules=['comment'], output=streamed)
+            buffered = StringIO()
+            MarkdownPP(input=StringIO(lines), modules=['comment', 'reference'], output=buffered)
+
+        self.assertEqual(streamed.getvalue(), buffered.getvalue())
+        self.assertTrue(streamed.getvalue().startswith('\n**Table of TODOs**\n'))
+        self.assertIn('| first ', streamed.getvalue())
+        self.assertIn('| second ', streamed.getvalue())
+
+    def test_streamed_table_of_errors(self):
+        '''A table of errors before the errors still lists them when streamed'''
+        lines = '!TABLE_OF_ERRORS\nfoo\n!ERROR "first" <!-- !ERROR: missing -->\nbar\n'
+
+        with mock.patch('MarkdownPP.Modules.Error.token_hex', return_value='nonce'):
+            streamed = StringIO()
+            MarkdownPP(input=StringIO(lines), modules=['error'], output=streamed)
+            buffered = StringIO()
+            MarkdownPP(input=StringIO(lines), modules=['error', 'reference'], output=buffered)
+
+        self.assertEqual(streamed.getvalue(), buffered.getvalue())
+        self.assertTrue(streamed.getvalue().startswith('\n**Table of Errors**\n'))
+        self.assertRegex(streamed.getvalue(), r'\| first +\| missing +\|')
+
+
+class Profile_Test(unittest.TestCase):
+
+    def tearDown(self):
+        PROJECT_DIR.PROFILE = None
+
+    def render(self, text, modules):
+        PROJECT_DIR.PROFILE = Profile()
+        MarkdownPP(input=StringIO(text), modules=modules, output=StringIO())
+        return PROJECT_DIR.PROFILE
+
+    def test_profile(self):
+        '''Each module gets its own row, in run order'''
+        with NamedTemporaryFile('w', suffix='.py') as code:
+            code.write('print(1)\n')
+            code.flush()
+            text = f'# Title\n!COMMENT "hello"\n!INCLUDECODE "{code.name}"\n'
+            profile = self.render(text, ['includecode', 'comment', 'reference'])
+
+        self.assertEqual(list(profile.stats), ['includecode', 'reference', 'comment'])
+        self.assertEqual(profile.stats['includecode']['transforms'], 1)
+        self.assertEqual(profile.stats['includecode']['read'], len('print(1)\n'))
+        # Scanned before and after !INCLUDECODE changed the document
+        self.assertEqual(profile.stats['comment']['lines'], 2)
+        self.assertEqual(profile.totals()['read'], len('print(1)\n'))
+        self.assertIn('includecode', profile.table())
+        self.assertEqual(json.loads(profile.json())['total']['transforms'], 2)
+
+    def test_profile_streaming(self):
+        '''Streamed modules are timed without the modules feeding them'''
+        profile = self.render('Some prose\n' * 100 + '!COMMENT "hello"\n', ['comment', 'error'])
+
+        self.assertEqual(list(profile.stats), ['comment', 'error'])
+        self.assertEqual(profile.stats['comment']['lines'], 1)
+        for stats in profile.stats.values():
+            self.assertGreaterEqual(stats['wall'], 0)
+        self.assertGreaterEqual(profile.inclusive['error'][0], profile.stats['error']['wall'])
+
+
+
+class Batch_Test(unittest.TestCase):
+
+    def tearDown(self):
+        PROJECT_DIR.INPUT_FILE = ''
+        PROJECT_DIR.CACHE = None
+
+    def test_destinations(self):
+        '''Outputs mirror the inputs below their common directory'''
+        documents = destinations(['/a/b/one.mdpp', '/a/b/c/two.md'], '/out', False)
+        self.assertEqual(documents, [('/a/b/one.mdpp', '/out/one.md'), ('/a/b/c/two.md', '/out/c/two.md')])
+        documents = destinations(['/a/b/one.mdpp'], '/out', True)
+        self.assertEqual(documents, [('/a/b/one.mdpp', '/out/one/Report.md')])
+
+    def test_batch(self):
+        '''Several inputs are rendered by a pool of workers, failures are summarised'''
+        with TemporaryDirectory() as dirname:
+            for name in ('one', 'two', 'three'):
+                with open(path.join(dirname, f'{name}.mdpp'), 'w') as f:
+                    f.write(f'!COMMENT "{name}"\n')
+
+            result = CliRunner().invoke(cli, ['-i', 'comment', '-j', '2', '-d', path.join(dirname, 'out'),
+                                              path.join(dirname, '*.mdpp')])
+            self.assertEqual(result.exit_code, 0, result.output)
+            for name in ('one', 'two', 'three'):
+                with open(path.join(dirname, 'out', f'{name}.md')) as f:
+                    self.assertIn(f'COMMENT: {name}', f.read())
+
+            # A missing input of a batch doesn't stop the others
+            self.assertEqual(render_document(path.join(dirname, 'missing.mdpp'), path.join(dirname, 'out', 'missing.md'),
+                                             False, ['comment'], False)[2][:17], 'FileNotFoundError')
+
+
+
+class BuildContext_Test(unittest.TestCase):
+
+    def render(self, dirname, name, results):
+        context = BuildContext(input_file=path.join(dirname, f'{name}.mdpp'))
+        output = StringIO()
+        text = f'!INCLUDE "{dirname}/{name}-*.md"\n!FRONTMATTER all, list(id)\n'
+        MarkdownPP(input=StringIO(text), output=output, modules=['include', 'frontmatter'], context=context)
+        results[name] = (output.getvalue(), context.frontmatter)
+
+    def test_concurrent_builds(self):
+        '''Builds running in threads at the same time keep their state apart'''
+        with TemporaryDirectory() as dirname:
+            for name in ('one', 'two'):
+                for i in range(50):
+                    with open(path.join(dirname, f'{name}-{i}.md'), 'w') as f:
+                        f.write(f'---\nid: {name}{i}\n---\n{name} {i}\n')
+
+            results = {}
+            threads = [threading.Thread(target=self.render, args=(dirname, name, results)) for name in ('one', 'two') * 4]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            for name, other in (('one', 'two'), ('two', 'one')):
+                output, frontmatter = results[name]
+                self.assertEqual(len(frontmatter), 50)
+                self.assertIn(f'{name}0', output)
+                self.assertNotIn(f'{other}0', output)
+
+    def test_legacy_globals(self):
+        '''PROJECT_DIR and frontmatter_storage configure and report on builds without a context'''
+        with NamedTemporaryFile('w', suffix='.md') as included:
+            included.write('---\nid: legacy\n---\ntext\n')
+            included.flush()
+            PROJECT_DIR.COPIED_FILES['leftover'] = 'from an earlier build'
+            mdpp = MarkdownPP(input=StringIO(f'!INCLUDE "{included.name}"\n'), output=StringIO(), modules=['include'])
+
+            self.assertEqual(frontmatter_storage.frontmatter, {included.name: {'id': 'legacy'}})
+            self.assertEqual(mdpp.context.copied_files, {})
+            self.assertIs(PROJECT_DIR.CACHE, mdpp.context.cache)
+        PROJECT_DIR.COPIED_FILES = {}
+
+
+
+class LiteralIndex_Test(unittest.TestCase):
+
+    def test_kinds(self):
+        '''Fenced, tilde fenced, blockquoted and indented code is literal, list content is not'''
+        lines = [
+            ('# Title\n', PROSE),
+            ('\n', PROSE),
+            ('    indented code\n', INDENTED),
+            ('\n', PROSE),
+            ('paragraph\n', PROSE),
+            ('    continued\n', PROSE),
+            ('- item\n', PROSE),
+            ('\n', PROSE),
+            ('    item content\n', PROSE),
+            ('~~~ {.python}\n', FENCE),
+            ('```\n', FENCED),
+            ('~~~\n', FENCE),
+            ('> ```\n', FENCE),
+            ('> !TOC\n', FENCED),
+            ('> ```\n', FENCE),
+            ('````markdown\n', FENCE),
+            ('```\n', FENCED),
+            ('````\n', FENCE),
+            ('text\n', PROSE),
+        ]
+        index = LiteralIndex([line for line, kind in lines])
+        self.assertEqual(list(index.kinds), [kind for line, kind in lines])
+        self.assertTrue(index.literal(2))
+        self.assertFalse(index.literal(8))
+        self.assertEqual(index.regions(), [(2, 3), (9, 18)])
+
+    def test_multiline_elements(self):
+        '''Tags after a code block inserted as a single element (eg by !INCLUDECODE) are processed'''
+        index = LiteralIndex(['```python\nprint("hello")\n```\n', '!COMMENT "hello"\n'])
+        self.assertEqual(list(index.kinds), [FENCE, PROSE])
+
+        with TemporaryDirectory() as directory:
+            code = path.join(directory, 'hello.py')
+            with open(code, 'w') as f:
+                f.write('print("hello")\n')
+
+            output = StringIO()
+            MarkdownPP(input=StringIO(f'!INCLUDECODE "{code}"\n!COMMENT "hello"\n'), output=output,
+                       modules=['includecode', 'comment', 'tableofcontents'])
+        self.assertIn('```\n<span style="color:DodgerBlue">COMMENT: hello</span>', output.getvalue())
+
+    def test_code_untouched(self):
+        '''Markers and headers in code blocks are left alone by whole document modules'''
+        text = '!TOC\n\n# Title\n\n~~~\n!TOC\n# Not a title\n~~~\n\n    # Not a title either\n'
+        output = StringIO()
+        MarkdownPP(input=StringIO(text), output=output, modules=['tableofcontents'])
+        result = output.getvalue()
+
+        self.assertEqual(result.count('[Title](#title)'), 1)
+        self.assertIn('~~~\n!TOC\n# Not a title\n~~~\n', result)
+
+    def test_update(self):
+        '''Updating the index after transforms gives the same index as rebuilding it'''
+        rng = random.Random(1234)
+        pool = ['text\n', '\n', '```\n', '```python\n', '~~~\n', '> ```\n', '> quote\n', '    code\n',
+                '- item\n', '```python\ncode\n```\n']
+        opers = ['prepend', 'append', 'swap', 'drop', 'noop']
+        for _ in range(500):
+            data = [rng.choice(pool) for _ in range(rng.randint(0, 12))]
+            index = LiteralIndex(data)
+            for _ in range(3):
+                transforms = [Transform(rng.randint(0, len(data)), rng.choice(opers),
+                                        [rng.choice(pool) for _ in range(rng.randint(0, 3))])
+                              for _ in range(rng.randint(0, 5))]
+                data = apply_transforms(data, transforms)
+                index.update(data, transforms)
+
+                rebuilt = LiteralIndex(data)
+                self.assertEqual(index.kinds, rebuilt.kinds)
+                self.assertEqual(index.states, rebuilt.states)
+
+
+class DirectoryListing_Test(unittest.TestCase):
+
+    def make_tree(self, dirname, names):
+        for name in names:
+            filename = path.join(dirname, name)
+            makedirs(path.dirname(filename), exist_ok=True)
+            if not name.endswith('/'):
+                with open(filename, 'w') as f:
+                    f.write(name)
+
+    def test_glob(self):
+        '''Globs match what glob.glob does, listing each directory once'''
+        with TemporaryDirectory() as dirname:
+            self.make_tree(dirname, ['a.md', 'b.md', '.hidden.md', 'c.txt', 'sub/d.md', 'sub/e.md',
+                                     'sub/deeper/f.md', 'other/g.md', 'empty/'])
+            listing = DirectoryListing()
+            patterns = ['*.md', '*', '.*', '?.md', '[ab].md', '*/*.md', '*/', 's*/*', '*/deeper/*.md',
+                        'sub/*.md', 'a.md', 'missing.md', 'missing/*.md', 'sub/deeper', '*/d.md', '**/*.md']
+            for pattern in patterns:
+                absolute = path.join(dirname, pattern)
+                self.assertEqual(sorted(listing.glob(absolute)), sorted(glob.glob(absolute)), pattern)
+            self.assertEqual(listing.scanned, 6)
+
+            # Relative patterns give relative paths
+            cwd = getcwd()
+            chdir(dirname)
+            try:
+                self.assertEqual(sorted(DirectoryListing().glob('sub/*.md')), ['sub/d.md', 'sub/e.md'])
+            finally:
+                chdir(cwd)
+
+    def test_list_files(self):
+        '''Directory listings for !INCLUDEDIR come in os.walk order'''
+        with TemporaryDirectory() as dirname:
+            self.make_tree(dirname, ['b.md', 'a.md', 'sub/d.md', 'sub/c.md', 'sub/deeper/e.md', 'z/f.md'])
+            expected = []
+            for root, dirs, files in walk(dirname):
+                expected += sorted(path.join(root, name) for name in files)
+            self.assertEqual(DirectoryListing().list_files(dirname, True), expected)
+            self.assertEqual(DirectoryListing().list_files(dirname),
+                             [path.join(dirname, 'a.md'), path.join(dirname, 'b.md')])
+            with self.assertRaises(FileNotFoundError):
+                DirectoryListing().list_files(path.join(dirname, 'missing'), True)
+
+    def test_ignore(self):
+        '''.mdppignore patterns prune traversals below them, but not literal paths'''
+        with TemporaryDirectory() as dirname:
+            self.make_tree(dirname, ['a.md', 'draft.md', 'sub/b.md', 'sub/draft.md', 'sub/old/c.md',
+                                     'sub/keep/old', 'other/old/d.md'])
+            with open(path.join(dirname, '.mdppignore'), 'w') as f:
+                f.write('# comments and blank lines are skipped\n\ndraft.md\nsub/old/\nold/\n')
+
+            listing = DirectoryListing()
+            self.assertEqual(sorted(listing.glob(path.join(dirname, '*.md'))), [path.join(dirname, 'a.md')])
+            self.assertEqual(listing.glob(path.join(dirname, 'draft.md')), [path.join(dirname, 'draft.md')])
+            self.assertEqual([path.relpath(name, dirname) for name in listing.list_files(dirname, True)],
+                             ['a.md', 'sub/b.md', 'sub/keep/old'])
+            self.assertEqual(listing.glob(path.join(dirname, '*', 'old', '*.md')), [])
+
+
+class Depfile_Test(unittest.TestCase):
+
+    def tearDown(self):
+        PROJECT_DIR.INPUT_FILE = ''
+        PROJECT_DIR.CACHE = None
+
+    def test_depfile(self):
+        '''--depfile writes a make rule of everything the report read, --list-deps prints it'''
+        with TemporaryDirectory() as dirname:
+            files = {'main.mdpp': '!INCLUDE "parts/*.md"\n\n!INCLUDECODE "code.py"\n\n!INCLUDEDIR "dir"\n\n'
+                                  '!INCLUDE "notes/*/*.md"\n',
+                     'notes/empty/.keep': '',
+                     'parts/a.md': '# A\n\n!INCLUDE "nested file.md"\n', 'parts/nested file.md': 'nested\n',
+                     'parts/b.md': '# B\n', 'code.py': 'print()\n', 'dir/c.md': 'c\n', 'unused.md': ''}
+            for name, text in files.items():
+                makedirs(path.join(dirname, path.dirname(name)), exist_ok=True)
+                with open(path.join(dirname, name), 'w') as f:
+                    f.write(text)
+
+            cwd = getcwd()
+            chdir(dirname)
+            try:
+                result = CliRunner().invoke(cli, ['main.mdpp', '-o', 'out.md', '--depfile', 'out.d'])
+                self.assertEqual(result.exit_code, 0, result.output)
+                with open('out.d') as f:
+                    rule = f.read()
+                result = CliRunner().invoke(cli, ['--list-deps', 'main.mdpp'])
+                self.assertEqual(result.exit_code, 0, result.output)
+            finally:
+                chdir(cwd)
+
+            # Globs depend on the directories they are matched in, even when nothing matched yet
+            deps = ['code.py', 'dir', 'dir/c.md', 'main.mdpp', 'notes', 'notes/empty',
+                    'parts', 'parts/a.md', 'parts/b.md', 'parts/nested file.md']
+            self.assertEqual(result.output.splitlines(), deps)
+            self.assertTrue(rule.startswith('out.md: \\\n  code.py \\\n  dir \\\n'))
+            self.assertIn('  parts/nested\\ file.md\n\n', rule)
+            self.assertTrue(rule.endswith('\nparts/nested\\ file.md:\n'))
+
+    def test_depfile_rebuild(self):
+        '''A rebuild on the same context (--watch) still names the copied images as targets'''
+        from MarkdownPP.Cache import BuildCache
+        from MarkdownPP.main import build
+
+        with TemporaryDirectory() as dirname, TemporaryDirectory() as collect:
+            with open(path.join(dirname, 'shot.png'), 'wb') as f:
+                f.write(b'image')
+            with open(path.join(dirname, 'main.mdpp'), 'w') as f:
+                f.write('![shot](shot.png)\n')
+            context = BuildContext(input_file=path.join(dirname, 'main.mdpp'), collect=True, cache=BuildCache())
+            context.set_toplevel(collect)
+            output, depfile = path.join(collect, 'Report.md'), path.join(collect, 'Report.d')
+
+            rules = []
+            for _ in range(2):
+                with open(context.input_file) as input:
+                    build(input, output, ['include'], context=context, depfile=depfile)
+                with open(depfile) as f:
+                    rules.append(f.read())
+
+            self.assertEqual(rules[1], rules[0])
+            self.assertEqual(rules[0].split(':')[0].split(), [output, path.join(collect, 'images', 'shot.png')])
+
+
+class ApplyTransforms_Test(unittest.TestCase):
+
+    @staticmethod
+    def apply_sequentially(data, transforms):
+        '''The original slice assignment applier, used as a reference'''
+        data = list(data)
+        for transform in sorted(transforms, key=lambda x: x.linenum, reverse=True):
+            linenum = transform.linenum
+            lines = [transform.data] if isinstance(transform.data, str) else transform.data
+            if transform.oper == "prepend":
+                data[linenum:linenum] = lines
+            elif transform.oper == "append":
+                data[linenum+1:linenum+1] = lines
+            elif transform.oper == "swap":
+                data[linenum:linenum+1] = lines
+            elif transform.oper == "drop":
+                data[linenum:linenum+1] = []
+        return data
+
+    def test_same_line_order(self):
+        '''Transforms on the same line apply in the order they were generated'''
+        data = ['# Title\n', 'text\n']
+        transforms = [
+            Transform(0, 'swap', '# 1\\. Title\n'),
+            Transform(0, 'prepend', '<a name="title"></a>\n\n'),
+            Transform(1, 'append', ['more\n']),
+        ]
+        self.assertEqual(apply_transforms(data, transforms),
+                         ['<a name="title"></a>\n\n', '# 1\\. Title\n', 'text\n', 'more\n'])
+
+    def test_matches_sequential(self):
+        '''The merge pass gives the same result as applying transforms one by one'''
+        rng = random.Random(1234)
+        opers = ['prepend', 'append', 'swap', 'drop', 'noop']
+        for _ in range(500):
+            data = [f'{i}\n' for i in range(rng.randint(0, 12))]
+            transforms = []
+            for t in range(rng.randint(0, 10)):
+                lines = [f'{t}.{n}\n' for n in range(rng.randint(0, 3))]
+                transforms.append(Transform(rng.randint(0, len(data)), rng.choice(opers),
+                                            lines[0] if len(lines) == 1 else lines))
+
+            self.assertEqual(apply_transforms(data, transforms),
+                             self.apply_sequentially(data, transforms))
+            self.assertEqual(apply_transforms(data, TransformBatch(transforms)),
+                             self.apply_sequentially(data, transforms))
+
+    def test_batch(self):
+        '''TransformBatch stores transforms in columns and yields them back as Transforms'''
+        batch = TransformBatch()
+        batch.add(3, 'swap', 'foo\n')
+        batch.add(1, 'drop')
+        batch.extend([Transform(2, 'append', ['bar\n'])])
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(list(batch.linenums), [3, 1, 2])
+        self.assertEqual([str(t) for t in batch],
+                         [str(Transform(3, 'swap', 'foo\n')), str(Transform(1, 'drop')),
+                          str(Transform(2, 'append', ['bar\n']))])
+        self.assertEqual(str(batch.pop()), str(Transform(2, 'append', ['bar\n'])))
+        self.assertEqual(len(batch), 2)
+
+
+
+if __name__ == '__main__':
+    unittest.main()